@@ -1,3 +1,6 @@
+import os
+import zipfile
+
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QGraphicsView, QGraphicsItem,
     QGraphicsScene, QGraphicsPixmapItem, QGraphicsRectItem, QGraphicsTextItem, QShortcut, QLabel,QSpinBox,
@@ -7,8 +10,12 @@ from PyQt5.QtGui import QPixmap, QPainter, QColor, QPen, QBrush, QFont, QTextOpt
 from PyQt5.QtCore import Qt
 
 from atlas.atlas_generated_window import AtlasGeneratedWindow
-from utils.controls_utils import CtrlDragMixin, is_atlas_file
+from utils.controls_utils import CtrlDragMixin, atlas_files
 from utils.meta_utils import MetaUtils
+from utils.import_utils import ImageImportTask, collect_image_files, format_skipped_summary, normalize_path
+from utils.watch_utils import AssetFolderWatcher
+from utils.bundle_utils import load_bundle_handles
+from utils.image_handle_utils import ImageHandle, as_handle
 
 
 class AtlasCreatorView(QGraphicsView, CtrlDragMixin):
@@ -25,7 +32,7 @@ class AtlasCreatorView(QGraphicsView, CtrlDragMixin):
         self.item_map = {}
 
         self.tile_size = 96
-        self.selected_pixmaps = set()
+        self.selected_handles = set()
 
     def mouseMoveEvent(self, event):
         self.handle_drag_move(event)
@@ -35,7 +42,7 @@ class AtlasCreatorView(QGraphicsView, CtrlDragMixin):
         self.handle_drag_release(event)
         super().mouseReleaseEvent(event)
 
-    def show_images(self, images, paths, start_idx):
+    def show_images(self, handles, paths, start_idx, thumbnails=None):
         spacing = 40
         fixed_size = self.tile_size
 
@@ -44,10 +51,9 @@ class AtlasCreatorView(QGraphicsView, CtrlDragMixin):
 
         x_offset = self.last_offset
 
-        for idx, (pixmap, path) in enumerate(zip(images, paths), start=start_idx):
+        for idx, (handle, path) in enumerate(zip(handles, paths), start=start_idx):
             name = path.split("/")[-1]
             group = {}
-            group.setFlag(QGraphicsItem.ItemIsMovable, True)
 
 
             # --- Riquadro base
@@ -56,8 +62,13 @@ class AtlasCreatorView(QGraphicsView, CtrlDragMixin):
             rect.setPen(QPen(QColor(150, 150, 150)))
             rect.setZValue(0)
 
-            # --- Immagine
-            scaled = pixmap.scaled(fixed_size, fixed_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            # --- Immagine (miniatura già pronta se arriva dall'import parallelo)
+            if thumbnails is not None:
+                scaled = thumbnails[idx - start_idx]
+            else:
+                # Decodifica solo per la miniatura: l'immagine intera non resta nella view
+                scaled = handle.load_pixmap().scaled(fixed_size, fixed_size, Qt.KeepAspectRatio,
+                                                     Qt.SmoothTransformation)
             img_item = QGraphicsPixmapItem(scaled)
             dx = (fixed_size - scaled.width()) / 2
             dy = (fixed_size - scaled.height()) / 2
@@ -78,6 +89,7 @@ class AtlasCreatorView(QGraphicsView, CtrlDragMixin):
             group_item = self.scene.createItemGroup([rect, img_item, text_item])
             group_item.setPos(x_offset, 0)
             group_item.setZValue(3)
+            group_item.setFlag(QGraphicsItem.ItemIsMovable, True)
 
             # --- Highlight selezione (invisibile di default)
             highlight = QGraphicsRectItem(0, 0, fixed_size, fixed_size)
@@ -89,7 +101,7 @@ class AtlasCreatorView(QGraphicsView, CtrlDragMixin):
 
             # --- Registra tutto
             group["rect"] = rect
-            group["pixmap"] = pixmap
+            group["handle"] = handle
             group["path"] = path
             group["group"] = group_item
             group["highlight"] = highlight
@@ -114,13 +126,13 @@ class AtlasCreatorView(QGraphicsView, CtrlDragMixin):
             for item in items:
                 if item in self.item_map:
                     group = self.item_map[item]
-                    pixmap = group['pixmap']
-                    if pixmap in self.selected_pixmaps:
+                    handle = group['handle']
+                    if handle in self.selected_handles:
                         group['highlight'].setVisible(False)
-                        self.selected_pixmaps.remove(pixmap)
+                        self.selected_handles.remove(handle)
                     else:
                         group['highlight'].setVisible(True)
-                        self.selected_pixmaps.add(pixmap)
+                        self.selected_handles.add(handle)
                     return
 
         self.handle_drag_press(event)
@@ -156,13 +168,17 @@ class AtlasCreator(QWidget):
 
         self.resize(600, 400)
 
-        self.loaded_images = []
+        # Handle leggeri (path, dimensioni, hash): i pixel si decodificano solo quando servono
+        self.loaded_handles = []
         self.loaded_names = []
+        self.loaded_hashes = {}
+        self.import_tasks = []
+        self.watcher = None
 
         if initial_image:
-            pixmap = QPixmap(initial_image)
-            if not pixmap.isNull():
-                self.loaded_images.append(pixmap)
+            handle = ImageHandle.from_file(initial_image)
+            if not handle.is_null():
+                self.loaded_handles.append(handle)
                 self.loaded_names.append(initial_image)
 
         self.view = AtlasCreatorView()
@@ -187,6 +203,18 @@ class AtlasCreator(QWidget):
         self.load_button.setFixedWidth(100)
         self.load_button.clicked.connect(self.load_images)
 
+        self.import_folder_button = QPushButton("Importa cartella")
+        self.import_folder_button.setFixedWidth(100)
+        self.import_folder_button.clicked.connect(lambda: self.import_folder())
+
+        self.watch_button = QPushButton("Osserva cartella")
+        self.watch_button.setCheckable(True)
+        self.watch_button.setFixedWidth(100)
+        self.watch_button.clicked.connect(self.toggle_watch)
+
+        self.import_status_label = QLabel("")
+        self.import_status_label.setAlignment(Qt.AlignCenter)
+
         self.delete_button = QPushButton("Elimina immagini")
         self.delete_button.setFixedWidth(100)
         self.delete_button.clicked.connect(self.delete_selected_images)
@@ -237,6 +265,8 @@ class AtlasCreator(QWidget):
 
         btn_layout = QHBoxLayout()
         btn_layout.addWidget(self.load_button)
+        btn_layout.addWidget(self.import_folder_button)
+        btn_layout.addWidget(self.watch_button)
         btn_layout.addWidget(self.delete_button)
         btn_layout.addWidget(self.toggle_all_button)
         btn_layout.setAlignment(Qt.AlignCenter)
@@ -244,61 +274,231 @@ class AtlasCreator(QWidget):
         layout = QVBoxLayout()
         layout.addWidget(self.mode_label)
         layout.addWidget(self.view)
+        layout.addWidget(self.import_status_label)
         layout.addLayout(btn_layout)   
         layout.addLayout(controls_layout)
         self.setLayout(layout)
 
 
     def load_images(self):
-        pixmaps = []
-        files, _ = QFileDialog.getOpenFileNames(self, "Seleziona immagini", "", "Immagini (*.png *.jpg *.jpeg *.bmp)")
+        files, _ = QFileDialog.getOpenFileNames(
+            self, "Seleziona immagini", "", "Immagini (*.png *.jpg *.jpeg *.bmp);;Bundle tile (*.zip)"
+        )
         if not files:
             return
-        
-        for file in files:
-            if file in self.loaded_names:
-                QMessageBox.warning(self, "Errore", f"L'immagine '{file}' è già stata caricata.")
-                continue
-            if is_atlas_file(file):
-                QMessageBox.warning(self, "Non consentito", f"Non è possibile caricare file atlas.\n{file}")
-                continue
-            pixmap = QPixmap(file)
-            pixmaps.append(pixmap)
-
-        self.load_images_from_pixmaps_and_paths(pixmaps, files)
 
+        # I bundle si leggono direttamente dallo zip, senza estrarli
+        invalid = []
+        for bundle in [file for file in files if file.lower().endswith(".zip")]:
+            try:
+                handles, names = load_bundle_handles(bundle)
+            except (zipfile.BadZipFile, KeyError, ValueError, OSError) as e:
+                invalid.append(f"{os.path.basename(bundle)}: {e}")
+                continue
+            self.load_images_from_pixmaps_and_paths(handles, [f"{bundle}/{name}" for name in names])
+        if invalid:
+            QMessageBox.warning(self, "Bundle non valido", "Impossibile leggere:\n\n" + "\n".join(invalid))
+
+        images = [file for file in files if not file.lower().endswith(".zip")]
+        if images:
+            self.import_files(images)
+
+    def import_folder(self, folder=None, pattern="*"):
+        if not folder:
+            folder = QFileDialog.getExistingDirectory(self, "Seleziona cartella")
+        if not folder:
+            return
+        self.import_files(collect_image_files(folder, pattern))
+
+    def import_files(self, files, replace_paths=(), on_finished=None, quiet=False):
+        self._prepare_insert_offset()
+
+        # I path da sostituire (file modificati) non contano come duplicati
+        replace_paths = set(replace_paths)
+        in_flight = [path for task in self.import_tasks for path in task.files]
+        known_paths = [path for path in self.loaded_names if path not in replace_paths] + in_flight
+        known_hashes = [digest for path, digest in self.loaded_hashes.items() if path not in replace_paths]
+
+        # Decodifica in parallelo, le immagini arrivano a blocchi man mano che sono pronte
+        task = ImageImportTask(
+            files,
+            known_paths=known_paths,
+            known_hashes=known_hashes,
+            update_paths=replace_paths,
+            thumb_size=self.view.tile_size,
+            parent=self
+        )
+        task.batch_ready.connect(self._on_import_batch)
+        task.progress.connect(self._on_import_progress)
+        task.finished.connect(lambda skipped: self._on_import_finished(task, skipped, on_finished, quiet))
+        task.aborted.connect(lambda: self._on_import_finished(task, {}, quiet=True))
+        self.import_tasks.append(task)
+        task.start()
+        return task
+
+    def _on_import_batch(self, batch):
+        new_batch = []
+        for path, digest, handle, thumb in batch:
+            self.loaded_hashes[path] = digest
+            if self.watcher:
+                self.watcher.remember(path, digest)
+            group = self._find_item(path)
+            if group:
+                self._replace_item_handle(group, handle, thumb)
+            else:
+                new_batch.append((path, handle, thumb))
+
+        if not new_batch:
+            return
 
-    def delete_selected_images(self): 
-        to_remove = []
+        paths = [path for path, _, _ in new_batch]
+        handles = [handle for _, handle, _ in new_batch]
+        thumbnails = [thumb for _, _, thumb in new_batch]
+
+        start_idx = len(self.loaded_handles)
+        self.loaded_handles.extend(handles)
+        self.loaded_names.extend(paths)
+        self.view.show_images(handles, paths, start_idx, thumbnails=thumbnails)
+
+    def _on_import_progress(self, done, total):
+        self.import_status_label.setText(f"Importazione: {done}/{total}")
+
+    def _on_import_finished(self, task, skipped, on_finished=None, quiet=False):
+        if task in self.import_tasks:
+            self.import_tasks.remove(task)
+        if not self.import_tasks:
+            self.import_status_label.setText("")
+        if on_finished:
+            on_finished()
+        if skipped and not quiet:
+            QMessageBox.information(self, "Importazione completata",
+                                    "Alcuni file sono stati scartati:\n\n" + format_skipped_summary(skipped))
+
+    def _find_item(self, path):
         for item in self.view.image_items:
-            is_visible = item["highlight"].isVisible()
-            if is_visible:
-                to_remove.append(item)
-
-        for item in to_remove:
+            if item["path"] == path:
+                return item
+        return None
+
+    def _replace_item_handle(self, group, handle, thumb):
+        old_handle = group["handle"]
+        if old_handle in self.view.selected_handles:
+            self.view.selected_handles.remove(old_handle)
+            self.view.selected_handles.add(handle)
+        if old_handle in self.loaded_handles:
+            self.loaded_handles[self.loaded_handles.index(old_handle)] = handle
+
+        for child in group["group"].childItems():
+            if isinstance(child, QGraphicsPixmapItem):
+                fixed_size = self.view.tile_size
+                child.setPixmap(thumb)
+                child.setOffset((fixed_size - thumb.width()) / 2, (fixed_size - thumb.height()) / 2)
+        group["handle"] = handle
+
+    def _remove_items(self, items):
+        for item in items:
             self.view.scene.removeItem(item["group"])
             self.view.image_items.remove(item)
 
             if item["path"] in self.loaded_names:
                 self.loaded_names.remove(item["path"])
+            self.loaded_hashes.pop(item["path"], None)
 
-            if item["pixmap"] in self.view.selected_pixmaps:
-                self.view.selected_pixmaps.remove(item["pixmap"])
+            if item["handle"] in self.loaded_handles:
+                self.loaded_handles.remove(item["handle"])
+
+            if item["handle"] in self.view.selected_handles:
+                self.view.selected_handles.remove(item["handle"])
 
         self.view.relayout_images()
 
+    def toggle_watch(self):
+        if self.watcher:
+            self.watcher.stop()
+            self.watcher = None
+
+        if not self.watch_button.isChecked():
+            self.watch_button.setText("Osserva cartella")
+            return
+
+        folder = QFileDialog.getExistingDirectory(self, "Cartella da osservare")
+        if not folder:
+            self.watch_button.setChecked(False)
+            return
+
+        self.watch_folder(folder)
+
+    def watch_folder(self, folder, pattern="*"):
+        self.watch_button.setChecked(True)
+        self.watch_button.setText("Stop osserva")
+
+        self.watcher = AssetFolderWatcher(folder, pattern, parent=self)
+        self.watcher.changes_detected.connect(self._on_folder_changes)
+        self.watcher.start(known=self.loaded_hashes)
+
+        # Solo i file della cartella non ancora caricati, senza riepilogo
+        loaded = {normalize_path(path) for path in self.loaded_names}
+        new_files = [path for path in sorted(self.watcher.snapshot) if normalize_path(path) not in loaded]
+        if new_files:
+            self.import_files(new_files, quiet=True)
+
+    def _on_folder_changes(self, added, modified, removed):
+        removed_items = [item for item in (self._find_item(path) for path in removed) if item]
+        self._remove_items(removed_items)
+        if removed:
+            # Aggiunti e modificati entrano nel catalogo con l'import
+            from utils.catalog_utils import forget_files
+            forget_files(removed)
+
+        # Solo i file aggiunti o modificati vengono decodificati di nuovo
+        changed = added + modified
+        if not changed:
+            self._update_generated_atlas([], removed)
+            return
+
+        # Un file già caricato che cambia si aggiorna al suo posto, anche se ora è uguale a un altro sprite
+        self.import_files(
+            changed,
+            replace_paths=[path for path in modified if self._find_item(path)],
+            on_finished=lambda: self._update_generated_atlas(changed, removed),
+            quiet=True
+        )
+
+    def _update_generated_atlas(self, changed, removed):
+        window = getattr(self, "generated_window", None)
+        if not window or not window.isVisible():
+            return
+
+        updated = []
+        for path in changed:
+            item = self._find_item(path)
+            if item:
+                updated.append((path, item["handle"].load_image()))
+
+        window.update_images(updated, [path for path in removed if path in window.placements])
+
+
+    def delete_selected_images(self): 
+        to_remove = []
+        for item in self.view.image_items:
+            is_visible = item["highlight"].isVisible()
+            if is_visible:
+                to_remove.append(item)
+
+        self._remove_items(to_remove)
+
 
     def toggle_all_images(self):
         if self.toggle_all_button.isChecked():
             for item in self.view.image_items:
                 item["highlight"].setVisible(True)
-                self.view.selected_pixmaps.add(item["pixmap"])
+                self.view.selected_handles.add(item["handle"])
 
             self.toggle_all_button.setText("Deseleziona Tutto")
         else:
             for item in self.view.image_items:
                 item["highlight"].setVisible(False)
-                self.view.selected_pixmaps.clear()
+                self.view.selected_handles.clear()
 
             self.toggle_all_button.setText("Seleziona Tutto")
 
@@ -312,64 +512,71 @@ class AtlasCreator(QWidget):
         if hasattr(self, 'atlas_window') and self.atlas_window:
             self.atlas_window.close()
 
-        pixmaps = list(self.view.selected_pixmaps)
+        # Solo handle: la finestra decodifica e disegna uno sprite alla volta
+        selected = [item for item in self.view.image_items if item["handle"] in self.view.selected_handles]
+        handles = [item["handle"] for item in selected]
+        paths = [item["path"] for item in selected]
 
         if self.edit_mode:
             meta = MetaUtils.load_meta(self.atlas_path)
             end_tile = meta.get("end_tile", [2, 2]) if meta else [2, 2]
             self.generated_window = AtlasGeneratedWindow(
-                tile_size, cols, rows, images_to_insert=pixmaps, 
+                tile_size, cols, rows, images_to_insert=handles, 
                 edit_mdode=True, base_atlas=self.atlas_path, 
-                end_tile=end_tile
+                end_tile=end_tile, image_paths=paths
             )
         else:
             self.generated_window = AtlasGeneratedWindow(
                 tile_size, cols, rows,
-                images_to_insert=pixmaps,
-                edit_mdode=False
+                images_to_insert=handles,
+                edit_mdode=False, image_paths=paths
             )
 
         self.generated_window.show()
 
     def load_images_from_pixmaps_and_paths(self, pixmaps, paths):
-
-        tile_size = self.tile_size_spin.value()
-
+        # pixmaps: QPixmap/QImage (restano in memoria, non hanno un file) oppure ImageHandle
         if not pixmaps or not paths or len(pixmaps) != len(paths):
             return
 
-        new_images = []
+        new_handles = []
         new_paths = []
 
+        atlases = atlas_files(paths)
         for pixmap, path in zip(pixmaps, paths):
             if path in self.loaded_names:
                 continue
-            if pixmap.isNull():
+            if path in atlases:
                 continue
-            if is_atlas_file(path):
+            handle = as_handle(pixmap, path)
+            if handle.is_null():
                 continue
 
-            new_images.append(pixmap)
+            new_handles.append(handle)
             new_paths.append(path)
 
-        if not new_images:
+        if not new_handles:
             return
 
+        self._prepare_insert_offset()
+
+        # --- Carica immagini ---
+        start_idx = len(self.loaded_handles)
+        self.loaded_handles.extend(new_handles)
+        self.loaded_names.extend(new_paths)
+        self.view.show_images(new_handles, new_paths, start_idx)
+
+    def _prepare_insert_offset(self):
+        tile_size = self.tile_size_spin.value()
         if self.edit_mode and self.atlas_path:
             meta = MetaUtils.load_meta(self.atlas_path)
-            end_tile = meta.get("end_tile", [2, 2]) 
+            end_tile = meta.get("end_tile", [2, 2]) if meta else [2, 2]
             x_tile = end_tile[0]
             spacing = 16
-            self.view.last_offset = x_tile * tile_size + spacing
-        else:
+            self.view.last_offset = max(self.view.last_offset, x_tile * tile_size + spacing)
+        elif not self.view.image_items:
             self.view.last_offset = 0
 
-        # --- Carica immagini ---
-        start_idx = len(self.loaded_images)
-        self.loaded_images.extend(new_images)
-        self.loaded_names.extend(new_paths)
-        self.view.show_images(new_images, new_paths, start_idx)
-
 
     
 
@@ -1,16 +1,44 @@
 import math
 from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QLabel, QGraphicsView, QGraphicsScene, QFileDialog, QMessageBox,
-                             QWidget, QGraphicsPixmapItem, QPushButton, QHBoxLayout)
+                             QWidget, QPushButton, QHBoxLayout, QInputDialog)
 from PyQt5.QtGui import QPixmap, QPainter, QColor, QImage
-from PyQt5.QtCore import Qt, QRectF
+from PyQt5.QtCore import Qt
 
-from utils.controls_utils import CtrlDragMixin, apply_zoom
+from utils.controls_utils import CtrlDragMixin, apply_zoom, INDEXED_PNG_FILTER
 from utils.grid_utils import GridOverlayItem
 from utils.meta_utils import MetaUtils
 import os
+from utils.profiling_utils import profiled
+from utils.job_utils import start_job
+from utils.pixel_cache_utils import load_image
+from utils.sparse_canvas_utils import SparseTileCanvas, SparseCanvasItem
+from utils.image_handle_utils import as_handle, iter_decoded
+
+# Formati di esportazione dell'atlas: filtro del dialogo -> formato
+EXPORT_PNG = "png"
+EXPORT_INDEXED = "indexed"
+EXPORT_BC1 = "BC1"
+EXPORT_BC3 = "BC3"
+EXPORT_FILTERS = {
+    "PNG Files (*.png)": EXPORT_PNG,
+    INDEXED_PNG_FILTER: EXPORT_INDEXED,
+    "DDS BC1 / DXT1 (*.dds)": EXPORT_BC1,
+    "DDS BC3 / DXT5 (*.dds)": EXPORT_BC3,
+}
+
+
+def save_canvas_job(job, canvas, path: str, export=EXPORT_PNG, quality=None, regions=None):
+    # PNG: ritorna True; gli altri formati ritornano il resoconto dell'export
+    if export == EXPORT_INDEXED:
+        return canvas.write_indexed_png(path, job)
+    if export in (EXPORT_BC1, EXPORT_BC3):
+        return canvas.write_dds(path, export, quality, regions, job=job)
+    return canvas.write_png(path, job)
+
 
 class AtlasGeneratedWindow(QWidget):
-    def __init__(self, tile_size, cols, rows, images_to_insert, edit_mdode=False, base_atlas=None, end_tile=None):
+    def __init__(self, tile_size, cols, rows, images_to_insert, edit_mdode=False, base_atlas=None, end_tile=None,
+                 image_paths=None):
         super().__init__()
         self.setWindowTitle("Atlas Generato")
         self.setMinimumSize(400, 300)
@@ -18,11 +46,22 @@ class AtlasGeneratedWindow(QWidget):
         self.tile_size = tile_size
         self.cols = cols
         self.rows = rows
-        self.images_to_insert = images_to_insert
+        self.image_paths = image_paths if image_paths is not None else [f"img_{i}" for i in range(len(images_to_insert))]
+        # QPixmap/QImage o ImageHandle: si tengono solo handle, i pixel arrivano uno alla volta durante la generazione
+        self.images_to_insert = [as_handle(image, path) for image, path in zip(images_to_insert, self.image_paths)]
         self.edit_mode = edit_mdode
         self.start_tile = [2,2]
         self.end_tile = end_tile
         self.base_atlas = base_atlas
+        self.saved_path = None
+        self.saved_export = (EXPORT_PNG, None)  # formato e qualità dell'ultimo salvataggio
+        self.canvas = None  # SparseTileCanvas, pronta a fine generazione
+
+        # sprite -> [x_tile, y_tile, tiles_wide, tiles_high]
+        self.placements = {}
+        if self.edit_mode and self.base_atlas:
+            meta = MetaUtils.load_meta(self.base_atlas)
+            self.placements = dict(meta.get("sprites", {})) if meta else {}
         self.view = AtlasGeneratedView()
 
         self.grid_button = QPushButton("Attiva Griglia")
@@ -33,7 +72,7 @@ class AtlasGeneratedWindow(QWidget):
 
         self.save_atlas_button = QPushButton("Salva")
         self.save_atlas_button.setFixedWidth(100)   
-        self.save_atlas_button.clicked.connect(self.save_atlas)
+        self.save_atlas_button.clicked.connect(lambda: self.save_atlas())
 
         self_button_layout = QHBoxLayout()
         self_button_layout.addWidget(self.grid_button)
@@ -63,100 +102,186 @@ class AtlasGeneratedWindow(QWidget):
                 self.grid_button.setText("Attiva Griglia")
 
 
+    @profiled("save_atlas", "io")
     def save_atlas(self):
-        path, _ = QFileDialog.getSaveFileName(self, "Salva Atlas", "atlas_", "PNG Files (*.png)")
-        if path:
-            success = self.view.pixmap_item.pixmap().save(path, "PNG")
-            if not success:
-                print("Errore durante il salvataggio dell'atlas.")
-            else:
-                print(f"Atlas salvato con successo in {path}")
-                MetaUtils.save_meta(
-                    image_path=path,
-                    tile_size=self.tile_size,
-                    editable=True,
-                    cols=self.cols,
-                    rows=self.rows,
-                    start_tile=self.start_tile,
-                    end_tile=getattr(self, "next_end_tile", [2, 2])
-                )
-                QMessageBox.information(self, "Salvataggio Meta Atlas", "Meta Atlas salvato con successo.")   
-
-
-    def generate_checkerboard(self, tile_size, cols, rows):      
-        width = tile_size * cols
-        height = tile_size * rows
-        image = QImage(width, height, QImage.Format_RGB32)
-        p = QPainter(image)
-
-        white = QColor(255, 255, 255)
-        light_grey = QColor(200, 200, 200)
-        black = QColor(0, 0, 0)
-
-        for row in range(rows):
-            for col in range(cols):
-                x = col * tile_size
-                y = row * tile_size
-
-                # Riga o colonna guida
-                if row == 0 or col == 0:
-                    color = black if (row + col) % 2 == 0 else white
-                else:
-                    color = light_grey if (row + col) % 2 == 0 else white
-                p.fillRect(x, y, tile_size, tile_size, color)
-        p.end()
-        return QPixmap.fromImage(image)
-    
-    
-    def insert_images_into_atlas(self, tile_size, cols, rows, pixmaps):
-        # 1. Base atlas (modifica o nuovo)
+        if self.canvas is None:
+            return
+        path, selected_filter = QFileDialog.getSaveFileName(self, "Salva Atlas", "atlas_", ";;".join(EXPORT_FILTERS))
+        if not path:
+            return
+
+        export, quality = EXPORT_FILTERS.get(selected_filter, EXPORT_PNG), None
+        if export in (EXPORT_BC1, EXPORT_BC3):
+            from utils.dds_utils import QUALITY_LABELS, QUALITY_NORMAL
+            labels = list(QUALITY_LABELS.values())
+            label, ok = QInputDialog.getItem(self, "Qualità DDS", "Compressione:", labels, QUALITY_NORMAL, False)
+            if not ok:
+                return
+            quality = labels.index(label)
+        self._start_save(path, (export, quality), owner=self, on_saved=self._on_atlas_saved)
+
+    def _start_save(self, path, saved_export, owner=None, on_saved=None):
+        # Esportazione a bande dalla tela sparsa, nel pool: la finestra resta reattiva
+        export, quality = saved_export
+        start_job(
+            save_canvas_job, self.canvas.snapshot(), path, export, quality, self._sprite_regions(),
+            owner=owner, label="Salvataggio atlas..." if owner else None, name="save_atlas_job",
+            on_result=lambda result: self._on_save_result(path, saved_export, result, on_saved or self._on_resaved)
+        )
+
+    def _on_save_result(self, path, saved_export, result, on_saved):
+        if not result:
+            print("Errore durante il salvataggio dell'atlas.")
+            return
+        on_saved(path, saved_export, result)
+
+    def _sprite_regions(self):
+        # Area in pixel di ogni sprite, per il resoconto d'errore degli export con perdita
+        ts = self.tile_size
+        return {key: (x * ts, y * ts, w * ts, h * ts) for key, (x, y, w, h) in self.placements.items()}
+
+    def _on_atlas_saved(self, path, saved_export, result):
+        print(f"Atlas salvato con successo in {path}")
+        self.saved_path = path
+        self.saved_export = saved_export
+        stats = result if isinstance(result, dict) else None
+        self._save_meta(path, stats)
+
+        message = "Meta Atlas salvato con successo."
+        if stats and "palette" in stats:
+            from utils.palette_utils import format_export_report
+            message += "\n\n" + format_export_report(stats)
+        elif stats:
+            from utils.dds_utils import format_dds_report
+            message += "\n\n" + format_dds_report(stats)
+        QMessageBox.information(self, "Salvataggio Meta Atlas", message)
+
+    def _on_resaved(self, path, saved_export, result):
+        self._save_meta(path, result if isinstance(result, dict) else None)
+
+
+    def _save_meta(self, path, stats=None):
+        MetaUtils.save_meta(
+            image_path=path,
+            tile_size=self.tile_size,
+            editable=True,
+            cols=self.cols,
+            rows=self.rows,
+            start_tile=self.start_tile,
+            end_tile=getattr(self, "next_end_tile", [2, 2]),
+            sprites=self.placements,
+            palette=stats.get("palette") if stats else None
+        )
+
+    def sprite_at(self, col, row):
+        # Hit-test: i tile liberi non appartengono a nessuno sprite
+        if self.canvas is None or not self.canvas.is_occupied(col, row):
+            return None
+        for key, (x_tile, y_tile, tiles_wide, tiles_high) in self.placements.items():
+            if x_tile <= col < x_tile + tiles_wide and y_tile <= row < y_tile + tiles_high:
+                return key
+        return None
+
+    def _place_image(self, canvas, image, tile_size, cols, cursor=None):
+        # cursor esplicito per il job di generazione, che non deve toccare lo stato della finestra
+        cursor = self._cursor if cursor is None else cursor
+        tiles_wide = math.ceil(image.width() / tile_size)
+        tiles_high = math.ceil(image.height() / tile_size)
+
+        # 3. Controlla se va a capo
+        if cursor[0] + tiles_wide > cols:
+            cursor[0] = 2  # torna all'inizio riga (salta margine)
+            cursor[1] += tiles_high + 1  # va a capo + margine
+
+        # 4. Disegna immagine: solo i tile che copre
+        x_tile, y_tile = cursor
+        canvas.draw_image(x_tile * tile_size, y_tile * tile_size, image)
+
+        # 6. Sposta cursore orizzontale per la prossima immagine
+        cursor[0] += tiles_wide + 1  # +1 per margine visivo
+        return [x_tile, y_tile, tiles_wide, tiles_high]
+
+    @profiled("pack_atlas", "pack")
+    def insert_images_into_atlas(self, tile_size, cols, rows, handles):
+        # Decodifica e disegno nel pool, uno sprite alla volta
+        self.setWindowTitle("Atlas Generato - generazione in corso...")
+        start_job(
+            self._render_atlas, tile_size, cols, rows, list(handles), list(self.image_paths),
+            owner=self, label="Generazione atlas...", name="pack_atlas_job",
+            on_result=self._apply_atlas,
+            on_cancel=lambda: self.setWindowTitle("Atlas Generato - generazione annullata")
+        )
+
+    def _render_atlas(self, job, tile_size, cols, rows, handles, keys):
+        # 1. Base atlas (modifica o nuovo): tela sparsa, in memoria solo i tile occupati
         if self.edit_mode and self.base_atlas and os.path.exists(self.base_atlas):
-            base_pixmap = QPixmap(self.base_atlas)
+            canvas = SparseTileCanvas.from_image(load_image(self.base_atlas), tile_size)
         else:
-            base_pixmap = self.generate_checkerboard(tile_size, cols, rows)
-
-        image = base_pixmap.toImage()
-        painter = QPainter(image)
+            canvas = SparseTileCanvas(tile_size * cols, tile_size * rows, tile_size)
 
         # 2. Tile iniziale per inserimento (default: 2,2)
-        current_x_tile = self.end_tile[0] if self.end_tile else 2
-        current_y_tile = self.end_tile[1] if self.end_tile else 2
+        cursor = [self.end_tile[0], self.end_tile[1]] if self.end_tile else [2, 2]
+        placements = {}
 
-        max_x_tile = current_x_tile
-        max_y_tile = current_y_tile
+        # Streaming: ogni sprite viene decodificato, disegnato e rilasciato; in memoria ci sono solo la tela
+        # e le poche immagini decodificate in anticipo
+        for index, ((_, sprite), key) in enumerate(zip(iter_decoded(handles, job=job), keys)):
+            if not sprite.isNull():
+                placements[key] = self._place_image(canvas, sprite, tile_size, cols, cursor)
+            job.report(index + 1, len(handles))
 
-        for pixmap in pixmaps:
-            if pixmap.isNull():
-                continue
+        return canvas, placements, cursor
 
-            tiles_wide = math.ceil(pixmap.width() / tile_size)
-            tiles_high = math.ceil(pixmap.height() / tile_size)
+    def _apply_atlas(self, result):
+        canvas, placements, cursor = result
+        self.placements.update(placements)
 
-            # 3. Controlla se va a capo
-            if current_x_tile + tiles_wide > cols:
-                current_x_tile = 2  # torna all'inizio riga (salta margine)
-                current_y_tile += tiles_high + 1  # va a capo + margine
+        # 7. Imposta la prossima tile disponibile come nuova end_tile
+        self._cursor = cursor
+        self.next_end_tile = list(cursor)
 
-            # 4. Disegna immagine
-            x = current_x_tile * tile_size
-            y = current_y_tile * tile_size
-            painter.drawPixmap(x, y, pixmap)
+        # 8. Mostra il nuovo atlas
+        self.canvas = canvas
+        self.view.set_canvas(canvas)
+        self.setWindowTitle("Atlas Generato")
 
-            # 5. Aggiorna fine massima usata
-            max_x_tile = max(max_x_tile, current_x_tile + tiles_wide)
-            max_y_tile = max(max_y_tile, current_y_tile + tiles_high)
+    @profiled("repack_atlas", "pack")
+    def update_images(self, updated, removed):
+        # Aggiornamento incrementale: si ridisegnano solo gli sprite toccati
+        if self.canvas is None:
+            return
 
-            # 6. Sposta cursore orizzontale per la prossima immagine
-            current_x_tile += tiles_wide + 1  # +1 per margine visivo
+        canvas = self.canvas
+        self._cursor = list(getattr(self, "next_end_tile", [2, 2]))
 
-        painter.end()
+        for key in removed:
+            slot = self.placements.pop(key, None)
+            if slot:
+                canvas.clear_tiles(*slot)
 
-        # 7. Imposta la prossima tile disponibile come nuova end_tile
-        self.next_end_tile = [current_x_tile, current_y_tile]
+        for key, image in updated:
+            if image.isNull():
+                continue
+            tiles_wide = math.ceil(image.width() / self.tile_size)
+            tiles_high = math.ceil(image.height() / self.tile_size)
+            slot = self.placements.get(key)
 
-        # 8. Mostra il nuovo atlas
-        final_pixmap = QPixmap.fromImage(image)
-        self.view.set_pixmap(final_pixmap)
+            if slot:
+                canvas.clear_tiles(*slot)
+                # Se entra ancora nel suo spazio resta dov'era
+                if tiles_wide <= slot[2] and tiles_high <= slot[3]:
+                    canvas.draw_image(slot[0] * self.tile_size, slot[1] * self.tile_size, image)
+                    self.placements[key] = [slot[0], slot[1], tiles_wide, tiles_high]
+                    continue
+
+            self.placements[key] = self._place_image(canvas, image, self.tile_size, self.cols)
+
+        self.next_end_tile = list(self._cursor)
+        self.view.canvas_item.update()
+
+        # Se l'atlas è già stato salvato lo si tiene allineato su disco
+        if self.saved_path:
+            self._start_save(self.saved_path, self.saved_export)
 
 
 
@@ -171,13 +296,17 @@ class AtlasGeneratedView(QGraphicsView, CtrlDragMixin):
         self.scene = QGraphicsScene()
         self.setScene(self.scene)
         self.image_item = None
+        self.canvas_item = None  # arriva a fine generazione
+        self.setMouseTracking(True)
 
-    def set_pixmap(self, pixmap):
-        self.pixmap_item = QGraphicsPixmapItem(pixmap)
-        self.scene.addItem(self.pixmap_item)
+    def set_canvas(self, canvas):
+        if self.canvas_item is not None:
+            self.scene.removeItem(self.canvas_item)
+        self.canvas_item = SparseCanvasItem(canvas)
+        self.scene.addItem(self.canvas_item)
 
-        self.setSceneRect(QRectF(pixmap.rect())) 
-        self.centerOn(self.pixmap_item)
+        self.setSceneRect(canvas.rect())
+        self.centerOn(self.canvas_item)
 
     def mousePressEvent(self, event):
         self.handle_drag_press(event)
@@ -185,8 +314,18 @@ class AtlasGeneratedView(QGraphicsView, CtrlDragMixin):
 
     def mouseMoveEvent(self, event):
         self.handle_drag_move(event)
+        self._update_tooltip(event)
         super().mouseMoveEvent(event)
 
+    def _update_tooltip(self, event):
+        # Nome dello sprite sotto il cursore
+        if self.canvas_item is None:
+            return
+        pos = self.mapToScene(event.pos())
+        tile = self.canvas_item.canvas.tile_at(pos.x(), pos.y())
+        key = self.window().sprite_at(*tile) if tile and hasattr(self.window(), "sprite_at") else None
+        self.setToolTip(os.path.basename(key) if key else "")
+
     def mouseReleaseEvent(self, event):
         self.handle_drag_release(event)
         super().mouseReleaseEvent(event)
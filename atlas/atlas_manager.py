@@ -1,23 +1,59 @@
 from PyQt5.QtWidgets import (QWidget, QPushButton, QHBoxLayout, QVBoxLayout, QMessageBox,
                              QGraphicsScene, QLabel, QSpinBox, QSizePolicy, QGraphicsRectItem, QShortcut)
-from PyQt5.QtGui import QPixmap, QKeySequence, QPainter, QColor
-from PyQt5.QtCore import Qt, QRectF
+from PyQt5.QtGui import QPixmap, QKeySequence, QPainter, QImage
+from PyQt5.QtCore import Qt, QRectF, pyqtSignal
 
 from utils.controls_utils import save_pixmap_dialog, ShiftDragRectSelectMixin, get_snapped_rect, is_atlas_file
 from utils.graphics_utils import load_image_with_checker
 from utils.states_utils import save_state, undo_state, redo_state, reset_state
-from utils.grid_utils import draw_grid_ui
+from utils.grid_utils import draw_grid_ui, detect_grid_ui
 from tile_splitter.tile_splitter import GridGraphicsView
 from tile_splitter.tile_splitter_executor import TileSplitterWidget
 from atlas.atlas_creator_widget import AtlasCreator 
 from utils.meta_utils import MetaUtils
+from utils.profiling_utils import profiled
+from utils.document_utils import DocumentMixin, open_document
+from utils.job_utils import start_job
+from utils.array_utils import to_argb32, qimage_view, fill_tiles, move_tiles
 
-class AtlasManagerWindow(QWidget):
+# Colori del checker usati per pulire i tile spostati
+CHECKER_LIGHT = 0xFFC8C8C8
+CHECKER_WHITE = 0xFFFFFFFF
+
+
+def _transparent_value(image: QImage) -> int:
+    # RGB32 non ha alpha: "trasparente" diventa nero opaco, come con setPixelColor
+    return 0xFF000000 if image.format() == QImage.Format_RGB32 else 0
+
+
+def erase_tiles_job(job, image: QImage, coords: set, tile_size: int):
+    image = to_argb32(image)
+    pixels = qimage_view(image)
+    value = _transparent_value(image)
+    coords = list(coords)
+    for index in range(0, len(coords), 256):
+        job.check()
+        fill_tiles(pixels, coords[index:index + 256], tile_size, value)
+        job.report(min(index + 256, len(coords)), len(coords))
+    return image
+
+
+def move_tiles_job(job, image: QImage, coords: set, offset, tile_size: int):
+    image = to_argb32(image)
+    job.check()
+    moved = move_tiles(qimage_view(image), coords, offset, tile_size,
+                       lambda x, y: CHECKER_LIGHT if (x + y) % 2 == 0 else CHECKER_WHITE)
+    job.report(1, 1)
+    return image, moved
+
+
+class AtlasManagerWindow(QWidget, DocumentMixin):
     def __init__(self, edit_mode=False):
         super().__init__()
         self.setWindowTitle("Gestione Atlas")
         self.setMinimumSize(900, 700)
         self.view = AtlasGraphicsView()
+        self.view.pixmap_edited.connect(self.document_changed)
         self.view.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.scene = QGraphicsScene(self)
         self.view.setScene(self.scene)
@@ -50,7 +86,7 @@ class AtlasManagerWindow(QWidget):
         self.load_button.clicked.connect(lambda: self.load_image())
 
         self.save_button = QPushButton("Salva")
-        self.save_button.clicked.connect(self.save_image)
+        self.save_button.clicked.connect(lambda: self.save_image())
 
         self.undo_button = QPushButton("Annulla")
         self.undo_button.clicked.connect(self.on_undo)
@@ -84,6 +120,14 @@ class AtlasManagerWindow(QWidget):
         self.grid_button.setFixedWidth(100)
         self.grid_button.clicked.connect(lambda: draw_grid_ui(self.view, self.grid_size_field, self.grid_button))
 
+        self.detect_grid_button = QPushButton("Rileva griglia")
+        self.detect_grid_button.setFixedWidth(100)
+        self.detect_grid_button.clicked.connect(
+            lambda: detect_grid_ui(self.view, self.grid_size_field, self.grid_button, self.grid_info_label)
+        )
+        self.grid_info_label = QLabel("")
+        self.grid_info_label.setAlignment(Qt.AlignCenter)
+
         self.save_selection_button = QPushButton("Salva selezione")
         self.save_selection_button.setFixedWidth(100)
         self.save_selection_button.clicked.connect(lambda: self.save_selection())
@@ -92,6 +136,7 @@ class AtlasManagerWindow(QWidget):
         grid_layout.addWidget(grid_label)
         grid_layout.addWidget(self.grid_size_field)
         grid_layout.addWidget(self.grid_button)
+        grid_layout.addWidget(self.detect_grid_button)
         grid_layout.addWidget(self.save_selection_button)
         grid_layout.setAlignment(Qt.AlignCenter)
 
@@ -101,6 +146,7 @@ class AtlasManagerWindow(QWidget):
         main_layout.addLayout(top_bar_layout)
         main_layout.addWidget(self.view, stretch=1)
         main_layout.addLayout(grid_layout)
+        main_layout.addWidget(self.grid_info_label)
         main_layout.addLayout(button_layout)
         self.setLayout(main_layout)
 
@@ -153,6 +199,7 @@ class AtlasManagerWindow(QWidget):
             self.redo_stack,
             self.view.restore_selection
         )
+        self.document_changed()
         
 
     def on_redo(self):
@@ -163,20 +210,44 @@ class AtlasManagerWindow(QWidget):
             self.redo_stack,
             self.view.restore_selection
         )
+        self.document_changed()
         
     def on_reset(self):
         reset_state(
             self.view.pixmap_item,
-            self.original_pixmap,
+            self.original_base,
             self.view.selected_coords,
             self.undo_stack,
             self.redo_stack,
             self.view.restore_selection
         )
+        self.document_changed()
 
-        
+    def on_document_changed(self):
+        # Modifica fatta da un'altra finestra sullo stesso documento
+        if self.view.pixmap_item is not None:
+            self.view.pixmap_item.setPixmap(self.document.pixmap())
+
+    def closeEvent(self, event):
+        self.detach_document()
+        super().closeEvent(event)
+
+    def set_document(self, document):
+        pixmap_item = load_image_with_checker(
+            view=self.view,
+            scene=self.scene,
+            pixmap=document.pixmap(),
+            parent=self,
+            tile_size=16
+        )
+        if pixmap_item:
+            pixmap_item.path = document.path
+            self.attach_document(document)
+            self._show_pixmap_item(pixmap_item)
+
+    @profiled("atlas_manager.load_image", "io")
     def load_image(self, pixmap: QPixmap = None):
-        self.pixmap = load_image_with_checker(
+        pixmap_item = load_image_with_checker(
             view=self.view,
             scene=self.scene,
             pixmap=pixmap,
@@ -184,37 +255,30 @@ class AtlasManagerWindow(QWidget):
             tile_size=16
         )
 
-        if self.pixmap:
-            self.view.pixmap_item = self.pixmap
-            self.original_pixmap = self.view.pixmap_item.pixmap().copy()
-            self.view.setSceneRect(QRectF(self.pixmap.pixmap().rect()))
-            self.undo_stack.clear()
-            self.redo_stack.clear()
+        if pixmap_item:
+            document = open_document(pixmap_item.pixmap(), pixmap_item.path)
+            pixmap_item.setPixmap(document.pixmap())
+            self.attach_document(document)
+            self._show_pixmap_item(pixmap_item)
 
-            save_state(
-                self.view.pixmap_item,
-                self.view.selected_coords,
-                self.undo_stack,
-                self.redo_stack
-            )
+    def _show_pixmap_item(self, pixmap_item):
+        self.pixmap = pixmap_item
+        self.view.pixmap_item = self.pixmap
+        self.view.setSceneRect(QRectF(self.pixmap.pixmap().rect()))
 
-            if hasattr(self.pixmap, "path"):
+        # se l'img caricata ha prefisso 
+        self.edit_mode = is_atlas_file(self.pixmap.path)
 
-                # se l'img caricata ha prefisso 
-                self.edit_mode = is_atlas_file(self.pixmap.path)
-
-                # modalità Edit attiva
-                if is_atlas_file(self.pixmap.path):
-                    self.atlas_creator_button.setText("Modifica Atlas")
-                    self.mode_label.setText("🟢 MODIFICA")
-                else:
-                    self.atlas_creator_button.setText("Crea Atlas")
-                    self.mode_label.setText("⚪ NUOVO")
-                 
-            else:
-                self.pixmap.path = getattr(self.view.pixmap_item, "path", None)
+        # modalità Edit attiva
+        if self.edit_mode:
+            self.atlas_creator_button.setText("Modifica Atlas")
+            self.mode_label.setText("🟢 MODIFICA")
+        else:
+            self.atlas_creator_button.setText("Crea Atlas")
+            self.mode_label.setText("⚪ NUOVO")
 
 
+    @profiled("atlas_manager.save_selection", "io")
     def save_selection(self, rect: QRectF = None):
         tile_size = self.grid_size_field.value()
         source_pixmap = self.view.pixmap_item.pixmap()
@@ -267,29 +331,30 @@ class AtlasManagerWindow(QWidget):
         save_pixmap_dialog(self, final_pixmap, "selezione_atlas")
 
     
+    @profiled("atlas_manager.save_image", "io")
     def save_image(self):
         if self.view.pixmap_item is None:
             return
 
         pixmap = self.view.pixmap_item.pixmap()
-        path = save_pixmap_dialog(self, pixmap, "atlas_")
-        if not path:
-            return
+        save_pixmap_dialog(self, pixmap, "atlas_", on_saved=self._save_image_meta)
 
+    def _save_image_meta(self, path, stats):
         # Recupera i dati da UI
         tile_size = self.grid_size_field.value()
 
         MetaUtils.save_meta(
             path, 
             tile_size, 
-            editable=True
+            editable=True,
+            palette=stats["palette"] if stats else None
         )
 
-        QMessageBox.information(self, "Salvato", "Meta salvato con successo.")
-
 
 
 class AtlasGraphicsView(GridGraphicsView, ShiftDragRectSelectMixin):
+    pixmap_edited = pyqtSignal()
+
     def __init__(self):
         super().__init__()
         self.selection_rect_item: QGraphicsRectItem = None
@@ -388,67 +453,52 @@ class AtlasGraphicsView(GridGraphicsView, ShiftDragRectSelectMixin):
         super().mouseReleaseEvent(event)
 
 
+    @profiled("move_tiles", "tiles")
     def _move_selected_tiles_to(self, target_tile_x: int, target_tile_y: int):
         if not self.pixmap_item or not self.selected_coords:
             return
 
-        tile_size = self.tile_size
-        source = self.pixmap_item.pixmap()
-        image = source.toImage()
-
         # Bounding box della selezione corrente
         min_x = min(x for x, _ in self.selected_coords)
         min_y = min(y for _, y in self.selected_coords)
-        width = max(x for x, _ in self.selected_coords) - min_x + 1
-        height = max(y for _, y in self.selected_coords) - min_y + 1
 
         # Calcolo offset reale
-        offset_x = target_tile_x - min_x
-        offset_y = target_tile_y - min_y
+        offset = (target_tile_x - min_x, target_tile_y - min_y)
+
+        revision, selection = self._revision(), set(self.selected_coords)
+        start_job(
+            move_tiles_job, self.pixmap_item.pixmap().toImage(), selection, offset, self.tile_size,
+            owner=self, label="Spostamento tile...", name="move_tiles_job",
+            on_result=lambda result: self._apply_moved_tiles(result, revision, selection)
+        )
 
-        # Salva stato prima dello spostamento
+    def _revision(self):
+        # Revisione del documento: lo stato in cima allo stack di undo, che cambia a ogni modifica, undo o redo
+        stack = getattr(self.window(), "undo_stack", None)
+        return stack[-1] if stack else None
+
+    def _save_pre_edit_state(self, revision, selection) -> bool:
+        # Al risultato di un job: False se nel frattempo il documento è cambiato (undo, altra modifica) e il
+        # risultato va scartato. Lo stato di prima si salva solo qui, così un job rifiutato o annullato
+        # non lascia voci di undo
+        if not self.pixmap_item or self._revision() is not revision:
+            return False
         if hasattr(self.window(), "undo_stack"):
             save_state(
                 self.pixmap_item,
-                self.selected_coords,
+                selection,
                 self.window().undo_stack,
                 self.window().redo_stack
             )
+        return True
 
-        # Crea nuova immagine con i tile spostati
-        new_image = image.copy()
-
-        new_selected = set()
-
-        for x, y in self.selected_coords:
-            px = x * tile_size
-            py = y * tile_size
-            tile = image.copy(px, py, tile_size, tile_size)
-
-            new_x = x + offset_x
-            new_y = y + offset_y
-
-            dest_x = new_x * tile_size
-            dest_y = new_y * tile_size
-
-            # Pulisce tile vecchio
-            color1 = QColor(200, 200, 200)
-            color2 = QColor(255, 255, 255)
-            for dx in range(tile_size):
-                for dy in range(tile_size):
-                    checker_color = color1 if ((x + dx // tile_size) + (y + dy // tile_size)) % 2 == 0 else color2
-                    new_image.setPixelColor(px + dx, py + dy, checker_color)
-
-            # Copia tile nuovo
-            for dx in range(tile_size):
-                for dy in range(tile_size):
-                    color = tile.pixelColor(dx, dy)
-                    new_image.setPixelColor(dest_x + dx, dest_y + dy, color)
-
-            new_selected.add((new_x, new_y))
+    def _apply_moved_tiles(self, result, revision=None, selection=()):
+        image, new_selected = result
+        if not self._save_pre_edit_state(revision, selection):
+            return
 
         # Applica nuova immagine
-        self.pixmap_item.setPixmap(QPixmap.fromImage(new_image))
+        self.pixmap_item.setPixmap(QPixmap.fromImage(image))
 
         # Pulisce selezione vecchia visiva
         for coord in list(self.selected_coords):
@@ -463,6 +513,16 @@ class AtlasGraphicsView(GridGraphicsView, ShiftDragRectSelectMixin):
 
         self.viewport().update()
 
+        # Anche lo stato dopo lo spostamento: la cima dello stack è sempre l'immagine corrente
+        if hasattr(self.window(), "undo_stack"):
+            save_state(
+                self.pixmap_item,
+                self.selected_coords,
+                self.window().undo_stack,
+                self.window().redo_stack
+            )
+        self.pixmap_edited.emit()
+
     def _create_drag_preview(self):
         tile_size = self.tile_size
         coords = sorted(self.selected_coords)
@@ -503,6 +563,7 @@ class AtlasGraphicsView(GridGraphicsView, ShiftDragRectSelectMixin):
             super().keyPressEvent(event)
 
 
+    @profiled("select_tiles", "selection")
     def select_tiles_in_rect(self, rect: QRectF):
         self.last_selection_rect = rect
 
@@ -532,30 +593,24 @@ class AtlasGraphicsView(GridGraphicsView, ShiftDragRectSelectMixin):
             )
 
 
+    @profiled("erase_tiles", "tiles")
     def erase_selected_tiles(self):
         if not self.pixmap_item:
             return
         if not self.selected_coords:
             return
         
-        if hasattr(self.parent(), "undo_stack") and self.pixmap_item:
-            save_state(
-                self.pixmap_item,
-                self.selected_coords,
-                self.parent().undo_stack,
-                self.parent().redo_stack
-            )
+        revision, selection = self._revision(), set(self.selected_coords)
+        start_job(
+            erase_tiles_job, self.pixmap_item.pixmap().toImage(), selection, self.tile_size,
+            owner=self, label="Cancellazione tile...", name="erase_tiles_job",
+            on_result=lambda image: self._apply_erased_tiles(image, revision, selection)
+        )
 
-        # Cancella pixel selezionati
-        original = self.pixmap_item.pixmap()
-        image = original.toImage()
-        for x, y in self.selected_coords:
-            px, py = x * self.tile_size, y * self.tile_size
-            for dx in range(self.tile_size):
-                for dy in range(self.tile_size):
-                    image.setPixelColor(px + dx, py + dy, Qt.transparent)
-        new_pixmap = QPixmap.fromImage(image)
-        self.pixmap_item.setPixmap(new_pixmap)
+    def _apply_erased_tiles(self, image, revision=None, selection=()):
+        if not self._save_pre_edit_state(revision, selection):
+            return
+        self.pixmap_item.setPixmap(QPixmap.fromImage(image))
 
         # Rimuove i marker visivi (rettangoli arancioni)
         for coord in list(self.selected_coords):  # fai una copia per sicurezza
@@ -578,6 +633,7 @@ class AtlasGraphicsView(GridGraphicsView, ShiftDragRectSelectMixin):
                 self.window().undo_stack,
                 self.window().redo_stack
             )
+        self.pixmap_edited.emit()
 
 
     def restore_selection(self, coords: set):
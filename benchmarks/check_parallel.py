@@ -0,0 +1,135 @@
+# Controllo della modalità a processi di run_bands (shared memory), anche su una macchina a un core:
+#
+#   python benchmarks/check_parallel.py
+#   python benchmarks/check_parallel.py --workers 4
+#
+# Un kernel in Python puro deve dare gli stessi pixel e risultati dei thread; un errore nel kernel, un
+# annullamento o un figlio morto devono arrivare al chiamante senza lasciare segmenti in /dev/shm e senza
+# rompere le chiamate successive. Esce con codice 1 al primo controllo fallito.
+
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from utils import parallel_utils
+from utils.parallel_utils import MODE_PROCESSES, MODE_THREADS, run_bands
+
+SHAPE = (512, 512)
+BAND_ROWS = 64
+
+
+def invert_rows(band, top, step):
+    # Python puro riga per riga: il caso per cui esiste la modalità a processi
+    for row in band:
+        row[::step] = 0xFFFFFFFF - row[::step]
+    return top, int(band[:, 0].sum())
+
+
+def first_row(band, top):
+    # Ritorna una vista sulla shared memory: il figlio la deve copiare prima di chiuderla
+    return band[0]
+
+
+def fail_at(band, top, bad_top):
+    if top == bad_top:
+        raise ValueError(f"banda {top}")
+    return top
+
+
+def crash(band, top):
+    os._exit(3)
+
+
+class CancelAfterFirst:
+    is_cancelled = False
+
+    def check(self):
+        from utils.job_utils import JobCancelled
+        if self.is_cancelled:
+            raise JobCancelled()
+
+    def report(self, done, total):
+        self.is_cancelled = True
+
+
+def _segments():
+    try:
+        return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+    except OSError:
+        return set()
+
+
+def _sheet():
+    return np.arange(SHAPE[0] * SHAPE[1], dtype=np.uint32).reshape(SHAPE)
+
+
+def run_checks():
+    failures = []
+
+    def expect(condition, message):
+        print(("ok   " if condition else "FAIL ") + message, flush=True)
+        if not condition:
+            failures.append(message)
+
+    before = _segments()
+
+    threads, processes = _sheet(), _sheet()
+    expected = run_bands(invert_rows, threads, 3, band_rows=BAND_ROWS, mode=MODE_THREADS)
+    results = run_bands(invert_rows, processes, 3, band_rows=BAND_ROWS, mode=MODE_PROCESSES)
+    expect(results == expected, "risultati dei processi uguali a quelli dei thread")
+    expect(np.array_equal(processes, threads), "pixel scritti dai processi riportati nell'array")
+
+    rows = run_bands(first_row, _sheet(), band_rows=BAND_ROWS, mode=MODE_PROCESSES)
+    expect(all(np.array_equal(row, _sheet()[top]) for row, top in zip(rows, range(0, SHAPE[0], BAND_ROWS))),
+           "viste sulla shared memory ritornate come copie")
+
+    try:
+        run_bands(fail_at, _sheet(), BAND_ROWS * 2, band_rows=BAND_ROWS, mode=MODE_PROCESSES)
+        expect(False, "errore del kernel propagato")
+    except ValueError as e:
+        expect(str(e) == f"banda {BAND_ROWS * 2}", "errore del kernel propagato")
+
+    from utils.job_utils import JobCancelled
+    try:
+        run_bands(invert_rows, _sheet(), 1, band_rows=BAND_ROWS, mode=MODE_PROCESSES, job=CancelAfterFirst())
+        expect(False, "annullamento propagato")
+    except JobCancelled:
+        expect(True, "annullamento propagato")
+
+    try:
+        run_bands(crash, _sheet(), band_rows=BAND_ROWS, mode=MODE_PROCESSES)
+        expect(False, "figlio morto segnalato")
+    except parallel_utils.BrokenProcessPool:
+        expect(True, "figlio morto segnalato")
+
+    again = _sheet()
+    results = run_bands(invert_rows, again, 3, band_rows=BAND_ROWS, mode=MODE_PROCESSES)
+    expect(results == expected and np.array_equal(again, threads), "nuovo pool dopo un figlio morto")
+
+    parallel_utils.shutdown_pools()
+    expect(_segments() == before, "nessun segmento di shared memory rimasto")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Modalità a processi di run_bands")
+    parser.add_argument("--workers", type=int, default=2, help="worker dei pool (default: 2)")
+    args = parser.parse_args(argv)
+
+    os.environ[parallel_utils.WORKERS_ENV] = str(max(2, args.workers))
+    failures = run_checks()
+    if failures:
+        print(f"{len(failures)} controlli falliti.")
+        return 1
+    print("Modalità a processi ok.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
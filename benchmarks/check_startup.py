@@ -0,0 +1,131 @@
+# Controllo del tempo di avvio della finestra principale rispetto a un budget:
+#
+#   python benchmarks/check_startup.py
+#   python benchmarks/check_startup.py --import-budget-ms 300 --first-frame-budget-ms 1200 --runs 5
+#
+# Ogni misura gira in un processo nuovo (cache dei moduli vuota): tempo di "import main" via -X importtime,
+# tempo al primo frame della MainWindow e lista dei moduli pesanti caricati troppo presto.
+# Esce con codice 1 se un budget viene superato o se un modulo da caricare al primo utilizzo è già presente.
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_FRAME_SCRIPT = """
+import sys, time, json
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r})
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QTimer
+app = QApplication(sys.argv[:1])
+import main
+from utils.startup_utils import FirstFrameProbe, loaded_deferred_modules
+import_done = time.perf_counter() - t0
+window = main.MainWindow()
+window.resize(800, 600)
+result = {{}}
+def done(elapsed):
+    result.update(first_frame=elapsed, imports=import_done, deferred=loaded_deferred_modules())
+    QTimer.singleShot(0, app.quit)
+FirstFrameProbe(window, t0, done)
+window.show()
+QTimer.singleShot(10000, app.quit)
+app.exec_()
+print("RESULT " + json.dumps(result))
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    return env
+
+
+def measure_import_time():
+    # Tempo cumulativo di "import main" secondo -X importtime, in millisecondi
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, env=_env(), capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else "import main fallito")
+
+    modules = {}
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s*(\d+)\s*\|\s*(\d+)\s*\|\s*(.+)$", line)
+        if match:
+            modules[match.group(3).strip()] = int(match.group(2)) / 1000.0
+    return modules.get("main"), modules
+
+
+def measure_first_frame():
+    proc = subprocess.run(
+        [sys.executable, "-c", FIRST_FRAME_SCRIPT.format(root=ROOT)],
+        cwd=ROOT, env=_env(), capture_output=True, text=True
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith("RESULT "):
+            result = json.loads(line[len("RESULT "):])
+            if "first_frame" in result:
+                return result
+    raise RuntimeError("primo frame non misurato:\n" + proc.stderr[-2000:])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Budget di avvio di Sprityle")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--import-budget-ms", type=float, default=400.0)
+    parser.add_argument("--first-frame-budget-ms", type=float, default=1500.0)
+    parser.add_argument("--top", type=int, default=10, help="Moduli più lenti da mostrare")
+    parser.add_argument("--json", help="Scrive i risultati in questo file")
+    args = parser.parse_args(argv)
+
+    import_times, frame_times, deferred = [], [], set()
+    modules = {}
+    for _ in range(args.runs):
+        total, modules = measure_import_time()
+        import_times.append(total)
+        result = measure_first_frame()
+        frame_times.append(result["first_frame"] * 1000.0)
+        deferred.update(result["deferred"])
+
+    import_ms = statistics.median(import_times)
+    frame_ms = statistics.median(frame_times)
+
+    print(f"import main:   {import_ms:8.1f} ms (budget {args.import_budget_ms:.0f} ms)")
+    print(f"primo frame:   {frame_ms:8.1f} ms (budget {args.first_frame_budget_ms:.0f} ms)")
+    print("\nModuli più lenti (cumulativo):")
+    for name, ms in sorted(modules.items(), key=lambda item: item[1], reverse=True)[1:args.top + 1]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"import_ms": import_ms, "first_frame_ms": frame_ms,
+                       "deferred_loaded": sorted(deferred)}, f, indent=4)
+
+    failures = []
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import main oltre il budget: {import_ms:.1f} ms > {args.import_budget_ms:.0f} ms")
+    if frame_ms > args.first_frame_budget_ms:
+        failures.append(f"primo frame oltre il budget: {frame_ms:.1f} ms > {args.first_frame_budget_ms:.0f} ms")
+    if deferred:
+        failures.append("moduli caricati all'avvio invece che al primo utilizzo: " + ", ".join(sorted(deferred)))
+
+    if failures:
+        print("\n!!! BUDGET DI AVVIO SUPERATO !!!")
+        for line in failures:
+            print("  " + line)
+        return 1
+
+    print("\nAvvio entro il budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
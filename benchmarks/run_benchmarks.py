@@ -0,0 +1,460 @@
+# Micro-benchmark dei percorsi caldi sui pixel, eseguibile senza display:
+#
+#   QT_QPA_PLATFORM=offscreen python benchmarks/run_benchmarks.py
+#   python benchmarks/run_benchmarks.py --sizes 256 1024 --tiles 16 256 --json out.json
+#   python benchmarks/run_benchmarks.py --update-baseline
+#
+# Ogni operazione viene misurata su fogli sintetici (tempo minimo su --repeat giri, picco di memoria
+# Python via tracemalloc e picco RSS campionato dove /proc è disponibile). Il risultato viene confrontato
+# con benchmarks/baseline.json: una regressione oltre la tolleranza fa uscire con codice 1, una baseline
+# mancante con codice 2 (la si crea sulla macchina di riferimento con --update-baseline).
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from PyQt5.QtCore import QT_VERSION_STR
+from PyQt5.QtGui import QImage, QPixmap, QColor, QPainter
+from PyQt5.QtWidgets import QApplication, QGraphicsScene, QGraphicsPixmapItem
+
+from utils.job_utils import wait_for_jobs
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_SIZES = [256, 1024, 4096, 8192]
+DEFAULT_TILES = [16, 256, 4096]
+TILE_SIZE = 16
+
+
+# --- Dati sintetici ---------------------------------------------------------
+
+def make_sheet(size: int, tile_size: int = TILE_SIZE) -> QPixmap:
+    # Foglio con tile colorati, trasparenze e un colore chiave ricorrente
+    image = QImage(size, size, QImage.Format_ARGB32)
+    image.fill(QColor(0, 0, 0, 0))
+    painter = QPainter(image)
+    for y in range(0, size, tile_size * 4):
+        for x in range(0, size, tile_size * 4):
+            painter.fillRect(x, y, tile_size * 3, tile_size * 3, QColor((x * 7) % 256, (y * 3) % 256, 128))
+            painter.fillRect(x + 2, y + 2, 4, 4, QColor("#FF00FF"))
+    painter.end()
+    return QPixmap.fromImage(image)
+
+
+# Cartelle temporanee della misura in corso: run_suite le cancella appena la misura finisce
+_folders = []
+
+
+def bench_folder() -> str:
+    folder = tempfile.mkdtemp(prefix="sprityle_bench_")
+    _folders.append(folder)
+    return folder
+
+
+def remove_bench_folders():
+    while _folders:
+        shutil.rmtree(_folders.pop(), ignore_errors=True)
+
+
+def tile_coords(size: int, count: int, tile_size: int = TILE_SIZE):
+    per_row = size // tile_size
+    count = min(count, per_row * per_row)
+    return {(i % per_row, i // per_row) for i in range(count)}
+
+
+# --- Misura -----------------------------------------------------------------
+
+class RssSampler:
+    # Picco RSS campionato in un thread: solo dove esiste /proc/self/statm
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.available = os.path.exists("/proc/self/statm")
+        self.page_size = os.sysconf("SC_PAGE_SIZE") if self.available else 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _rss(self):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * self.page_size
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        if self.available:
+            self.start_rss = self._rss()
+            self.peak = self.start_rss
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, self._rss())
+
+    @property
+    def delta(self):
+        return self.peak - self.start_rss if self.available else None
+
+
+def measure(setup, run, repeat: int):
+    best = None
+    py_peak = 0
+    rss_peak = None
+    for _ in range(repeat):
+        state = setup()
+        tracemalloc.start()
+        with RssSampler() as sampler:
+            start = time.perf_counter()
+            run(state)
+            elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        best = elapsed if best is None else min(best, elapsed)
+        py_peak = max(py_peak, peak)
+        if sampler.delta is not None:
+            rss_peak = max(rss_peak or 0, sampler.delta)
+        QApplication.processEvents()
+    return best, py_peak, rss_peak
+
+
+# --- Operazioni -------------------------------------------------------------
+
+def bench_remove_selected_color(size, tiles):
+    from main import MainWindow
+
+    def setup():
+        window = MainWindow()
+        window.view.pixmap_item = QGraphicsPixmapItem(make_sheet(size))
+        window.view.scene.addItem(window.view.pixmap_item)
+        window.color_field.setText("#FF00FF")
+        window.save_state()
+        return window
+
+    return setup, lambda window: (window.remove_selected_color(), wait_for_jobs())
+
+
+def bench_remove_selected_color_indexed(size, tiles):
+    from main import MainWindow
+    from utils.indexed_utils import IndexedImageItem
+
+    # Documento indicizzato: la rimozione tocca solo la palette
+    def setup():
+        window = MainWindow()
+        window.view.pixmap_item = IndexedImageItem(make_sheet(size))
+        window.view.scene.addItem(window.view.pixmap_item)
+        window.color_field.setText("#FF00FF")
+        window.save_state()
+        return window
+
+    return setup, lambda window: window.remove_selected_color()
+
+
+def _atlas_manager_with_selection(size, tiles):
+    from atlas.atlas_manager import AtlasManagerWindow
+
+    window = AtlasManagerWindow()
+    window.load_image(make_sheet(size))
+    window.view.set_tile_size(TILE_SIZE)
+    window.view.selected_coords = tile_coords(size, tiles)
+    return window
+
+
+def bench_erase_selected_tiles(size, tiles):
+    return (lambda: _atlas_manager_with_selection(size, tiles),
+            lambda window: (window.view.erase_selected_tiles(), wait_for_jobs()))
+
+
+def bench_move_selected_tiles(size, tiles):
+    # Spostamento di una riga in basso: serve almeno una riga libera sotto la selezione
+    per_row = size // TILE_SIZE
+    if tiles > per_row * (per_row - 1):
+        return None
+
+    def run(window):
+        window.view._move_selected_tiles_to(0, 1)
+        wait_for_jobs()
+
+    return lambda: _atlas_manager_with_selection(size, tiles), run
+
+
+def bench_draw_checkerboard_pixmap(size, tiles):
+    from utils.graphics_utils import draw_checkerboard_pixmap
+    return lambda: None, lambda _: draw_checkerboard_pixmap(size, size, TILE_SIZE)
+
+
+def bench_draw_grid_lines(size, tiles):
+    from utils.grid_utils import draw_grid_lines
+    return QGraphicsScene, lambda scene: draw_grid_lines(scene, size, size, TILE_SIZE)
+
+
+def bench_insert_images_into_atlas(size, tiles):
+    from atlas.atlas_generated_window import AtlasGeneratedWindow
+
+    cells = size // TILE_SIZE
+    sprite = make_sheet(TILE_SIZE * 2)
+    # Ogni sprite occupa 2x2 celle più il margine
+    count = min(tiles, max(1, (cells // 3) ** 2))
+    sprites = [sprite] * count
+
+    return lambda: None, lambda _: (AtlasGeneratedWindow(TILE_SIZE, cells, cells, sprites), wait_for_jobs())
+
+
+def bench_insert_image_files_into_atlas(size, tiles):
+    from atlas.atlas_generated_window import AtlasGeneratedWindow
+    from utils.image_handle_utils import ImageHandle
+
+    # Sprite su disco passati come handle: il picco deve restare la tela più la finestra di decodifica
+    cells = size // TILE_SIZE
+    count = min(tiles, max(1, (cells // 3) ** 2))
+    folder = bench_folder()
+    sprite = make_sheet(TILE_SIZE * 2)
+    paths = []
+    for index in range(count):
+        path = os.path.join(folder, f"sprite_{index:05d}.png")
+        sprite.save(path, "PNG")
+        paths.append(path)
+    handles = [ImageHandle.from_file(path) for path in paths]
+
+    return lambda: None, lambda _: (AtlasGeneratedWindow(TILE_SIZE, cells, cells, handles, image_paths=paths),
+                                    wait_for_jobs())
+
+
+def bench_generate_tile_images(size, tiles):
+    from tile_splitter.tile_splitter_executor import TileSplitterWidget
+
+    sheet = make_sheet(size)
+    coords = tile_coords(size, tiles)
+    return (lambda: TileSplitterWidget(sheet, coords, TILE_SIZE),
+            lambda widget: widget.generate_tile_images(4))
+
+
+def bench_save_state(size, tiles):
+    from utils.states_utils import save_state
+
+    item = QGraphicsPixmapItem(make_sheet(size))
+    selection = tile_coords(size, tiles)
+    return lambda: ([], []), lambda stacks: save_state(item, selection, stacks[0], stacks[1])
+
+
+def bench_split_sheet_streaming(size, tiles):
+    from utils.stream_utils import split_sheet
+
+    # Lettura a bande forzata (full_decode_limit=0): il picco deve restare quello di una banda
+    folder = bench_folder()
+    path = os.path.join(folder, "sheet.png")
+    make_sheet(size).save(path, "PNG")
+    return (lambda: tempfile.mkdtemp(dir=folder),
+            lambda out_dir: split_sheet(path, TILE_SIZE, out_dir, full_decode_limit=0))
+
+
+def bench_read_png_bands(size, tiles):
+    import numpy as np
+    from utils.array_utils import qimage_view
+    from utils.stream_utils import PngRowReader
+
+    # Foglio sfumato salvato da Qt: libpng sceglie filtri adattivi (Paeth/Average) riga per riga,
+    # il caso che split_sheet_streaming sui tile a tinta unita non copre
+    folder = bench_folder()
+    path = os.path.join(folder, "gradient.png")
+    image = QImage(size, size, QImage.Format_ARGB32)
+    y, x = np.mgrid[0:size, 0:size].astype(np.uint32)
+    qimage_view(image)[:] = ((128 + (x + y) % 128) << 24 | ((x * 7 + y) & 0xFF) << 16
+                             | ((x ^ y) & 0xFF) << 8 | ((x + y * 5) & 0xFF))
+    image.save(path, "PNG")
+
+    def run(_):
+        with PngRowReader(path) as reader:
+            for _ in range(0, reader.height, 256):
+                reader.read_rows(256)
+
+    return lambda: None, run
+
+
+def bench_build_tilemap(size, tiles):
+    from utils.tilemap_utils import build_tilemap
+
+    # Con i tile capovolti considerati uguali; la lettura a bande è già misurata da split_sheet_streaming
+    folder = bench_folder()
+    path = os.path.join(folder, "map.png")
+    make_sheet(size).save(path, "PNG")
+    return lambda: None, lambda _: build_tilemap(path, TILE_SIZE, flips=True)
+
+
+def bench_generate_variants(size, tiles):
+    from utils.recolor_utils import generate_variants
+
+    class Job:
+        def check(self):
+            pass
+
+        def report(self, done, total):
+            pass
+
+    # Quattro varianti del foglio con tolleranza: una decodifica, LUT per variante, scrittura nel pool
+    folder = bench_folder()
+    path = os.path.join(folder, "sheet.png")
+    make_sheet(size).save(path, "PNG")
+    magenta = QColor("#FF00FF").rgba()
+    variants = [(f"v{i}", [(magenta, QColor.fromHsv(i * 90, 255, 255).rgba())]) for i in range(4)]
+    return (lambda: tempfile.mkdtemp(dir=folder),
+            lambda out_dir: generate_variants(Job(), [path], variants, out_dir, tolerance=16))
+
+
+# (nome, factory, dipende dal numero di tile)
+OPERATIONS = [
+    ("remove_selected_color", bench_remove_selected_color, False),
+    ("remove_selected_color_indexed", bench_remove_selected_color_indexed, False),
+    ("erase_selected_tiles", bench_erase_selected_tiles, True),
+    ("move_selected_tiles_to", bench_move_selected_tiles, True),
+    ("draw_checkerboard_pixmap", bench_draw_checkerboard_pixmap, False),
+    ("draw_grid_lines", bench_draw_grid_lines, False),
+    ("insert_images_into_atlas", bench_insert_images_into_atlas, True),
+    ("insert_image_files_into_atlas", bench_insert_image_files_into_atlas, True),
+    ("generate_tile_images", bench_generate_tile_images, True),
+    ("save_state", bench_save_state, False),
+    ("split_sheet_streaming", bench_split_sheet_streaming, False),
+    ("read_png_bands", bench_read_png_bands, False),
+    ("build_tilemap", bench_build_tilemap, False),
+    ("generate_variants", bench_generate_variants, False),
+]
+
+
+def run_suite(sizes, tile_counts, repeat, time_budget, only=None):
+    results = []
+    for name, factory, uses_tiles in OPERATIONS:
+        if only and name not in only:
+            continue
+        # Ultima misura per numero di tile: serve a stimare la taglia successiva
+        last = {}
+        for size in sizes:
+            counts = tile_counts if uses_tiles else [0]
+            for tiles in counts:
+                entry = {"op": name, "size": size, "tiles": tiles}
+                if uses_tiles and tiles > (size // TILE_SIZE) ** 2:
+                    continue
+
+                if tiles in last:
+                    # Le operazioni per pixel crescono con l'area: si salta prima di sforare il budget
+                    prev_size, prev_seconds = last[tiles]
+                    estimate = prev_seconds * (size / prev_size) ** 2
+                    if estimate > time_budget:
+                        entry["skipped"] = f"stimati {estimate:.1f}s, oltre il budget di {time_budget}s"
+                        results.append(entry)
+                        print(f"{name:28s} size={size:5d} tiles={tiles:5d}  saltato ({entry['skipped']})", flush=True)
+                        continue
+
+                try:
+                    bench = factory(size, tiles)
+                    if bench is None:
+                        continue
+                    setup, run = bench
+                    seconds, py_peak, rss_peak = measure(setup, run, repeat)
+                finally:
+                    remove_bench_folders()
+                entry.update({"seconds": seconds, "py_peak_bytes": py_peak, "rss_peak_bytes": rss_peak})
+                results.append(entry)
+                last[tiles] = (size, seconds)
+                print(f"{name:28s} size={size:5d} tiles={tiles:5d}  {seconds * 1000:10.2f} ms  "
+                      f"py_peak={py_peak / 1e6:8.2f} MB  rss_peak={(rss_peak or 0) / 1e6:8.2f} MB", flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta):
+    def key(entry):
+        return entry["op"], entry["size"], entry["tiles"]
+
+    reference = {key(entry): entry for entry in baseline.get("results", []) if "seconds" in entry}
+    regressions = []
+    for entry in results:
+        base = reference.get(key(entry))
+        if not base or "seconds" not in entry:
+            continue
+        if entry["seconds"] > base["seconds"] * tolerance and entry["seconds"] - base["seconds"] > min_delta:
+            regressions.append(f"{entry['op']} size={entry['size']} tiles={entry['tiles']}: "
+                               f"{base['seconds'] * 1000:.2f} ms -> {entry['seconds'] * 1000:.2f} ms")
+        base_mem, mem = base.get("rss_peak_bytes"), entry.get("rss_peak_bytes")
+        if base_mem and mem and mem > base_mem * tolerance and mem - base_mem > 16 * 1024 * 1024:
+            regressions.append(f"{entry['op']} size={entry['size']} tiles={entry['tiles']}: "
+                               f"RSS {base_mem / 1e6:.1f} MB -> {mem / 1e6:.1f} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dei percorsi caldi di Sprityle")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--tiles", type=int, nargs="+", default=DEFAULT_TILES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", help="Solo queste operazioni")
+    parser.add_argument("--time-budget", type=float, default=30.0,
+                        help="Taglie con tempo stimato oltre questa soglia (s) vengono saltate")
+    parser.add_argument("--json", help="Scrive i risultati in questo file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Rapporto massimo rispetto alla baseline")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="Differenza minima (s) per segnalare")
+    args = parser.parse_args(argv)
+
+    # Senza baseline il controllo non può fallire: meglio fermarsi subito che passare in silenzio
+    if not args.update_baseline and not os.path.exists(args.baseline):
+        print(f"Nessuna baseline in {args.baseline}: eseguire con --update-baseline per crearla.")
+        return 2
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+
+    results = run_suite(args.sizes, args.tiles, args.repeat, args.time_budget, args.only)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "qt": QT_VERSION_STR,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Baseline aggiornata: {args.baseline}")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.tolerance, args.min_delta)
+    if regressions:
+        print("\n!!! REGRESSIONI RISPETTO ALLA BASELINE !!!")
+        for line in regressions:
+            print("  " + line)
+        return 1
+
+    print("\nNessuna regressione rispetto alla baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
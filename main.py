@@ -1,17 +1,38 @@
+import time
+
+# Riferimento per il tempo al primo frame: preso prima di qualsiasi import pesante
+STARTUP_T0 = time.perf_counter()
+
 import sys
 from PyQt5.QtWidgets import (
     QApplication, QGraphicsView, QGraphicsScene,
-    QMainWindow, QWidget, QPushButton, QVBoxLayout, QLabel, QLineEdit, QHBoxLayout, QMessageBox
+    QMainWindow, QWidget, QPushButton, QVBoxLayout, QLabel, QLineEdit, QHBoxLayout, QMessageBox,
+    QGraphicsPixmapItem, QColorDialog
 )
 from PyQt5.QtGui import QPixmap, QPainter, QColor, QImage
 from PyQt5.QtCore import Qt, pyqtSignal
 
-from tile_splitter.tile_splitter import TileSplitterWindow
-from atlas.atlas_manager import AtlasManagerWindow
 from utils.graphics_utils import load_image_with_checker
 from utils.controls_utils import save_pixmap_dialog, apply_zoom, CtrlDragMixin,is_atlas_file
-from utils.states_utils import save_state, undo_state, redo_state, reset_state
-from utils.meta_utils import MetaUtils
+from utils.states_utils import save_state, undo_state, redo_state, reset_state, apply_state
+from utils.profiling_utils import profiled, is_enabled, set_enabled, ProfilerPanel, export_trace_dialog
+from utils.startup_utils import FirstFrameProbe
+from utils.document_utils import DocumentMixin, open_document
+from utils.job_utils import start_job
+
+
+def remove_color_job(job, image: QImage, target: int, replacement: int = 0):
+    # Nel thread del pool: l'immagine è una copia ARGB32 solo di questo job
+    from utils.array_utils import qimage_view, color_key_band
+    from utils.parallel_utils import run_bands, merge_rects
+
+    rects = run_bands(color_key_band, qimage_view(image), target, replacement, job=job)
+    return image, merge_rects(rects)
+
+
+def recolor_job(job, image: QImage, mapping, tolerance: int):
+    from utils.recolor_utils import recolor_image
+    return recolor_image(image, mapping, tolerance, job=job)
 
 
 class ImageViewer(QGraphicsView, CtrlDragMixin):
@@ -35,9 +56,13 @@ class ImageViewer(QGraphicsView, CtrlDragMixin):
         pos = self.mapToScene(event.pos())
         x, y = int(pos.x()), int(pos.y())
 
-        if 0 <= x < self.pixmap_item.pixmap().width() and 0 <= y < self.pixmap_item.pixmap().height():
-            image = self.pixmap_item.pixmap().toImage()
-            color = image.pixelColor(x, y)
+        if self.pixmap_item.boundingRect().contains(x, y):
+            # Documento indicizzato: il colore si legge dalla palette, senza espandere l'immagine
+            indexed = getattr(self.pixmap_item, "indexed", None)
+            if indexed is not None:
+                color = QColor.fromRgba(indexed.pixel(x, y))
+            else:
+                color = self.pixmap_item.pixmap().toImage().pixelColor(x, y)
             hex_color = color.name().upper()
             self.color_picked.emit(hex_color)
 
@@ -56,7 +81,7 @@ class ImageViewer(QGraphicsView, CtrlDragMixin):
         apply_zoom(self, event, zoom_in=1.15)
 
 
-class MainWindow(QMainWindow):
+class MainWindow(QMainWindow, DocumentMixin):
     def __init__(self):
         super().__init__()
 
@@ -97,13 +122,31 @@ class MainWindow(QMainWindow):
 
         self.remove_color_button = QPushButton("Rimuovi colore")
         self.remove_color_button.setFixedWidth(100)
-        self.remove_color_button.clicked.connect(self.remove_selected_color)
+        self.remove_color_button.clicked.connect(lambda: self.remove_selected_color())
+
+        self.replace_color_button = QPushButton("Sostituisci colore")
+        self.replace_color_button.setFixedWidth(110)
+        self.replace_color_button.clicked.connect(self.replace_selected_color)
+
+        self.highlight_button = QPushButton("Evidenzia colore")
+        self.highlight_button.setFixedWidth(110)
+        self.highlight_button.setCheckable(True)
+        self.highlight_button.toggled.connect(self.highlight_selected_color)
+        self.highlight_item = None
+
+        self.recolor_button = QPushButton("Ricolora...")
+        self.recolor_button.setFixedWidth(90)
+        self.recolor_button.clicked.connect(self.open_recolor_panel)
+        self.recolor_panel = None
 
         color_layout = QHBoxLayout()
         color_layout.addWidget(self.color_label)
         color_layout.addWidget(self.color_field)
         color_layout.addWidget(self.copy_button)
         color_layout.addWidget(self.remove_color_button)
+        color_layout.addWidget(self.replace_color_button)
+        color_layout.addWidget(self.highlight_button)
+        color_layout.addWidget(self.recolor_button)
         color_layout.setAlignment(Qt.AlignCenter)
 
         layout = QVBoxLayout()
@@ -115,11 +158,11 @@ class MainWindow(QMainWindow):
         # Buttons
         self.load_button = QPushButton("Carica")
         self.load_button.setMaximumWidth(120)
-        self.load_button.clicked.connect(self.load_image)
+        self.load_button.clicked.connect(lambda: self.load_image())
 
         self.save_button = QPushButton("Salva")
         self.save_button.setFixedWidth(80)
-        self.save_button.clicked.connect(self.save_image)
+        self.save_button.clicked.connect(lambda: self.save_image())
 
         self.undo_button = QPushButton("Annulla")
         self.undo_button.setFixedWidth(80)
@@ -146,51 +189,225 @@ class MainWindow(QMainWindow):
         container.setLayout(layout)
         self.setCentralWidget(container)
 
+        self.profiler_panel = None
+        self.memory_panel = None
+        self.catalog_panel = None
+        self.init_tools_menu()
+
+    def init_tools_menu(self):
+        tools_menu = self.menuBar().addMenu("Strumenti")
+
+        self.profiling_action = tools_menu.addAction("Profilazione")
+        self.profiling_action.setCheckable(True)
+        self.profiling_action.setChecked(is_enabled())
+        self.profiling_action.toggled.connect(set_enabled)
+
+        stats_action = tools_menu.addAction("Statistiche prestazioni")
+        stats_action.triggered.connect(self.open_profiler_panel)
+
+        trace_action = tools_menu.addAction("Esporta trace...")
+        trace_action.triggered.connect(lambda: export_trace_dialog(self))
+
+        tools_menu.addSeparator()
+        # Palette + indici al posto dei pixel ARGB: per la pixel art con pochi colori
+        self.indexed_action = tools_menu.addAction("Documento indicizzato")
+        self.indexed_action.setCheckable(True)
+        self.indexed_action.toggled.connect(self.apply_view_mode)
+
+        memory_action = tools_menu.addAction("Memoria")
+        memory_action.triggered.connect(self.open_memory_panel)
+
+        catalog_action = tools_menu.addAction("Catalogo asset")
+        catalog_action.triggered.connect(self.open_catalog_panel)
+
+    def open_profiler_panel(self):
+        if self.profiler_panel is None:
+            self.profiler_panel = ProfilerPanel()
+            self.profiler_panel.enabled_checkbox.toggled.connect(self.profiling_action.setChecked)
+        self.profiler_panel.show()
+        self.profiler_panel.raise_()
+
+    def open_memory_panel(self):
+        if self.memory_panel is None:
+            from utils.memory_utils import MemoryPanel
+            self.memory_panel = MemoryPanel()
+        self.memory_panel.show()
+        self.memory_panel.raise_()
+
+    def open_catalog_panel(self):
+        if self.catalog_panel is None:
+            from utils.catalog_utils import CatalogPanel
+            self.catalog_panel = CatalogPanel()
+        self.catalog_panel.show()
+        self.catalog_panel.raise_()
+
 
     def open_tile_splitter(self):
-        pixmap = None
-        if self.view.pixmap_item and not self.view.pixmap_item.pixmap().isNull():
-            pixmap = self.view.pixmap_item.pixmap().copy()
+        # Le finestre secondarie (e tutto ciò che importano) si caricano al primo utilizzo
+        from tile_splitter.tile_splitter import TileSplitterWindow
 
-        self.tile_splitter = TileSplitterWindow(pixmap)
+        # Il documento è condiviso: nessuna copia dell'immagine
+        self.tile_splitter = TileSplitterWindow(document=self.document)
         self.tile_splitter.show()
 
     def open_atlas_manager(self):
-        pixmap = None
-        if self.view.pixmap_item and not self.view.pixmap_item.pixmap().isNull():
-            pixmap_item = self.view.pixmap_item
-            pixmap = pixmap_item.pixmap()
-            pixmap.path = getattr(pixmap_item, "path", None)
-        self.atlas_manager = AtlasManagerWindow(edit_mode=is_atlas_file(pixmap.path) if pixmap and hasattr(pixmap, "path") else False)
-        if pixmap is not None:
-            self.atlas_manager.load_image(pixmap)
+        from atlas.atlas_manager import AtlasManagerWindow
+
+        path = self.document.path if self.document else None
+        self.atlas_manager = AtlasManagerWindow(edit_mode=is_atlas_file(path))
+        if self.document is not None:
+            self.atlas_manager.set_document(self.document)
         self.atlas_manager.show()
 
 
+    def apply_view_mode(self):
+        # Scambia l'item della vista tra ARGB (QGraphicsPixmapItem) e indicizzato, mantenendo lo stato corrente
+        item = self.view.pixmap_item
+        if item is None:
+            return
+        indexed_mode = self.indexed_action.isChecked()
+        if indexed_mode == hasattr(item, "set_indexed"):
+            return
+
+        if indexed_mode:
+            from utils.indexed_utils import IndexedImageItem
+            new_item = IndexedImageItem()
+            # Il documento intero passa agli indici (originale e storia compresi): senza questo le pixmap ARGB
+            # resterebbero vive accanto agli indici
+            if self.document is not None:
+                self.document.index_states()
+        else:
+            new_item = QGraphicsPixmapItem()
+        new_item.setZValue(item.zValue())
+        new_item.path = getattr(item, "path", None)
+        state = self.document.state() if self.document is not None else {"pixmap": item.pixmap()}
+        apply_state(new_item, set(), state)
+
+        self._clear_highlight()
+        self.view.scene.removeItem(item)
+        self.view.scene.addItem(new_item)
+        self.view.pixmap_item = new_item
+
+        if indexed_mode and new_item.indexed is None:
+            QMessageBox.information(self, "Documento indicizzato",
+                                    "L'immagine ha troppi colori per una palette: resta in ARGB.")
+
+    def _selected_rgba(self):
+        color_hex = self.color_field.text()
+        if self.view.pixmap_item is None or not QColor.isValidColor(color_hex):
+            return None
+        return QColor(color_hex).rgba()
+
+    @profiled("remove_color", "tiles")
     def remove_selected_color(self):
-        if self.view.pixmap_item is None:
+        target = self._selected_rgba()
+        if target is not None:
+            self._replace_color(target, 0, "Rimozione colore...")
+
+    def replace_selected_color(self):
+        target = self._selected_rgba()
+        if target is None:
             return
-        
+        color = QColorDialog.getColor(QColor.fromRgba(target), self, "Nuovo colore", QColorDialog.ShowAlphaChannel)
+        if color.isValid():
+            self._replace_color(target, color.rgba(), "Sostituzione colore...")
+
+    def _replace_color(self, target: int, replacement: int, label: str):
+        # Indicizzato: si cambia solo la palette, O(colori). ARGB: scansione a bande nel pool
+        indexed = getattr(self.view.pixmap_item, "indexed", None)
+        if indexed is not None:
+            replaced = indexed.replace_color(target, replacement)
+            if replaced is not None:
+                self.view.pixmap_item.set_indexed(replaced)
+                self.save_state()
+            return
+
         original_pixmap = self.view.pixmap_item.pixmap()
         image = original_pixmap.toImage().convertToFormat(QImage.Format_ARGB32) 
 
-        color_hex = self.color_field.text()
-        if not QColor.isValidColor(color_hex):
+        revision = self._revision()
+        start_job(
+            remove_color_job, image, target, replacement,
+            owner=self, label=label, name="remove_color_job",
+            on_result=lambda result: self._apply_removed_color(result, revision)
+        )
+
+    def open_recolor_panel(self):
+        if self.recolor_panel is None:
+            from utils.recolor_utils import RecolorPanel
+            self.recolor_panel = RecolorPanel(self)
+        self.recolor_panel.show()
+        self.recolor_panel.raise_()
+
+    @profiled("recolor", "tiles")
+    def apply_recolor(self, mapping, tolerance: int = 0):
+        # Mappatura colore -> colore con LUT (utils.recolor_utils); indicizzato: solo la palette
+        if self.view.pixmap_item is None:
+            return
+        indexed = getattr(self.view.pixmap_item, "indexed", None)
+        if indexed is not None:
+            from utils.recolor_utils import recolor_indexed
+            recolored = recolor_indexed(indexed, mapping, tolerance)
+            if recolored is not None:
+                self.view.pixmap_item.set_indexed(recolored)
+                self.save_state()
             return
 
-        target_color = QColor(color_hex)
-        changed = False
-        
-        for y in range(image.height()):
-            for x in range(image.width()):
-                if image.pixelColor(x, y) == target_color:
-                    image.setPixelColor(x, y, QColor(0, 0, 0, 0))
-                    changed = True
+        revision = self._revision()
+        start_job(
+            recolor_job, self.view.pixmap_item.pixmap().toImage(), mapping, tolerance,
+            owner=self, label="Ricolorazione...", name="recolor_job",
+            on_result=lambda result: self._apply_recolor(result, revision)
+        )
+
+    def _revision(self):
+        # Revisione del documento: lo stato in cima allo stack di undo, che cambia a ogni modifica, undo o redo.
+        # I risultati dei job calcolati su una revisione superata si scartano
+        return self.undo_stack[-1] if self.undo_stack else None
 
-        if changed:
+    def _is_current(self, revision) -> bool:
+        return self.view.pixmap_item is not None and self._revision() is revision
+
+    def _apply_recolor(self, result, revision=None):
+        image, changed = result
+        if changed and self._is_current(revision):
             self.view.pixmap_item.setPixmap(QPixmap.fromImage(image))
             self.save_state()
 
+    def highlight_selected_color(self, checked):
+        # Sovrapposizione dei pixel del colore selezionato: un confronto sugli indici (o sui pixel ARGB)
+        self._clear_highlight()
+        target = self._selected_rgba()
+        if not checked or target is None:
+            return
+
+        from utils.indexed_utils import color_mask, mask_overlay
+        indexed = getattr(self.view.pixmap_item, "indexed", None)
+        if indexed is not None:
+            mask = indexed.color_mask(target)
+        else:
+            mask = color_mask(self.view.pixmap_item.pixmap().toImage(), target)
+        self.highlight_item = QGraphicsPixmapItem(QPixmap.fromImage(mask_overlay(mask)))
+        self.highlight_item.setZValue(2)
+        self.view.scene.addItem(self.highlight_item)
+
+    def _clear_highlight(self):
+        if self.highlight_item is not None:
+            if self.highlight_item.scene() is not None:
+                self.view.scene.removeItem(self.highlight_item)
+            self.highlight_item = None
+        if self.highlight_button.isChecked():
+            self.highlight_button.blockSignals(True)
+            self.highlight_button.setChecked(False)
+            self.highlight_button.blockSignals(False)
+
+    def _apply_removed_color(self, result, revision=None):
+        image, dirty_rect = result
+        if dirty_rect is not None and self._is_current(revision):
+            self.view.pixmap_item.setPixmap(QPixmap.fromImage(image))
+            self.save_state()
+
+    @profiled("main.load_image", "io")
     def load_image(self):
     
         tile_size = int(self.current_tile_size)
@@ -204,28 +421,35 @@ class MainWindow(QMainWindow):
         )
 
         if self.view.pixmap_item:
-            self.original_pixmap = self.view.pixmap_item.pixmap().copy()
-            self.undo_stack.clear()
-            self.redo_stack.clear()       
-            self.save_state()
-
+            # Stesso file già aperto altrove: si riprende il suo documento, con la sua storia
+            document = open_document(self.view.pixmap_item.pixmap(), self.view.pixmap_item.path)
+            self.attach_document(document)
+            self.highlight_item = None  # la scena è stata svuotata
+            self._clear_highlight()
+            apply_state(self.view.pixmap_item, set(), document.state())
+            self.apply_view_mode()
+
+    @profiled("main.save_image", "io")
     def save_image(self):
         if self.view.pixmap_item is None:
             return
         
         pixmap = self.view.pixmap_item.pixmap()
-        path = save_pixmap_dialog(self, pixmap, "immagine")
-        if path:
-           MetaUtils.save_meta(
-                path, self.current_tile_size, editable=True
-            )
+        save_pixmap_dialog(self, pixmap, "immagine", on_saved=self._save_image_meta)
+
+    def _save_image_meta(self, path, stats):
+        from utils.meta_utils import MetaUtils
+        MetaUtils.save_meta(
+            path, self.current_tile_size, editable=True, palette=stats["palette"] if stats else None
+        )
             
  
 
     def reset_image(self):
+        self._clear_highlight()
         reset_state(
             self.view.pixmap_item,
-            self.original_pixmap,
+            self.original_base,
             set(),
             self.undo_stack,
             self.redo_stack,
@@ -233,12 +457,21 @@ class MainWindow(QMainWindow):
             color_field=self.color_field,
             parent=self
         )
+        self.document_changed()
 
     def save_state(self):
+        self._clear_highlight()
         save_state(self.view.pixmap_item, set(), self.undo_stack, self.redo_stack)
+        self.document_changed()
+
+    def on_document_changed(self):
+        if self.view.pixmap_item is not None:
+            self._clear_highlight()
+            apply_state(self.view.pixmap_item, set(), self.document.state())
 
 
     def undo(self):
+        self._clear_highlight()
         undo_state(
             self.view.pixmap_item,
             set(),  # Nessuna selezione in ImageViewer
@@ -246,8 +479,10 @@ class MainWindow(QMainWindow):
             self.redo_stack,
             restore_selection_fn=None
         )
+        self.document_changed()
 
     def redo(self):
+        self._clear_highlight()
         redo_state(
             self.view.pixmap_item,
             set(),
@@ -255,6 +490,7 @@ class MainWindow(QMainWindow):
             self.redo_stack,
             restore_selection_fn=None
         )
+        self.document_changed()
 
     def show_color(self, hex_color):
         self.color_field.setText(hex_color)
@@ -272,6 +508,7 @@ if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = MainWindow()
     window.resize(800, 600)
+    FirstFrameProbe(window, STARTUP_T0)
     window.show()
     sys.exit(app.exec_())
 
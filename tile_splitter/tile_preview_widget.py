@@ -0,0 +1,99 @@
+import math
+
+from PyQt5.QtWidgets import QAbstractScrollArea
+from PyQt5.QtGui import QPainter, QBrush, QColor, QPen
+from PyQt5.QtCore import QSize, QRectF, Qt
+
+
+class TileGridPreview(QAbstractScrollArea):
+    # Griglia di anteprime disegnata in un solo widget: si dipingono solo le celle visibili.
+    # Ogni cella mostra un tile ripetuto cols x rows tramite pennello, senza immagini grandi in memoria.
+    def __init__(self, cell_size: int = 64, spacing: int = 4, max_columns: int = 0, parent=None):
+        super().__init__(parent)
+        self.cell_size = cell_size
+        self.spacing = spacing
+        self.max_columns = max_columns
+        self.tiles = []
+        self.repeat = (1, 1)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.viewport().setBackgroundRole(self.backgroundRole())
+
+    def set_tiles(self, tiles, repeat=(1, 1)):
+        self.tiles = list(tiles)
+        self.repeat = repeat
+        self._update_scrollbar()
+        self.viewport().update()
+
+    def _pitch(self):
+        return self.cell_size + self.spacing
+
+    def _columns(self):
+        columns = max(1, (self.viewport().width() - self.spacing) // self._pitch())
+        if self.max_columns:
+            columns = min(columns, self.max_columns)
+        return columns
+
+    def _total_rows(self):
+        return math.ceil(len(self.tiles) / self._columns()) if self.tiles else 0
+
+    def _update_scrollbar(self):
+        content_height = self._total_rows() * self._pitch() + self.spacing
+        bar = self.verticalScrollBar()
+        bar.setRange(0, max(0, content_height - self.viewport().height()))
+        bar.setPageStep(self.viewport().height())
+        bar.setSingleStep(self._pitch() // 2)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._update_scrollbar()
+
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+
+    def sizeHint(self):
+        columns = self.max_columns or 4
+        rows = min(max(1, math.ceil(len(self.tiles) / columns)), 4)
+        pitch = self._pitch()
+        return QSize(columns * pitch + self.spacing + self.verticalScrollBar().sizeHint().width(),
+                     rows * pitch + self.spacing)
+
+    def paintEvent(self, event):
+        if not self.tiles:
+            return
+
+        painter = QPainter(self.viewport())
+        # Nearest neighbour: i pixel restano netti e non si scala nulla in anticipo
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, False)
+
+        pitch = self._pitch()
+        columns = self._columns()
+        scroll = self.verticalScrollBar().value()
+        first_row = scroll // pitch
+        last_row = min(self._total_rows() - 1, (scroll + self.viewport().height()) // pitch)
+        cols, rows = self.repeat
+
+        for row in range(first_row, last_row + 1):
+            for col in range(columns):
+                index = row * columns + col
+                if index >= len(self.tiles):
+                    break
+                tile = self.tiles[index]
+                x = self.spacing + col * pitch
+                y = self.spacing + row * pitch - scroll
+
+                pattern_w = tile.width() * cols
+                pattern_h = tile.height() * rows
+                scale = self.cell_size / max(pattern_w, pattern_h, 1)
+
+                painter.save()
+                painter.translate(x, y)
+                painter.scale(scale, scale)
+                rect = QRectF(0, 0, pattern_w, pattern_h)
+                painter.fillRect(rect, QColor(220, 220, 220))
+                painter.fillRect(rect, QBrush(tile))
+                painter.restore()
+
+                painter.setPen(QPen(QColor(150, 150, 150)))
+                painter.drawRect(x - 1, y - 1, int(pattern_w * scale) + 1, int(pattern_h * scale) + 1)
+
+        painter.end()
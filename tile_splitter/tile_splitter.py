@@ -1,22 +1,33 @@
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QGraphicsScene, QGraphicsView, QFileDialog,
-                             QHBoxLayout, QPushButton, QLabel, QGraphicsPixmapItem, QMessageBox, QSpinBox, QShortcut)
+                             QHBoxLayout, QPushButton, QLabel, QGraphicsPixmapItem, QMessageBox, QSpinBox, QShortcut,
+                             QCheckBox)
 from PyQt5.QtGui import QPixmap, QPainter, QColor, QPen, QKeySequence
 from PyQt5.QtCore import Qt, QRectF
+import os
 
 from tile_splitter.tile_splitter_executor import TileSplitterWidget
 from utils.graphics_utils import draw_checkerboard_for_view, auto_fit_view
 from utils.controls_utils import apply_zoom, CtrlDragMixin
-from utils.grid_utils import draw_grid_ui
+from utils.grid_utils import draw_grid_ui, detect_grid_ui
 from utils.states_utils import save_state
+from utils.profiling_utils import profiled
+from utils.document_utils import DocumentMixin
+from utils.job_utils import start_job
+from utils.pixel_cache_utils import load_pixmap
 
-class TileSplitterWindow(QWidget):
-    def __init__(self, source_pixmap: QPixmap= None):
+class TileSplitterWindow(QWidget, DocumentMixin):
+    shares_history = False
+
+    def __init__(self, source_pixmap: QPixmap= None, document=None):
         super().__init__()
         self.setWindowTitle("Gestione Tile")
         self.view = GridGraphicsView()
         self.view.setScene(QGraphicsScene())
 
-        if source_pixmap:
+        if document is not None:
+            self.attach_document(document)
+            self.set_pixmap(document.pixmap())
+        elif source_pixmap:
             self.set_pixmap(source_pixmap)
         else:
             self.load_image()
@@ -47,27 +58,92 @@ class TileSplitterWindow(QWidget):
         self.grid_button.setFixedWidth(100)
         self.grid_button.clicked.connect(lambda: draw_grid_ui(self.view, self.grid_size_field, self.grid_button))
 
+        self.detect_grid_button = QPushButton("Rileva griglia")
+        self.detect_grid_button.setFixedWidth(100)
+        self.detect_grid_button.clicked.connect(
+            lambda: detect_grid_ui(self.view, self.grid_size_field, self.grid_button, self.grid_info_label)
+        )
+        self.grid_info_label = QLabel("")
+        self.grid_info_label.setAlignment(Qt.AlignCenter)
+
         self.separator_button = QPushButton("Avvia separazione")
         self.separator_button.setFixedWidth(100)
         self.separator_button.clicked.connect(self.open_tile_splitter)
 
+        # Tutti i tile del foglio, letto a bande direttamente dal file
+        self.split_all_button = QPushButton("Separa tutto")
+        self.split_all_button.setFixedWidth(100)
+        self.split_all_button.clicked.connect(self.split_all_tiles)
+
+        # Mappa di livello -> tileset di tile unici + mappa di indici
+        self.tilemap_button = QPushButton("Comprimi mappa")
+        self.tilemap_button.setFixedWidth(100)
+        self.tilemap_button.clicked.connect(self.compress_tilemap)
+
+        self.tilemap_flips_box = QCheckBox("Capovolti")
+        self.tilemap_flips_box.setToolTip("Considera uguali i tile capovolti in orizzontale o in verticale")
+
+        # Rilevamento automatico sprite (fogli irregolari)
+        gap_label = QLabel("Tolleranza:")
+        gap_label.setFixedWidth(60)
+
+        self.sprite_gap_field = QSpinBox()
+        self.sprite_gap_field.setRange(1, 64)
+        self.sprite_gap_field.setValue(2)
+        self.sprite_gap_field.setFixedWidth(40)
+
+        self.detect_sprites_button = QPushButton("Rileva sprite")
+        self.detect_sprites_button.setFixedWidth(100)
+        self.detect_sprites_button.clicked.connect(lambda: self.detect_sprites())
+
+        self.sprites_to_atlas_button = QPushButton("Sprite in Atlas")
+        self.sprites_to_atlas_button.setFixedWidth(100)
+        self.sprites_to_atlas_button.setEnabled(False)
+        self.sprites_to_atlas_button.clicked.connect(self.open_sprites_in_atlas)
+
+        self.detected_rects = []
+        self.detected_items = []
+
+        sprite_layout = QHBoxLayout()
+        sprite_layout.addWidget(gap_label)
+        sprite_layout.addWidget(self.sprite_gap_field)
+        sprite_layout.addWidget(self.detect_sprites_button)
+        sprite_layout.addWidget(self.sprites_to_atlas_button)
+        sprite_layout.setAlignment(Qt.AlignCenter)
+
         grid_layout = QHBoxLayout()
         grid_layout.addWidget(self.load_button)
         grid_layout.addWidget(grid_label)
         grid_layout.addWidget(self.grid_size_field)
         grid_layout.addWidget(self.grid_button)
+        grid_layout.addWidget(self.detect_grid_button)
         grid_layout.addWidget(self.separator_button)
+        grid_layout.addWidget(self.split_all_button)
+        grid_layout.addWidget(self.tilemap_button)
+        grid_layout.addWidget(self.tilemap_flips_box)
         grid_layout.setAlignment(Qt.AlignCenter)
 
         # Layout complessivo
         layout = QVBoxLayout()
         layout.addWidget(self.view)
         layout.addLayout(grid_layout)
+        layout.addWidget(self.grid_info_label)
+        layout.addLayout(sprite_layout)
         self.setLayout(layout)
 
         draw_checkerboard_for_view(self.view, self.tile_size)
 
 
+    def on_document_changed(self):
+        # Stessa immagine modificata altrove: si aggiorna il sorgente, selezione e vista restano
+        self.source_pixmap = self.document.pixmap()
+        if self.view.pixmap_item is not None:
+            self.view.pixmap_item.setPixmap(self.source_pixmap)
+
+    def closeEvent(self, event):
+        self.detach_document()
+        super().closeEvent(event)
+
     def set_pixmap(self, pixmap: QPixmap):
         self.source_pixmap = pixmap
         self.view.pixmap_item = QGraphicsPixmapItem(self.source_pixmap)
@@ -97,12 +173,117 @@ class TileSplitterWindow(QWidget):
         )
         self.separator_window.show()
 
-    
+    def split_all_tiles(self):
+        source = getattr(self, "source_path", None) or (self.document.path if self.document else None)
+        path, _ = QFileDialog.getOpenFileName(self, "Foglio da separare", source or "", "Immagini (*.png *.jpg *.bmp)")
+        if not path:
+            return
+        out_dir = QFileDialog.getExistingDirectory(self, "Cartella di destinazione")
+        if not out_dir:
+            return
+
+        from utils.stream_utils import split_sheet
+        tile_size = self.grid_size_field.value()
+        start_job(
+            lambda job: split_sheet(path, tile_size, out_dir, job),
+            owner=self, label="Separazione tile...", name="split_sheet",
+            on_result=lambda summary: self._on_sheet_split(summary, tile_size)
+        )
+
+    def _on_sheet_split(self, summary, tile_size):
+        # Il catalogo si aggiorna dal thread GUI
+        from utils.meta_utils import MetaUtils
+        for path in summary["saved"]:
+            MetaUtils.save_meta(path, tile_size, editable=True)
+
+        QMessageBox.information(
+            self, "Separazione completata",
+            f"{len(summary['saved'])} tile salvati, {summary['empty']} vuoti e "
+            f"{summary['duplicates']} duplicati saltati."
+        )
+
+    def compress_tilemap(self):
+        source = getattr(self, "source_path", None) or (self.document.path if self.document else None)
+        path, _ = QFileDialog.getOpenFileName(self, "Mappa da comprimere", source or "", "Immagini (*.png *.jpg *.bmp)")
+        if not path:
+            return
+        csv_filter = "Tileset + mappa CSV (*.png)"
+        tileset_path, selected_filter = QFileDialog.getSaveFileName(
+            self, "Salva tileset", "atlas_tileset.png", f"{csv_filter};;Tileset + mappa binaria (*.png)"
+        )
+        if not tileset_path:
+            return
+        # La mappa va accanto al tileset, con lo stesso nome
+        map_path = os.path.splitext(tileset_path)[0] + (".csv" if selected_filter == csv_filter else ".bin")
+
+        tile_size = self.grid_size_field.value()
+        flips = self.tilemap_flips_box.isChecked()
+        start_job(
+            self._tilemap_job, path, tile_size, flips, tileset_path, map_path,
+            owner=self, label="Compressione mappa...", name="compress_tilemap",
+            on_result=lambda stats: self._on_tilemap_saved(tileset_path, map_path, tile_size, stats)
+        )
+
+    @staticmethod
+    def _tilemap_job(job, path, tile_size, flips, tileset_path, map_path):
+        from utils.tilemap_utils import build_tilemap, save_tilemap
+        return save_tilemap(build_tilemap(path, tile_size, flips, job), tileset_path, map_path, job)
+
+    def _on_tilemap_saved(self, tileset_path, map_path, tile_size, stats):
+        # Il tileset è un atlas: un tile per sprite, nell'ordine degli indici della mappa
+        from utils.meta_utils import MetaUtils
+        from utils.tilemap_utils import tileset_sprites, format_tilemap_report
+        columns, rows = stats["columns"], stats["rows"]
+        MetaUtils.save_meta(
+            tileset_path, tile_size, editable=True, cols=columns, rows=rows, start_tile=[0, 0],
+            end_tile=[stats["unique"] % columns, stats["unique"] // columns],
+            sprites=tileset_sprites(stats["unique"], columns)
+        )
+        QMessageBox.information(
+            self, "Mappa compressa",
+            f"Tileset: {tileset_path}\nMappa: {map_path}\n\n" + format_tilemap_report(stats)
+        )
+
+    @profiled("detect_sprites", "analysis")
+    def detect_sprites(self):
+        if not getattr(self, "source_pixmap", None):
+            return
+
+        for item in self.detected_items:
+            self.view.scene().removeItem(item)
+        self.detected_items = []
+
+        from utils.sprite_detection_utils import detect_sprites
+        self.detected_rects = detect_sprites(self.source_pixmap.toImage(), gap=self.sprite_gap_field.value())
+
+        pen = QPen(QColor(0, 170, 255))
+        pen.setWidthF(0.0)
+        for rect in self.detected_rects:
+            item = self.view.scene().addRect(QRectF(rect), pen)
+            item.setZValue(11)
+            self.detected_items.append(item)
+
+        self.sprites_to_atlas_button.setEnabled(bool(self.detected_rects))
+        self.setWindowTitle(f"Gestione Tile - {len(self.detected_rects)} sprite rilevati")
+
+    def open_sprites_in_atlas(self):
+        if not self.detected_rects:
+            return
+
+        pixmaps = [self.source_pixmap.copy(rect) for rect in self.detected_rects]
+        paths = [f"sprite_{i:04d}.png" for i in range(len(pixmaps))]
+
+        from atlas.atlas_creator_widget import AtlasCreator
+        self.atlas_creator = AtlasCreator()
+        self.atlas_creator.load_images_from_pixmaps_and_paths(pixmaps, paths)
+        self.atlas_creator.show()
+
     def load_image(self):
         file, _ = QFileDialog.getOpenFileName(self, "Carica immagine", "", "Immagini (*.png *.jpg *.bmp)")
         if file:
-            pixmap = QPixmap(file)
+            pixmap = load_pixmap(file)
             if not pixmap.isNull():
+                self.source_path = file
                 self.set_pixmap(pixmap)
                 
 
@@ -1,14 +1,17 @@
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
-    QLineEdit, QMessageBox, QScrollArea, QFileDialog, QGridLayout
+    QLineEdit, QMessageBox, QFileDialog
 )
-from PyQt5.QtGui import QPixmap, QPainter
-from PyQt5.QtCore import QRect, Qt
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtCore import Qt
 
-from atlas.atlas_creator_widget import AtlasCreator
+from tile_splitter.tile_preview_widget import TileGridPreview
+from utils.array_utils import to_argb32, qimage_view, extract_tiles, repeat_tiles, array_to_qimage
 from utils.meta_utils import MetaUtils
+from utils.bundle_utils import write_tile_bundle
 from datetime import datetime
 import os
+from utils.profiling_utils import profiled
 
 class TileSplitterWidget(QWidget):
     def __init__(self, source_pixmap: QPixmap, selected_coords: set, tile_size: int):
@@ -18,6 +21,8 @@ class TileSplitterWidget(QWidget):
         self.selected_coords = selected_coords
         self.tile_size = tile_size
         self.generated_images = []
+        self.tile_pixmaps = []
+        self.repeat = (1, 1)
 
         self.resize(300, 400)
 
@@ -25,9 +30,9 @@ class TileSplitterWidget(QWidget):
         main_layout = QVBoxLayout()
         self.setLayout(main_layout)
 
-        self.tile_layout = QGridLayout()
+        self.tile_preview = TileGridPreview(cell_size=min(tile_size * 4, 96), max_columns=4)
         self.view_selected_tiles()
-        main_layout.addLayout(self.tile_layout)
+        main_layout.addWidget(self.tile_preview)
         
         controls_layout = QHBoxLayout()
         controls_layout.setAlignment(Qt.AlignCenter)
@@ -38,22 +43,26 @@ class TileSplitterWidget(QWidget):
         self.repeat_field = QLineEdit("4")
         self.repeat_field.setFixedWidth(40)
 
+        self.repeat_rows_label = QLabel("Righe:")
+        self.repeat_rows_label.setFixedWidth(40)
+
+        self.repeat_rows_field = QLineEdit("1")
+        self.repeat_rows_field.setFixedWidth(40)
+
         self.generate_button = QPushButton("Genera")
         self.generate_button.clicked.connect(self.handle_generate)
 
         controls_layout.addWidget(self.repeat_label)
         controls_layout.addWidget(self.repeat_field)
+        controls_layout.addWidget(self.repeat_rows_label)
+        controls_layout.addWidget(self.repeat_rows_field)
         controls_layout.addWidget(self.generate_button)
         main_layout.addLayout(controls_layout)
 
         # Area anteprima immagini generate
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.preview_container = QWidget()
-        self.preview_layout_output = QVBoxLayout(self.preview_container)
-        self.scroll_area.setWidget(self.preview_container)
-        self.scroll_area.setMinimumHeight(150)
-        main_layout.addWidget(self.scroll_area)
+        self.output_preview = TileGridPreview(cell_size=128)
+        self.output_preview.setMinimumHeight(150)
+        main_layout.addWidget(self.output_preview)
 
         self.button_layout = QHBoxLayout()
         self.button_layout.setAlignment(Qt.AlignCenter)
@@ -62,7 +71,12 @@ class TileSplitterWidget(QWidget):
         self.save_button = QPushButton("Salva immagini")
         self.save_button.setFixedWidth(100)
         self.save_button.setEnabled(False)
-        self.save_button.clicked.connect(self.save_images)
+        self.save_button.clicked.connect(lambda: self.save_images())
+
+        self.save_bundle_button = QPushButton("Salva bundle")
+        self.save_bundle_button.setFixedWidth(100)
+        self.save_bundle_button.setEnabled(False)
+        self.save_bundle_button.clicked.connect(lambda: self.save_bundle())
 
         self.load_button = QPushButton("Carica in Atlas")
         self.load_button.setFixedWidth(100)
@@ -70,92 +84,90 @@ class TileSplitterWidget(QWidget):
         self.load_button.clicked.connect(self.load_into_atlas)
 
         self.button_layout.addWidget(self.save_button)
+        self.button_layout.addWidget(self.save_bundle_button)
         self.button_layout.addWidget(self.load_button)
 
         main_layout.addLayout(self.button_layout)
 
     def view_selected_tiles(self):
-        max_cols = 4
-        tile_size = self.tile_size
-        scale = 4
-        for idx, (x, y) in enumerate(sorted(self.selected_coords)):
-            rect = QRect(x * tile_size, y * tile_size, tile_size, tile_size)
-            tile = self.source_pixmap.copy(rect)
-            tile = tile.scaled(tile_size * scale, tile_size * scale, Qt.KeepAspectRatio)
-            label = QLabel()
-            label.setPixmap(tile)
-            label.setFixedSize(tile.width() + 4, tile.height() + 4)
-            
-            row = idx // max_cols
-            col = idx % max_cols
-
-            self.tile_layout.addWidget(label, row, col)
+        # Un unico widget composito al posto di una QLabel per tile
+        self.tile_pixmaps = self.extract_tile_pixmaps()
+        self.tile_preview.set_tiles(self.tile_pixmaps)
 
     def handle_generate(self):
         try:
             repeat_count = int(self.repeat_field.text())
-            if repeat_count <= 0:
+            repeat_rows = int(self.repeat_rows_field.text())
+            if repeat_count <= 0 or repeat_rows <= 0:
                 raise ValueError
         except ValueError:
             QMessageBox.warning(self, "Errore", "Inserisci un numero valido di ripetizioni.")
             return
 
-        self.generated_images = self.generate_tile_images(repeat_count)
+        # Per l'anteprima bastano i tile singoli: le ripetizioni si materializzano solo quando servono
+        self.repeat = (repeat_count, repeat_rows)
+        self.generated_images = []
         self.update_output_preview()
+        self.load_button.setEnabled(True)
         self.save_button.setEnabled(True)
+        self.save_bundle_button.setEnabled(True)
 
-    def generate_tile_images(self, repeat_count):
-        
-        tile_size = self.tile_size
-        selected = sorted(self.selected_coords)
-        self.generated_images = []  
-
-        for x, y in selected:
-            tile = self.source_pixmap.copy(x * tile_size, y * tile_size, tile_size, tile_size)
-            result = QPixmap(tile_size * repeat_count, tile_size)
-            result.fill(Qt.transparent)
-            painter = QPainter(result)
-            for i in range(repeat_count):
-                painter.drawPixmap(i * tile_size, 0, tile)
-            painter.end()
-            self.generated_images.append(result)
+    def _selected_tiles_array(self):
+        image = to_argb32(self.source_pixmap.toImage())
+        tiles = extract_tiles(qimage_view(image), sorted(self.selected_coords), self.tile_size)
+        return tiles, image.format()
+
+    def extract_tile_pixmaps(self):
+        tiles, fmt = self._selected_tiles_array()
+        return [QPixmap.fromImage(array_to_qimage(tile, fmt)) for tile in tiles]
+
+    @profiled("generate_tiles", "tiles")
+    def generate_tile_images(self, repeat_count, repeat_rows=1):
+        # Tutti i tile selezionati in un unico blocco numpy, ripetuti in orizzontale e in verticale
+        tiles, fmt = self._selected_tiles_array()
+        patterns = repeat_tiles(tiles, repeat_count, repeat_rows)
+        self.generated_images = [QPixmap.fromImage(array_to_qimage(pattern, fmt)) for pattern in patterns]
 
         self.load_button.setEnabled(True)
         self.save_button.setEnabled(True)
+        self.save_bundle_button.setEnabled(True)
         return self.generated_images
+
+    def _ensure_generated_images(self):
+        if not self.generated_images and self.tile_pixmaps:
+            self.generate_tile_images(*self.repeat)
+        return self.generated_images
+
+    def iter_tile_images(self):
+        # Un tile ripetuto alla volta, per chi li scrive in streaming (bundle): niente lista completa in memoria
+        if self.generated_images:
+            yield from self.generated_images
+            return
+        tiles, fmt = self._selected_tiles_array()
+        cols, rows = self.repeat
+        for tile in tiles:
+            yield array_to_qimage(repeat_tiles(tile[None], cols, rows)[0], fmt)
     
     def load_into_atlas(self):
         
+        images = self._ensure_generated_images()
+        from atlas.atlas_creator_widget import AtlasCreator
         atlas = AtlasCreator()
-        paths = [f"img_{i}" for i in range(len(self.generated_images))]
-        atlas.view.show_images(self.generated_images, paths, start_idx=0)
+        paths = [f"img_{i}" for i in range(len(images))]
+        atlas.view.show_images(images, paths, start_idx=0)
         atlas.show()
 
     def update_output_preview(self):
-        
-        for i in reversed(range(self.preview_layout_output.count())):
-            widget = self.preview_layout_output.itemAt(i).widget()
-            if widget:
-                widget.setParent(None)
-
-        scale = 2
-        for img in self.generated_images:
-            scaled = img.scaled(
-                img.width() * scale, img.height() * scale,
-                Qt.KeepAspectRatio, Qt.SmoothTransformation
-            )
-            label = QLabel()
-            label.setPixmap(scaled)
-            label.setAlignment(Qt.AlignCenter)
-            self.preview_layout_output.addWidget(label)
+        self.output_preview.set_tiles(self.tile_pixmaps, self.repeat)
 
+    @profiled("save_tiles", "io")
     def save_images(self):
         dir_path = QFileDialog.getExistingDirectory(self, "Seleziona cartella")
         if not dir_path:
             return
 
-        for i, pixmap in enumerate(self.generated_images):
-            filename = self.get_unique_tile_name()
+        for i, pixmap in enumerate(self._ensure_generated_images()):
+            filename = self.get_unique_tile_name(index=i)
             full_path = os.path.join(dir_path, filename)
             pixmap.save(full_path, "PNG")
             MetaUtils.save_meta(
@@ -163,6 +175,25 @@ class TileSplitterWidget(QWidget):
             )
         QMessageBox.information(self, "Salvato", "Immagini salvate con successo.")
 
-    def get_unique_tile_name(self, prefix="tile"):
+    @profiled("save_bundle", "io")
+    def save_bundle(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Salva bundle", "tiles.zip", "Bundle tile (*.zip)")
+        if not path:
+            return
+
+        cols, rows = self.repeat
+        write_tile_bundle(
+            path,
+            self.iter_tile_images(),
+            self.tile_size,
+            extra={
+                "repeat": [cols, rows],
+                "source_tiles": [list(coord) for coord in sorted(self.selected_coords)],
+            }
+        )
+        QMessageBox.information(self, "Salvato", "Bundle salvato con successo.")
+
+    def get_unique_tile_name(self, prefix="tile", index=0):
+        # L'indice evita collisioni tra tile salvati nello stesso millisecondo
         ms_timestamp = int(datetime.now().timestamp() * 1000)
-        return f"{prefix}_{ms_timestamp}.png"
+        return f"{prefix}_{ms_timestamp}_{index:04d}.png"
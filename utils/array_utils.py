@@ -0,0 +1,115 @@
+import numpy as np
+from PyQt5.QtGui import QImage
+
+from utils.parallel_utils import mask_rect
+
+ARGB32_FORMATS = (QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied, QImage.Format_RGB32)
+
+
+def to_argb32(image: QImage) -> QImage:
+    # I formati a 32 bit restano come sono: niente conversioni (e arrotondamenti) inutili
+    if image.format() in ARGB32_FORMATS:
+        return image
+    return image.convertToFormat(QImage.Format_ARGB32)
+
+
+def qimage_to_array(image: QImage) -> np.ndarray:
+    # Copia (h, w) uint32, indipendente dalla QImage di origine
+    image = to_argb32(image)
+    return qimage_view(image).copy()
+
+
+def qimage_view(image: QImage) -> np.ndarray:
+    # Vista (h, w) uint32 sui pixel della QImage: valida finché la QImage resta viva
+    if image.format() not in ARGB32_FORMATS:
+        raise ValueError("qimage_view richiede una QImage a 32 bit (usa to_argb32)")
+    width, height = image.width(), image.height()
+    if width == 0 or height == 0:
+        return np.zeros((height, width), dtype=np.uint32)
+
+    ptr = image.bits()
+    ptr.setsize(image.byteCount())
+    stride = image.bytesPerLine() // 4
+    return np.frombuffer(ptr, dtype=np.uint32).reshape(height, stride)[:, :width]
+
+
+def array_to_qimage(array: np.ndarray, fmt=QImage.Format_ARGB32) -> QImage:
+    array = np.ascontiguousarray(array, dtype=np.uint32)
+    height, width = array.shape
+    image = QImage(array.data, width, height, width * 4, fmt)
+    # copy() stacca la QImage dal buffer numpy
+    return image.copy()
+
+
+def pad_to_multiple(array: np.ndarray, tile_size: int) -> np.ndarray:
+    height, width = array.shape[:2]
+    pad_h = (-height) % tile_size
+    pad_w = (-width) % tile_size
+    if not pad_h and not pad_w:
+        return array
+    return np.pad(array, ((0, pad_h), (0, pad_w)), mode="constant")
+
+
+def extract_tiles(array: np.ndarray, coords, tile_size: int) -> np.ndarray:
+    # Estrae in un colpo solo i tile (x, y) in un blocco (N, tile_size, tile_size)
+    array = pad_to_multiple(array, tile_size)
+    coords = np.asarray(list(coords), dtype=np.int64).reshape(-1, 2)
+    offsets = np.arange(tile_size)
+    ys = coords[:, 1, None] * tile_size + offsets
+    xs = coords[:, 0, None] * tile_size + offsets
+    return array[ys[:, :, None], xs[:, None, :]]
+
+
+def repeat_tiles(tiles: np.ndarray, cols: int, rows: int = 1) -> np.ndarray:
+    # (N, th, tw) -> (N, rows * th, cols * tw) senza cicli Python
+    return np.tile(tiles, (1, rows, cols))
+
+
+def replace_color(array: np.ndarray, target: int, replacement: int = 0) -> int:
+    # Sostituisce in place un valore ARGB esatto; ritorna quanti pixel sono cambiati
+    mask = array == np.uint32(target)
+    count = int(np.count_nonzero(mask))
+    if count:
+        array[mask] = np.uint32(replacement)
+    return count
+
+
+def color_key_band(band: np.ndarray, top: int, target: int, replacement: int = 0):
+    # Kernel per parallel_utils.run_bands: come replace_color, ma ritorna il rettangolo sporco della banda
+    mask = band == np.uint32(target)
+    if not mask.any():
+        return None
+    band[mask] = np.uint32(replacement)
+    return mask_rect(mask, top)
+
+
+def fill_tiles(array: np.ndarray, coords, tile_size: int, value) -> None:
+    # value: intero ARGB oppure funzione (x, y) -> intero, per colori diversi per tile
+    height, width = array.shape
+    for x, y in coords:
+        px, py = x * tile_size, y * tile_size
+        if px >= width or py >= height or px < 0 or py < 0:
+            continue
+        array[py:py + tile_size, px:px + tile_size] = np.uint32(value(x, y) if callable(value) else value)
+
+
+def move_tiles(array: np.ndarray, coords, offset, tile_size: int, fill) -> set:
+    # Prima si leggono tutti i tile, poi si puliscono le origini e infine si incollano:
+    # l'ordine delle coordinate non conta anche se origini e destinazioni si sovrappongono
+    height, width = array.shape
+    dx, dy = offset
+    blocks = [(x, y, array[y * tile_size:(y + 1) * tile_size, x * tile_size:(x + 1) * tile_size].copy())
+              for x, y in coords]
+    fill_tiles(array, coords, tile_size, fill)
+
+    moved = set()
+    for x, y, block in blocks:
+        nx, ny = x + dx, y + dy
+        px, py = nx * tile_size, ny * tile_size
+        if px < 0 or py < 0 or px >= width or py >= height:
+            continue
+        h = min(block.shape[0], height - py)
+        w = min(block.shape[1], width - px)
+        array[py:py + h, px:px + w] = block[:h, :w]
+        moved.add((nx, ny))
+    return moved
@@ -0,0 +1,95 @@
+import json
+import zipfile
+from datetime import datetime
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice
+from PyQt5.QtGui import QImage, QPixmap
+from utils.profiling_utils import profiled
+
+BUNDLE_INDEX = "index.json"
+BUNDLE_VERSION = 1
+
+
+def encode_png(image) -> bytes:
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "PNG")
+    buffer.close()
+    return bytes(data)
+
+
+def bundle_tile_name(index: int, prefix: str = "tile") -> str:
+    return f"{prefix}_{index:05d}.png"
+
+
+@profiled("write_bundle", "io")
+def write_tile_bundle(path: str, images, tile_size: int, prefix: str = "tile", extra=None) -> dict:
+    # Zip non compresso (i PNG lo sono già): ogni tile viene codificato e scritto subito,
+    # in memoria resta un solo PNG alla volta
+    tiles = []
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as bundle:
+        for index, image in enumerate(images):
+            name = bundle_tile_name(index, prefix)
+            bundle.writestr(name, encode_png(image))
+            tiles.append({"name": name, "width": image.width(), "height": image.height()})
+
+        index_data = {
+            "version": BUNDLE_VERSION,
+            "tile_size": tile_size,
+            "created_at": datetime.now().isoformat(),
+            "tiles": tiles,
+        }
+        if extra:
+            index_data.update(extra)
+        bundle.writestr(BUNDLE_INDEX, json.dumps(index_data, indent=4))
+
+    return index_data
+
+
+def _parse_index(bundle: zipfile.ZipFile) -> dict:
+    # KeyError se manca index.json (zip qualsiasi), ValueError se è illeggibile o di una versione sconosciuta
+    index = json.loads(bundle.read(BUNDLE_INDEX).decode("utf-8"))
+    if not isinstance(index, dict) or index.get("version") != BUNDLE_VERSION:
+        version = index.get("version") if isinstance(index, dict) else None
+        raise ValueError(f"versione del bundle non supportata: {version}")
+    return index
+
+
+def read_bundle_index(path: str) -> dict:
+    with zipfile.ZipFile(path, "r") as bundle:
+        return _parse_index(bundle)
+
+
+def read_bundle_image(path: str, name: str) -> QImage:
+    # Lettura diretta dal bundle, senza estrarre nulla su disco
+    with zipfile.ZipFile(path, "r") as bundle:
+        return QImage.fromData(bundle.read(name))
+
+
+def iter_bundle_images(path: str):
+    with zipfile.ZipFile(path, "r") as bundle:
+        index = _parse_index(bundle)
+        for tile in index["tiles"]:
+            yield tile["name"], QImage.fromData(bundle.read(tile["name"]))
+
+
+def load_bundle_handles(path: str):
+    # Handle senza pixel: ogni tile viene riletto dallo zip quando serve
+    from utils.image_handle_utils import ImageHandle
+
+    handles, names = [], []
+    for tile in read_bundle_index(path)["tiles"]:
+        name = tile["name"]
+        loader = lambda name=name: read_bundle_image(path, name)
+        handles.append(ImageHandle(f"{path}/{name}", tile["width"], tile["height"], loader=loader))
+        names.append(name)
+    return handles, names
+
+
+def load_bundle_pixmaps(path: str):
+    names, pixmaps = [], []
+    for name, image in iter_bundle_images(path):
+        names.append(name)
+        pixmaps.append(QPixmap.fromImage(image))
+    return pixmaps, names
@@ -0,0 +1,454 @@
+import json
+import os
+import sqlite3
+import threading
+
+from PyQt5.QtGui import QImageReader
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QSpinBox, QComboBox,
+                             QListWidget, QFileDialog, QMessageBox)
+
+from utils.import_utils import IMAGE_EXTENSIONS
+from utils.watch_utils import hash_file
+
+CATALOG_ENV = "SPRITYLE_CATALOG"
+META_SUFFIX = ".meta.json"
+# Oltre questa dimensione i file si indicizzano senza hash: serve a riconoscere sprite identici, non gli atlas
+HASH_LIMIT = 16 * 1024 * 1024
+# Parametri per query IN (...): sotto il limite di SQLite anche nelle build vecchie
+QUERY_CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER,
+    width INTEGER,
+    height INTEGER,
+    content_hash TEXT,
+    tile_size INTEGER,
+    is_atlas INTEGER NOT NULL DEFAULT 0,
+    meta TEXT,
+    meta_mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS atlas_sprites (
+    atlas_path TEXT NOT NULL,
+    sprite TEXT NOT NULL,
+    x INTEGER, y INTEGER, w INTEGER, h INTEGER,
+    PRIMARY KEY (atlas_path, sprite)
+);
+CREATE INDEX IF NOT EXISTS idx_assets_tile_size ON assets(tile_size);
+CREATE INDEX IF NOT EXISTS idx_assets_hash ON assets(content_hash);
+CREATE INDEX IF NOT EXISTS idx_assets_dims ON assets(width, height);
+CREATE INDEX IF NOT EXISTS idx_atlas_sprites_sprite ON atlas_sprites(sprite);
+"""
+
+
+def default_catalog_path() -> str:
+    return os.environ.get(CATALOG_ENV) or os.path.join(os.path.expanduser("~"), ".sprityle", "catalog.sqlite3")
+
+
+def catalog_key(path: str) -> str:
+    return os.path.abspath(path).replace("\\", "/")
+
+
+def _has_atlas_prefix(path: str) -> bool:
+    return os.path.basename(path).lower().startswith("atlas_")
+
+
+def _meta_is_atlas(meta) -> bool:
+    return bool(meta) and ("sprites" in meta or "cols" in meta)
+
+
+class AssetCatalog:
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        # None se il database non è utilizzabile: MetaUtils ripiega sui soli file JSON
+        with cls._instance_lock:
+            if cls._instance is None:
+                try:
+                    cls._instance = cls(default_catalog_path())
+                except (sqlite3.Error, OSError) as e:
+                    print(f"[AssetCatalog] Catalogo non disponibile: {e}")
+                    cls._instance = False
+            return cls._instance or None
+
+    @classmethod
+    def existing(cls):
+        # Come instance(), ma senza creare il database: per i controlli che non devono avere effetti
+        if cls._instance is None and not os.path.exists(default_catalog_path()):
+            return None
+        return cls.instance()
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- Meta -------------------------------------------------------------
+
+    def get_meta(self, image_path: str):
+        # Ritorna il meta se il catalogo è allineato con il file JSON (stesso mtime) o se il JSON non c'è
+        key = catalog_key(image_path)
+        with self._lock:
+            row = self._conn.execute("SELECT meta, meta_mtime_ns FROM assets WHERE path = ?", (key,)).fetchone()
+
+        meta_path = image_path + META_SUFFIX
+        try:
+            json_mtime = os.stat(meta_path).st_mtime_ns
+        except OSError:
+            json_mtime = None
+
+        if row and row["meta"] is not None and (json_mtime is None or row["meta_mtime_ns"] == json_mtime):
+            return json.loads(row["meta"])
+
+        if json_mtime is None:
+            return None
+
+        # JSON più recente (o mai indicizzato): si reimporta
+        return self.sync_meta_file(image_path)
+
+    def sync_meta_file(self, image_path: str):
+        meta_path = image_path + META_SUFFIX
+        try:
+            mtime = os.stat(meta_path).st_mtime_ns
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[AssetCatalog] Errore lettura meta: {e}")
+            return None
+        self.put_meta(image_path, meta, mtime)
+        return meta
+
+    def put_meta(self, image_path: str, meta: dict, meta_mtime_ns=None):
+        key = catalog_key(image_path)
+        is_atlas = int(_has_atlas_prefix(key) or _meta_is_atlas(meta))
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO assets (path, tile_size, is_atlas, meta, meta_mtime_ns)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    tile_size = excluded.tile_size,
+                    is_atlas = excluded.is_atlas,
+                    meta = excluded.meta,
+                    meta_mtime_ns = excluded.meta_mtime_ns
+                """,
+                (key, meta.get("tile_size"), is_atlas, json.dumps(meta), meta_mtime_ns)
+            )
+            self._conn.execute("DELETE FROM atlas_sprites WHERE atlas_path = ?", (key,))
+            sprites = meta.get("sprites") or {}
+            self._conn.executemany(
+                "INSERT INTO atlas_sprites (atlas_path, sprite, x, y, w, h) VALUES (?, ?, ?, ?, ?, ?)",
+                [(key, catalog_key(sprite) if os.path.isabs(sprite) else sprite, *slot[:4])
+                 for sprite, slot in sprites.items()]
+            )
+
+    # --- Indicizzazione ---------------------------------------------------
+
+    def index_file(self, path: str, stat=None):
+        key = catalog_key(path)
+        stat = stat or os.stat(path)
+        with self._lock:
+            row = self._conn.execute("SELECT mtime_ns, size FROM assets WHERE path = ?", (key,)).fetchone()
+        if row and row["mtime_ns"] == stat.st_mtime_ns and row["size"] == stat.st_size:
+            changed = False
+        else:
+            # Solo l'header: dimensioni senza decodificare i pixel
+            size = QImageReader(path).size()
+            digest = hash_file(path) if stat.st_size <= HASH_LIMIT else None
+            self.record_files([(path, stat, size.width(), size.height(), digest)])
+            changed = True
+
+        # Il sidecar viene riletto solo se il suo mtime è cambiato
+        self.get_meta(path)
+        return changed
+
+    def record_files(self, entries):
+        # entries: (path, stat, larghezza, altezza, hash) di file già letti (import): nessuna rilettura
+        rows = [(catalog_key(path), stat.st_mtime_ns, stat.st_size, width, height, digest,
+                 int(_has_atlas_prefix(path))) for path, stat, width, height, digest in entries]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """
+                INSERT INTO assets (path, mtime_ns, size, width, height, content_hash, is_atlas)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    mtime_ns = excluded.mtime_ns,
+                    size = excluded.size,
+                    width = excluded.width,
+                    height = excluded.height,
+                    content_hash = excluded.content_hash,
+                    is_atlas = MAX(assets.is_atlas, excluded.is_atlas)
+                """,
+                rows
+            )
+
+    def forget(self, paths):
+        keys = [(catalog_key(path),) for path in paths]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM assets WHERE path = ?", keys)
+            self._conn.executemany("DELETE FROM atlas_sprites WHERE atlas_path = ?", keys)
+
+    def index_directory(self, folder: str, job=None) -> dict:
+        stats = {"indexed": 0, "unchanged": 0, "removed": 0}
+        seen = set()
+        for root, _, files in os.walk(folder):
+            for name in files:
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if job is not None:
+                    job.check()
+                path = os.path.join(root, name)
+                try:
+                    changed = self.index_file(path)
+                except OSError:
+                    continue
+                seen.add(catalog_key(path))
+                stats["indexed" if changed else "unchanged"] += 1
+
+        # Via dal catalogo i file spariti da questa cartella
+        prefix = catalog_key(folder).rstrip("/") + "/"
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT path FROM assets WHERE path >= ? AND path < ? AND mtime_ns IS NOT NULL",
+                (prefix, prefix + "\uffff")
+            ).fetchall()
+            gone = [(row["path"],) for row in rows if row["path"] not in seen]
+            self._conn.executemany("DELETE FROM assets WHERE path = ?", gone)
+            self._conn.executemany("DELETE FROM atlas_sprites WHERE atlas_path = ?", gone)
+        stats["removed"] = len(gone)
+        return stats
+
+    # --- Query ------------------------------------------------------------
+
+    def is_atlas(self, path: str):
+        with self._lock:
+            row = self._conn.execute("SELECT is_atlas FROM assets WHERE path = ?", (catalog_key(path),)).fetchone()
+        return None if row is None else bool(row["is_atlas"])
+
+    def atlas_paths(self, paths) -> set:
+        # Quali tra i path sono atlas per il catalogo: una query ogni QUERY_CHUNK path, non una per file
+        keys = {}
+        for path in paths:
+            keys.setdefault(catalog_key(path), []).append(path)
+        found = set()
+        key_list = list(keys)
+        with self._lock:
+            for start in range(0, len(key_list), QUERY_CHUNK):
+                chunk = key_list[start:start + QUERY_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT path FROM assets WHERE is_atlas = 1 AND path IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for row in rows:
+                    found.update(keys[row["path"]])
+        return found
+
+    def find_assets(self, tile_size=None, width=None, height=None, is_atlas=None, content_hash=None, limit=None):
+        clauses, params = [], []
+        for column, value in (("tile_size", tile_size), ("width", width), ("height", height),
+                              ("content_hash", content_hash)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if is_atlas is not None:
+            clauses.append("is_atlas = ?")
+            params.append(int(is_atlas))
+
+        query = "SELECT path, width, height, tile_size, is_atlas, content_hash FROM assets"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY path"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, params)]
+
+    def atlases_containing(self, sprite_path: str):
+        # Per path dello sprite o per contenuto identico (stesso hash) salvato altrove. Le voci salvate con un
+        # path relativo valgono dalla cartella dell'atlas: un file omonimo altrove non è lo stesso sprite
+        key = catalog_key(sprite_path)
+        name = os.path.basename(key)
+        like = "%/" + name.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT DISTINCT s.atlas_path FROM atlas_sprites s
+                WHERE s.sprite = ?
+                   OR s.sprite IN (
+                       SELECT other.path FROM assets other
+                       JOIN assets me ON me.content_hash = other.content_hash
+                       WHERE me.path = ? AND me.content_hash IS NOT NULL
+                   )
+                """,
+                (key, key)
+            ).fetchall()
+            relative = self._conn.execute(
+                """
+                SELECT atlas_path, sprite FROM atlas_sprites
+                WHERE (sprite = ? OR sprite LIKE ? ESCAPE '!') AND sprite NOT LIKE '/%'
+                """,
+                (name, like)
+            ).fetchall()
+        atlases = {row["atlas_path"] for row in rows}
+        atlases.update(row["atlas_path"] for row in relative
+                       if catalog_key(os.path.join(os.path.dirname(row["atlas_path"]), row["sprite"])) == key)
+        return sorted(atlases)
+
+
+def index_imported(entries):
+    # Dal thread GUI, a blocchi: file appena decodificati dall'import, con hash e dimensioni già noti
+    catalog = AssetCatalog.instance()
+    if not catalog or not entries:
+        return
+    try:
+        catalog.record_files(entries)
+    except sqlite3.Error as e:
+        print(f"[AssetCatalog] Errore indicizzazione: {e}")
+
+
+def forget_files(paths):
+    # File spariti da disco (cartelle osservate): il catalogo si tocca solo se esiste già
+    catalog = AssetCatalog.existing()
+    if not catalog or not paths:
+        return
+    try:
+        catalog.forget(paths)
+    except sqlite3.Error as e:
+        print(f"[AssetCatalog] Errore rimozione: {e}")
+
+
+def index_directory_job(job, catalog, folder):
+    return catalog.index_directory(folder, job=job)
+
+
+class CatalogPanel(QWidget):
+    # Query sul catalogo: asset per tile size e dimensioni, atlas che contengono uno sprite
+    MAX_RESULTS = 1000
+    KINDS = (("Tutti", None), ("Solo sprite", False), ("Solo atlas", True))
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Catalogo asset")
+        self.resize(640, 480)
+
+        self.index_button = QPushButton("Indicizza cartella...")
+        self.index_button.clicked.connect(self.index_folder)
+        self.containing_button = QPushButton("Atlas che contengono...")
+        self.containing_button.clicked.connect(self.find_containing)
+
+        self.tile_size_spin = self._any_spin(256)
+        self.width_spin = self._any_spin(16384)
+        self.height_spin = self._any_spin(16384)
+        self.kind_combo = QComboBox()
+        for label, _ in self.KINDS:
+            self.kind_combo.addItem(label)
+        self.search_button = QPushButton("Cerca")
+        self.search_button.clicked.connect(self.search)
+
+        self.results = QListWidget()
+        self.status_label = QLabel("")
+
+        top_layout = QHBoxLayout()
+        top_layout.addWidget(self.index_button)
+        top_layout.addWidget(self.containing_button)
+        top_layout.addStretch()
+
+        search_layout = QHBoxLayout()
+        search_layout.addWidget(QLabel("Tile size:"))
+        search_layout.addWidget(self.tile_size_spin)
+        search_layout.addWidget(QLabel("Larghezza:"))
+        search_layout.addWidget(self.width_spin)
+        search_layout.addWidget(QLabel("Altezza:"))
+        search_layout.addWidget(self.height_spin)
+        search_layout.addWidget(self.kind_combo)
+        search_layout.addWidget(self.search_button)
+
+        layout = QVBoxLayout()
+        layout.addLayout(top_layout)
+        layout.addLayout(search_layout)
+        layout.addWidget(self.results)
+        layout.addWidget(self.status_label)
+        self.setLayout(layout)
+
+    @staticmethod
+    def _any_spin(maximum):
+        # 0 = qualsiasi valore
+        spin = QSpinBox()
+        spin.setRange(0, maximum)
+        spin.setSpecialValueText("Qualsiasi")
+        return spin
+
+    def _catalog(self):
+        catalog = AssetCatalog.instance()
+        if not catalog:
+            QMessageBox.warning(self, "Errore", "Catalogo non disponibile.")
+        return catalog
+
+    def _show(self, paths, message):
+        self.results.clear()
+        self.results.addItems(paths)
+        self.status_label.setText(message)
+
+    def search(self):
+        catalog = self._catalog()
+        if not catalog:
+            return
+        rows = catalog.find_assets(
+            tile_size=self.tile_size_spin.value() or None,
+            width=self.width_spin.value() or None,
+            height=self.height_spin.value() or None,
+            is_atlas=self.KINDS[self.kind_combo.currentIndex()][1],
+            limit=self.MAX_RESULTS
+        )
+        paths = [f"{row['path']}  ({row['width'] or '?'}x{row['height'] or '?'})" for row in rows]
+        more = " (primi risultati)" if len(rows) == self.MAX_RESULTS else ""
+        self._show(paths, f"{len(rows)} asset{more}")
+
+    def find_containing(self):
+        catalog = self._catalog()
+        if not catalog:
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Sprite", "", "Immagini (*.png *.jpg *.jpeg *.bmp)")
+        if not path:
+            return
+        try:
+            # Lo sprite stesso va indicizzato per il confronto per contenuto
+            catalog.index_file(path)
+        except OSError:
+            pass
+        atlases = catalog.atlases_containing(path)
+        self._show(atlases, f"{len(atlases)} atlas contengono {os.path.basename(path)}")
+
+    def index_folder(self):
+        catalog = self._catalog()
+        if not catalog:
+            return
+        folder = QFileDialog.getExistingDirectory(self, "Cartella da indicizzare")
+        if not folder:
+            return
+        from utils.job_utils import start_job
+        self.status_label.setText("Indicizzazione in corso...")
+        start_job(
+            index_directory_job, catalog, folder,
+            owner=self, label="Indicizzazione catalogo...", name="index_directory",
+            on_result=lambda stats: self.status_label.setText(
+                f"{stats['indexed']} indicizzati, {stats['unchanged']} invariati, {stats['removed']} rimossi"
+            ),
+            on_error=lambda _: self.status_label.setText("Errore durante l'indicizzazione"),
+            on_cancel=lambda: self.status_label.setText("Indicizzazione annullata"),
+        )
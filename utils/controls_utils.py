@@ -3,6 +3,11 @@ from PyQt5.QtCore import Qt, QRectF
 from PyQt5.QtGui import QPixmap, QColor, QPen
 import os
 
+from utils.pixel_cache_utils import load_pixmap as load_cached_pixmap
+
+# Filtro del dialogo di salvataggio per il PNG a 8 bit con palette (utils.palette_utils)
+INDEXED_PNG_FILTER = "PNG indicizzato 8 bit (*.png)"
+
 
 class CtrlDragMixin:
     def handle_drag_press(self, event):
@@ -74,7 +79,7 @@ def load_pixmap(parent, pixmap: QPixmap = None) -> QPixmap:
     if not file_path:
         return None
 
-    loaded_pixmap = QPixmap(file_path)
+    loaded_pixmap = load_cached_pixmap(file_path)
     if loaded_pixmap.isNull():
         QMessageBox.warning(parent, "Errore", "Immagine non valida.")
         return None
@@ -82,28 +87,71 @@ def load_pixmap(parent, pixmap: QPixmap = None) -> QPixmap:
     return loaded_pixmap
 
 
-def save_pixmap_dialog(parent, pixmap: QPixmap, label="img"):
+def save_pixmap_dialog(parent, pixmap: QPixmap, label="img", on_saved=None):
+    # on_saved(path, stats): a salvataggio concluso; stats è il resoconto dell'export indicizzato, altrimenti None
     if not pixmap or pixmap.isNull():
         QMessageBox.warning(parent, "Errore", "Nessuna immagine da salvare.")
         return
 
-    file_path, _ = QFileDialog.getSaveFileName(
+    file_path, selected_filter = QFileDialog.getSaveFileName(
         parent,
         "Salva immagine",
         f"{label}.png",
-        "PNG (*.png);;JPEG (*.jpg *.jpeg);;BMP (*.bmp)"
+        f"PNG (*.png);;{INDEXED_PNG_FILTER};;JPEG (*.jpg *.jpeg);;BMP (*.bmp)"
     )
     if file_path:
-        pixmap.save(file_path)
-        QMessageBox.information(parent, "Salvataggio completato", "Immagine salvata con successo.")
+        # Codifica e scrittura nel pool; il messaggio arriva a salvataggio concluso
+        from utils.job_utils import start_job
+        job_fn = _save_indexed_image_job if selected_filter == INDEXED_PNG_FILTER else _save_image_job
+        start_job(
+            job_fn, pixmap.toImage(), file_path,
+            owner=parent, label="Salvataggio immagine...", name="save_image_job",
+            on_result=lambda result: _on_image_saved(parent, file_path, result, on_saved)
+        )
         return file_path
     return None
 
+def _save_image_job(job, image, path):
+    return image.save(path)
+
+def _save_indexed_image_job(job, image, path):
+    from utils.palette_utils import write_indexed_image
+    return write_indexed_image(path, image, job=job)
+
+def _on_image_saved(parent, path, result, on_saved=None):
+    if not result:
+        QMessageBox.warning(parent, "Errore", "Impossibile salvare l'immagine.")
+        return
+
+    stats = result if isinstance(result, dict) else None
+    if on_saved:
+        on_saved(path, stats)
+    message = "Immagine salvata con successo."
+    if stats:
+        from utils.palette_utils import format_export_report
+        message += "\n\n" + format_export_report(stats)
+    QMessageBox.information(parent, "Salvataggio completato", message)
+
+def has_atlas_prefix(file_path: str) -> bool:
+    return bool(file_path) and os.path.basename(file_path).lower().startswith("atlas_")
+
+
+def atlas_files(paths) -> set:
+    # Atlas tra i path: prima il prefisso, poi per gli altri una sola query al catalogo (atlas salvati con
+    # un altro nome, riconosciuti dal loro meta). Il catalogo si consulta solo se esiste già
+    atlases = {path for path in paths if has_atlas_prefix(path)}
+    rest = [path for path in paths if path and path not in atlases]
+    if rest:
+        from utils.catalog_utils import AssetCatalog
+        catalog = AssetCatalog.existing()
+        if catalog:
+            atlases.update(catalog.atlas_paths(rest))
+    return atlases
+
+
 def is_atlas_file(file_path: str) -> bool:
-    if not file_path:
-        return False
-    filename = os.path.basename(file_path).lower()
-    return filename.startswith("atlas_")
+    # Un file solo (documento aperto, meta da salvare); per gli elenchi di file usare atlas_files
+    return bool(file_path) and bool(atlas_files([file_path]))
 
 
 
@@ -0,0 +1,340 @@
+import math
+import os
+import struct
+
+import numpy as np
+
+from utils.parallel_utils import run_bands, BAND_BYTES
+from utils.stream_utils import remove_partial
+
+FORMAT_BC1 = "BC1"
+FORMAT_BC3 = "BC3"
+FOURCC = {FORMAT_BC1: b"DXT1", FORMAT_BC3: b"DXT5"}
+BLOCK_BYTES = {FORMAT_BC1: 8, FORMAT_BC3: 16}
+
+# Manopola qualità/velocità dell'encoder:
+#   veloce:  estremi dal bounding box dei colori del blocco
+#   normale: estremi lungo l'asse principale (PCA) dei colori
+#   alta:    PCA più raffinamenti ai minimi quadrati degli estremi
+QUALITY_FAST = 0
+QUALITY_NORMAL = 1
+QUALITY_HIGH = 2
+QUALITY_LABELS = {QUALITY_FAST: "Veloce", QUALITY_NORMAL: "Normale", QUALITY_HIGH: "Alta"}
+REFINE_STEPS = 2
+POWER_ITERATIONS = 4
+
+# Righe di pixel per banda in esportazione (multiplo di 4): circa 16 MB di sorgente alla volta
+EXPORT_BAND_BYTES = 16 << 20
+# In BC1 i pixel con alpha sotto soglia diventano trasparenti (modalità a 3 colori)
+BC1_ALPHA_THRESHOLD = 128
+
+DDSD_FLAGS = 0x1 | 0x2 | 0x4 | 0x1000 | 0x80000  # CAPS, HEIGHT, WIDTH, PIXELFORMAT, LINEARSIZE
+DDPF_FOURCC = 0x4
+DDSCAPS_TEXTURE = 0x1000
+
+# Frazione verso c1 dei codici 0..3: modalità a 4 colori e a 3 colori (il codice 3 è il trasparente)
+T_FOUR = np.array([0.0, 1.0, 1 / 3, 2 / 3], dtype=np.float32)
+T_THREE = np.array([0.0, 1.0, 0.5, 0.0], dtype=np.float32)
+
+
+def dds_header(width: int, height: int, fmt: str) -> bytes:
+    linear_size = math.ceil(width / 4) * math.ceil(height / 4) * BLOCK_BYTES[fmt]
+    pixel_format = struct.pack("<II4s5I", 32, DDPF_FOURCC, FOURCC[fmt], 0, 0, 0, 0, 0)
+    header = struct.pack("<7I44x", 124, DDSD_FLAGS, height, width, linear_size, 0, 1)
+    caps = struct.pack("<5I", DDSCAPS_TEXTURE, 0, 0, 0, 0)
+    return b"DDS " + header + pixel_format + caps
+
+
+# --- Blocchi -------------------------------------------------------------------
+
+def to_blocks(pixels: np.ndarray) -> np.ndarray:
+    # (h, w) uint32 ARGB -> (n, 16, 4) float32 RGBA, blocchi 4x4 in ordine di riga; i bordi si replicano
+    height, width = pixels.shape
+    pad_h, pad_w = (-height) % 4, (-width) % 4
+    if pad_h or pad_w:
+        pixels = np.pad(pixels, ((0, pad_h), (0, pad_w)), mode="edge")
+    rows, cols = pixels.shape[0] // 4, pixels.shape[1] // 4
+    blocks = pixels.reshape(rows, 4, cols, 4).transpose(0, 2, 1, 3).reshape(-1, 16)
+    shifts = np.array([16, 8, 0, 24], dtype=np.uint32)
+    return ((blocks[..., None] >> shifts) & 0xFF).astype(np.float32)
+
+
+def from_blocks(rgba: np.ndarray, width: int, height: int) -> np.ndarray:
+    # Inverso di to_blocks: (n, 16, 4) RGBA -> (h, w) uint32 ARGB, tagliando il padding
+    cols, rows = math.ceil(width / 4), math.ceil(height / 4)
+    values = np.clip(np.rint(rgba), 0, 255).astype(np.uint32)
+    argb = (values[..., 3] << 24) | (values[..., 0] << 16) | (values[..., 1] << 8) | values[..., 2]
+    pixels = argb.reshape(rows, cols, 4, 4).transpose(0, 2, 1, 3).reshape(rows * 4, cols * 4)
+    return pixels[:height, :width]
+
+
+def _to_565(colors: np.ndarray) -> np.ndarray:
+    r = np.rint(np.clip(colors[..., 0], 0, 255) * 31 / 255).astype(np.uint16)
+    g = np.rint(np.clip(colors[..., 1], 0, 255) * 63 / 255).astype(np.uint16)
+    b = np.rint(np.clip(colors[..., 2], 0, 255) * 31 / 255).astype(np.uint16)
+    return (r << 11) | (g << 5) | b
+
+
+def _from_565(values: np.ndarray) -> np.ndarray:
+    values = values.astype(np.uint32)
+    r, g, b = (values >> 11) & 31, (values >> 5) & 63, values & 31
+    return np.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)), axis=-1).astype(np.float32)
+
+
+def _color_palette(c0: np.ndarray, c1: np.ndarray, three_color: np.ndarray) -> np.ndarray:
+    # (n, 4, 3): come lo ricostruisce il decoder, in aritmetica intera
+    c0, c1 = c0.astype(np.int32), c1.astype(np.int32)
+    four = np.stack((c0, c1, (2 * c0 + c1) // 3, (c0 + 2 * c1) // 3), axis=1)
+    three = np.stack((c0, c1, (c0 + c1) // 2, np.zeros_like(c0)), axis=1)
+    return np.where(three_color[:, None, None], three, four).astype(np.float32)
+
+
+def _masked_stats(rgb, weights):
+    total = np.maximum(weights.sum(axis=1, keepdims=True), 1e-6)
+    mean = (rgb * weights[..., None]).sum(axis=1) / total
+    low = np.where(weights[..., None] > 0, rgb, np.inf).min(axis=1)
+    high = np.where(weights[..., None] > 0, rgb, -np.inf).max(axis=1)
+    empty = weights.sum(axis=1) == 0
+    low[empty], high[empty] = 0, 0
+    return mean, low, high
+
+
+def _pca_endpoints(rgb, weights, mean, low, high):
+    centered = (rgb - mean[:, None, :]) * weights[..., None]
+    cov = np.einsum("nki,nkj->nij", centered, rgb - mean[:, None, :])
+    axis = high - low + 1e-3
+    for _ in range(POWER_ITERATIONS):
+        axis = np.einsum("nij,nj->ni", cov, axis)
+        axis /= np.maximum(np.linalg.norm(axis, axis=1, keepdims=True), 1e-6)
+    t = ((rgb - mean[:, None, :]) * axis[:, None, :]).sum(axis=2)
+    t_min = np.where(weights > 0, t, np.inf).min(axis=1, initial=np.inf)
+    t_max = np.where(weights > 0, t, -np.inf).max(axis=1, initial=-np.inf)
+    t_min = np.where(np.isfinite(t_min), t_min, 0)
+    t_max = np.where(np.isfinite(t_max), t_max, 0)
+    return mean + axis * t_max[:, None], mean + axis * t_min[:, None]
+
+
+def _fit_indices(rgb, weights, c0_565, c1_565, three_color):
+    palette = _color_palette(_from_565(c0_565), _from_565(c1_565), three_color)
+    distance = ((rgb[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=3)
+    if three_color.any():
+        # Il codice 3 (trasparente) è riservato ai pixel trasparenti
+        distance[three_color, :, 3] = np.inf
+    codes = distance.argmin(axis=2)
+    error = (np.take_along_axis(distance, codes[..., None], axis=2)[..., 0] * weights).sum(axis=1)
+    transparent = three_color[:, None] & (weights == 0)
+    codes = np.where(transparent, 3, codes)
+    return codes.astype(np.uint32), error
+
+
+def _order_endpoints(c0_565, c1_565, three_color):
+    # 4 colori: c0 > c1; 3 colori (punch-through): c0 <= c1
+    swap = np.where(three_color, c0_565 > c1_565, c0_565 < c1_565)
+    return np.where(swap, c1_565, c0_565), np.where(swap, c0_565, c1_565)
+
+
+def _refine(rgb, weights, codes, three_color):
+    # Minimi quadrati su c0, c1 dati i codici: sum w * |(1 - t) c0 + t c1 - x|^2
+    t = np.where(three_color[:, None], T_THREE[codes], T_FOUR[codes]) * weights
+    s = (1 - np.where(three_color[:, None], T_THREE[codes], T_FOUR[codes])) * weights
+    aa, bb, ab = (s * s).sum(axis=1), (t * t).sum(axis=1), (s * t).sum(axis=1)
+    ax, bx = (s[..., None] * rgb).sum(axis=1), (t[..., None] * rgb).sum(axis=1)
+    det = aa * bb - ab * ab
+    ok = np.abs(det) > 1e-6
+    det = np.where(ok, det, 1)[:, None]
+    c0 = (bb[:, None] * ax - ab[:, None] * bx) / det
+    c1 = (aa[:, None] * bx - ab[:, None] * ax) / det
+    return c0, c1, ok
+
+
+def encode_color_blocks(blocks: np.ndarray, quality: int = QUALITY_NORMAL, punch_through: bool = False):
+    # (n, 16, 4) RGBA -> (c0, c1, codici) BC1; punch_through usa la modalità a 3 colori nei blocchi con trasparenza
+    rgb = blocks[..., :3]
+    if punch_through:
+        weights = (blocks[..., 3] >= BC1_ALPHA_THRESHOLD).astype(np.float32)
+        three_color = (weights == 0).any(axis=1)
+    else:
+        weights = np.ones(blocks.shape[:2], dtype=np.float32)
+        three_color = np.zeros(len(blocks), dtype=bool)
+
+    mean, low, high = _masked_stats(rgb, weights)
+    if quality == QUALITY_FAST:
+        start, end = high, low
+    else:
+        start, end = _pca_endpoints(rgb, weights, mean, low, high)
+
+    c0, c1 = _order_endpoints(_to_565(start), _to_565(end), three_color)
+    codes, error = _fit_indices(rgb, weights, c0, c1, three_color)
+
+    if quality >= QUALITY_HIGH:
+        for _ in range(REFINE_STEPS):
+            start, end, ok = _refine(rgb, weights, codes, three_color)
+            r0, r1 = _order_endpoints(_to_565(start), _to_565(end), three_color)
+            r_codes, r_error = _fit_indices(rgb, weights, r0, r1, three_color)
+            # Si tiene il raffinamento solo dove migliora davvero
+            better = ok & (r_error < error)
+            c0, c1 = np.where(better, r0, c0), np.where(better, r1, c1)
+            codes = np.where(better[:, None], r_codes, codes)
+            error = np.where(better, r_error, error)
+    return c0, c1, codes
+
+
+def encode_alpha_blocks(alpha: np.ndarray):
+    # (n, 16) -> (a0, a1, codici) BC3, modalità a 8 valori (a0 > a1)
+    a0 = alpha.max(axis=1).astype(np.int32)
+    a1 = alpha.min(axis=1).astype(np.int32)
+    palette = _alpha_palette(a0, a1)
+    codes = np.abs(alpha[:, :, None] - palette[:, None, :]).argmin(axis=2)
+    return a0.astype(np.uint8), a1.astype(np.uint8), codes.astype(np.uint64)
+
+
+def _alpha_palette(a0, a1):
+    a0, a1 = a0.astype(np.int32), a1.astype(np.int32)
+    steps = [a0, a1] + [((7 - i) * a0 + i * a1) // 7 for i in range(1, 7)]
+    six = [a0, a1] + [((5 - i) * a0 + i * a1) // 5 for i in range(1, 5)] + [np.zeros_like(a0), np.full_like(a0, 255)]
+    palette = np.where((a0 > a1)[:, None], np.stack(steps, axis=1), np.stack(six, axis=1))
+    return palette.astype(np.float32)
+
+
+def _pack_color(c0, c1, codes) -> np.ndarray:
+    packed = np.zeros(len(c0), dtype=[("c0", "<u2"), ("c1", "<u2"), ("codes", "<u4")])
+    packed["c0"], packed["c1"] = c0, c1
+    packed["codes"] = (codes << (2 * np.arange(16, dtype=np.uint32))).sum(axis=1, dtype=np.uint32)
+    return packed
+
+
+def encode_blocks(pixels: np.ndarray, fmt: str = FORMAT_BC3, quality: int = QUALITY_NORMAL) -> bytes:
+    # (h, w) uint32 ARGB non premoltiplicato -> blocchi BC1/BC3 in ordine di riga
+    blocks = to_blocks(pixels)
+    if fmt == FORMAT_BC1:
+        c0, c1, codes = encode_color_blocks(blocks, quality, punch_through=True)
+        return _pack_color(c0, c1, codes).tobytes()
+
+    c0, c1, codes = encode_color_blocks(blocks, quality)
+    a0, a1, alpha_codes = encode_alpha_blocks(blocks[..., 3])
+    alpha_bits = (alpha_codes << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    packed = np.zeros(len(blocks), dtype=[("a0", "u1"), ("a1", "u1"), ("bits", "u1", 6), ("color", _pack_color(c0, c1, codes).dtype)])
+    packed["a0"], packed["a1"] = a0, a1
+    packed["bits"] = alpha_bits.astype("<u8").view(np.uint8).reshape(-1, 8)[:, :6]
+    packed["color"] = _pack_color(c0, c1, codes)
+    return packed.tobytes()
+
+
+def decode_blocks(data: bytes, width: int, height: int, fmt: str = FORMAT_BC3) -> np.ndarray:
+    # Decoder di riferimento (per il resoconto d'errore): blocchi -> (h, w) uint32 ARGB
+    color_dtype = np.dtype([("c0", "<u2"), ("c1", "<u2"), ("codes", "<u4")])
+    if fmt == FORMAT_BC1:
+        color = np.frombuffer(data, dtype=color_dtype)
+        alpha = None
+    else:
+        packed = np.frombuffer(data, dtype=[("a0", "u1"), ("a1", "u1"), ("bits", "u1", 6), ("color", color_dtype)])
+        color = packed["color"]
+        bits = np.zeros((len(packed), 8), dtype=np.uint8)
+        bits[:, :6] = packed["bits"]
+        bits = bits.view("<u8")[:, 0]
+        alpha_codes = (bits[:, None] >> (3 * np.arange(16, dtype=np.uint64))) & 7
+        palette = _alpha_palette(packed["a0"], packed["a1"])
+        alpha = np.take_along_axis(palette, alpha_codes.astype(np.intp), axis=1)
+
+    c0, c1 = color["c0"], color["c1"]
+    three_color = (c0 <= c1) if fmt == FORMAT_BC1 else np.zeros(len(color), dtype=bool)
+    palette = _color_palette(_from_565(c0), _from_565(c1), three_color)
+    codes = (color["codes"][:, None] >> (2 * np.arange(16, dtype=np.uint32))) & 3
+    rgb = np.take_along_axis(palette, codes[..., None].astype(np.intp).repeat(3, axis=2), axis=1)
+
+    if alpha is None:
+        alpha = np.where(three_color[:, None] & (codes == 3), 0, 255).astype(np.float32)
+    rgba = np.concatenate((rgb, alpha[..., None]), axis=2)
+    return from_blocks(rgba, width, height)
+
+
+# --- Esportazione ----------------------------------------------------------------
+
+def _encode_band(band, top, fmt, quality):
+    return encode_blocks(band, fmt, quality)
+
+
+def _squared_error(source: np.ndarray, decoded: np.ndarray, fmt: str) -> np.ndarray:
+    # (h, w) somma degli errori al quadrato su R, G, B, A. In BC1 l'alpha a un bit conta come errore,
+    # ma l'RGB dei pixel resi trasparenti non si vede e non conta
+    shifts = np.array([16, 8, 0, 24], dtype=np.uint32)
+    a = ((source[..., None] >> shifts) & 0xFF).astype(np.float32)
+    b = ((decoded[..., None] >> shifts) & 0xFF).astype(np.float32)
+    if fmt == FORMAT_BC1:
+        hidden = b[..., 3] == 0
+        a[hidden, :3] = b[hidden, :3]
+    return ((a - b) ** 2).sum(axis=2)
+
+
+def psnr(squared_error: float, samples: int) -> float:
+    if samples == 0:
+        return float("inf")
+    mse = squared_error / samples
+    return float("inf") if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def write_dds(path: str, width: int, height: int, read_band, fmt: str = FORMAT_BC3,
+              quality: int = QUALITY_NORMAL, regions=None, job=None) -> dict:
+    # DDS a un livello (BC1 o BC3) a bande di righe: read_band(top, rows) ritorna (rows, width) uint32 ARGB.
+    # Ogni banda si codifica in parallelo a strisce di blocchi, poi si decodifica per il resoconto:
+    # PSNR totale e per regione (regions: nome -> (x, y, w, h) in pixel, es. gli sprite dell'atlas)
+    band_rows = max(4, EXPORT_BAND_BYTES // max(1, width * 4) // 4 * 4)
+    strip_rows = max(4, BAND_BYTES // max(1, width * 4) // 4 * 4)
+    regions = regions or {}
+    region_error = {name: 0.0 for name in regions}
+    total_error = 0.0
+
+    # Come PngRowWriter: path.tmp rinominato solo a fine scrittura, un annullamento non tocca il file esistente
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(dds_header(width, height, fmt))
+            for top in range(0, height, band_rows):
+                if job is not None:
+                    job.check()
+                rows = min(band_rows, height - top)
+                pixels = np.ascontiguousarray(read_band(top, rows))
+                data = b"".join(run_bands(_encode_band, pixels, fmt, quality, band_rows=strip_rows))
+                f.write(data)
+
+                error = _squared_error(pixels, decode_blocks(data, width, rows, fmt), fmt)
+                total_error += float(error.sum())
+                for name, (x, y, w, h) in regions.items():
+                    y0, y1 = max(y, top), min(y + h, top + rows)
+                    if y0 < y1:
+                        region_error[name] += float(error[y0 - top:y1 - top, x:x + w].sum())
+                if job is not None:
+                    job.report(top + rows, height)
+        os.replace(tmp_path, path)
+    except Exception:
+        remove_partial(tmp_path)
+        raise
+
+    return {
+        "format": fmt,
+        "quality": quality,
+        "bytes": os.path.getsize(path),
+        "rgba_bytes": width * height * 4,
+        "psnr": psnr(total_error, width * height * 4),
+        "sprites": {name: psnr(region_error[name], w * h * 4) for name, (_, _, w, h) in regions.items()},
+    }
+
+
+def format_dds_report(stats: dict, worst: int = 5) -> str:
+    from utils.memory_utils import format_bytes
+
+    lines = [
+        f"{stats['format']} ({QUALITY_LABELS.get(stats['quality'], stats['quality'])}): "
+        f"{format_bytes(stats['bytes'])} invece di {format_bytes(stats['rgba_bytes'])} non compressi.",
+        f"PSNR complessivo: {_format_psnr(stats['psnr'])}",
+    ]
+    sprites = sorted(stats["sprites"].items(), key=lambda item: item[1])
+    if sprites:
+        lines.append(f"Sprite peggiori ({min(worst, len(sprites))} di {len(sprites)}):")
+        for name, value in sprites[:worst]:
+            lines.append(f"  - {os.path.basename(name)}: {_format_psnr(value)}")
+    return "\n".join(lines)
+
+
+def _format_psnr(value: float) -> str:
+    return "senza perdite" if math.isinf(value) else f"{value:.1f} dB"
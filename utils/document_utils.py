@@ -0,0 +1,185 @@
+import os
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtGui import QPixmap
+
+from utils.image_cache_utils import image_cache
+from utils.pixel_cache_utils import load_pixmap
+
+
+def _is_indexed(value) -> bool:
+    # IndexedImage senza importare numpy all'avvio
+    return hasattr(value, "indices")
+
+
+def _document_key(path):
+    return os.path.normcase(os.path.abspath(path)) if path else None
+
+
+class ImageDocument(QObject):
+    # Un'immagine aperta, condivisa da tutte le finestre che la mostrano.
+    # Le QPixmap sono a condivisione implicita: originale, stati di undo e finestre puntano allo stesso
+    # buffer finché una modifica non ne crea uno nuovo (copy-on-write), quindi non serve mai .copy().
+    changed = pyqtSignal(object)  # la finestra che ha fatto la modifica, o None
+    released = pyqtSignal()
+
+    def __init__(self, pixmap: QPixmap, path: str = None):
+        super().__init__()
+        self.path = path
+        # QPixmap, o IndexedImage dopo index_states: si espande in ARGB solo quando qualcuno lo chiede
+        self.original = QPixmap(pixmap)
+        # Stessa struttura usata da utils.states_utils: le finestre usano direttamente queste liste
+        self.undo_stack = [{"pixmap": QPixmap(pixmap), "selection": set()}]
+        self.redo_stack = []
+        self.refs = 0
+
+    def pixmap(self) -> QPixmap:
+        # Lo stato corrente è sempre in cima allo stack di undo; gli stati indicizzati si espandono in ARGB
+        if not self.undo_stack:
+            return self.original_pixmap()
+        state = self.undo_stack[-1]
+        return state["pixmap"] if "pixmap" in state else state["indexed"].to_pixmap()
+
+    def original_pixmap(self) -> QPixmap:
+        return self.original.to_pixmap() if _is_indexed(self.original) else self.original
+
+    def original_state(self) -> dict:
+        return {"indexed": self.original} if _is_indexed(self.original) else {"pixmap": self.original}
+
+    def state(self) -> dict:
+        return self.undo_stack[-1] if self.undo_stack else self.original_state()
+
+    def index_states(self) -> bool:
+        # Modalità indicizzata: originale e stati ARGB della storia diventano IndexedImage, così le QPixmap a
+        # 32 bit si liberano davvero (anche dalla cache delle immagini decodificate). Le pixmap condivise si
+        # convertono una volta sola. False, senza toccare nulla, se lo stato corrente ha troppi colori
+        from utils.indexed_utils import IndexedImage
+
+        converted = {}
+
+        def convert(pixmap):
+            key = pixmap.cacheKey()
+            if key not in converted:
+                converted[key] = IndexedImage.from_pixmap(pixmap)
+            return converted[key]
+
+        current = self.state()
+        if "pixmap" in current and convert(current["pixmap"]) is None:
+            return False
+
+        for state in self.undo_stack + self.redo_stack:
+            if "pixmap" in state:
+                indexed = convert(state["pixmap"])
+                if indexed is not None:
+                    del state["pixmap"]
+                    state["indexed"] = indexed
+        if not _is_indexed(self.original):
+            self.original = convert(self.original) or self.original
+        if self.path:
+            image_cache().invalidate(self.path)
+        return True
+
+    def indexed_stats(self) -> dict:
+        # Byte realmente tenuti dagli stati indicizzati e quanti ne terrebbero gli stessi stati in ARGB
+        images = {id(value): value for value in
+                  [self.original] + [state.get("indexed") for state in self.undo_stack + self.redo_stack]
+                  if _is_indexed(value)}
+        indices = {id(image.indices): image.indices.nbytes for image in images.values()}
+        held = sum(indices.values()) + sum(image.palette.nbytes for image in images.values())
+        argb = sum(image.width * image.height * 4 for image in images.values())
+        return {"states": len(images), "bytes": held, "argb_bytes": argb}
+
+    def acquire(self):
+        self.refs += 1
+        return self
+
+    def release(self):
+        self.refs -= 1
+        if self.refs > 0:
+            return
+        _registry.pop(_document_key(self.path), None)
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.released.emit()
+
+    def notify(self, sender=None):
+        self.changed.emit(sender)
+
+
+_registry = {}
+
+
+def open_document(pixmap: QPixmap = None, path: str = None) -> ImageDocument:
+    # Stesso file -> stesso documento; le immagini senza path restano documenti a sé
+    key = _document_key(path)
+    document = _registry.get(key) if key else None
+    if document is None:
+        if pixmap is None:
+            pixmap = load_pixmap(path)
+        document = ImageDocument(pixmap, path)
+        if key:
+            _registry[key] = document
+    return document
+
+
+def open_documents():
+    return list(_registry.values())
+
+
+class DocumentMixin:
+    # Per le finestre che mostrano un ImageDocument: undo/redo/originale diventano quelli del documento.
+    # Le finestre di sola consultazione mettono shares_history a False e ricevono solo le notifiche.
+    document = None
+    shares_history = True
+    _original_pixmap = None
+
+    @property
+    def original_pixmap(self):
+        # Per le finestre che condividono la storia l'originale è quello del documento, espanso in ARGB
+        # solo qui, quando serve davvero
+        if self.document is not None and self.shares_history:
+            return self.document.original_pixmap()
+        return self._original_pixmap
+
+    @original_pixmap.setter
+    def original_pixmap(self, pixmap):
+        self._original_pixmap = pixmap
+
+    @property
+    def original_base(self):
+        # Originale da passare a reset_state: IndexedImage per i documenti indicizzati, nessuna espansione
+        if self.document is not None and self.shares_history:
+            return self.document.original
+        return self._original_pixmap
+
+    def attach_document(self, document: ImageDocument):
+        if document is self.document:
+            return
+        self.detach_document()
+        self.document = document.acquire()
+        if self.shares_history:
+            self.undo_stack = document.undo_stack
+            self.redo_stack = document.redo_stack
+        document.changed.connect(self._on_document_changed)
+
+    def detach_document(self):
+        if self.document is None:
+            return
+        self.document.changed.disconnect(self._on_document_changed)
+        self.document.release()
+        self.document = None
+        if self.shares_history:
+            self.undo_stack = []
+            self.redo_stack = []
+
+    def document_changed(self):
+        # Da chiamare dopo ogni modifica alla storia (nuovo stato, undo, redo, reset)
+        if self.document is not None:
+            self.document.notify(self)
+
+    def _on_document_changed(self, sender):
+        if sender is not self:
+            self.on_document_changed()
+
+    def on_document_changed(self):
+        pass
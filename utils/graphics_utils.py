@@ -2,7 +2,10 @@ from PyQt5.QtWidgets import QFileDialog, QGraphicsPixmapItem, QMessageBox, QGrap
 from PyQt5.QtGui import QPixmap, QColor, QPainter, QBrush
 from PyQt5.QtCore import QRectF
 from typing import Optional
+from utils.profiling_utils import profiled
+from utils.pixel_cache_utils import load_pixmap
 
+@profiled("checkerboard_view", "draw")
 def draw_checkerboard_for_view(view, tile_size: int):
     if view.pixmap_item is None:
         return
@@ -22,6 +25,7 @@ def draw_checkerboard_for_view(view, tile_size: int):
     view.checker_item = checker_item
 
 
+@profiled("checkerboard_pixmap", "draw")
 def draw_checkerboard_pixmap(width, height, tile_size=16):
     checkerboard = QPixmap(width, height)
     checkerboard.fill(QColor(0, 0, 0, 0))  # Trasparente
@@ -64,6 +68,7 @@ def auto_fit_view(view, pixmap_or_pixitem, margin_ratio=0.9):
         view.centerOn(pixmap_width / 2, pixmap_height / 2)
 
 
+@profiled("load_image", "io")
 def load_image_with_checker(view, scene, pixmap: Optional[QPixmap] = None, parent=None, tile_size=16) -> Optional[QGraphicsPixmapItem]:
     pixmap_item = None
     file_path = None
@@ -73,7 +78,7 @@ def load_image_with_checker(view, scene, pixmap: Optional[QPixmap] = None, paren
         file_path, _ = QFileDialog.getOpenFileName(parent, "Apri immagine", "", "Immagini (*.png *.jpg *.bmp)")
         if not file_path:
             return None
-        pixmap = QPixmap(file_path)
+        pixmap = load_pixmap(file_path)
 
     # Caso 2-3: Se il QPixmap arriva già pronto, proviamo ad ereditare il path
     if hasattr(pixmap, "path"):
@@ -0,0 +1,178 @@
+import numpy as np
+from PyQt5.QtGui import QImage
+
+from utils.array_utils import to_argb32, qimage_view
+from utils.parallel_utils import run_bands
+
+# Sotto questa affidabilità il rilevamento non cambia la dimensione della griglia
+MIN_CONFIDENCE = 0.6
+
+
+def _signal(array: np.ndarray):
+    # Interi a 32 bit: luminanza premoltiplicata per alpha, più alpha stesso
+    pixels = array.view(np.int32)
+    alpha = (pixels >> 24) & 0xFF
+    luma = (((pixels >> 16) & 0xFF) * 77 + ((pixels >> 8) & 0xFF) * 150 + (pixels & 0xFF) * 29) >> 8
+    return alpha, ((luma * alpha) >> 8) + alpha
+
+
+def _profile_band(band: np.ndarray, top: int, array: np.ndarray):
+    # Una riga in più sopra per il bordo tra bande
+    bottom = top + band.shape[0]
+    start = max(0, top - 1)
+    alpha, signal = _signal(array[start:bottom])
+    own = slice(top - start, None)
+
+    col_alpha = alpha[own].sum(axis=0)
+    col_edges = np.abs(np.diff(signal[own], axis=1)).sum(axis=0)
+    row_alpha = alpha[own].sum(axis=1)
+    row_edges = np.abs(np.diff(signal, axis=0)).sum(axis=1)
+    return top, start, col_alpha, col_edges, row_alpha, row_edges
+
+
+def axis_profiles(array: np.ndarray, band_rows: int = None) -> dict:
+    # Profili 1D di copertura alpha e di intensità dei bordi, per colonna e per riga.
+    # Si lavora a bande di righe (in parallelo) per non allocare float grandi quanto tutta l'immagine.
+    height, width = array.shape
+    col_alpha = np.zeros(width)
+    col_edges = np.zeros(width)
+    row_alpha = np.zeros(height)
+    row_edges = np.zeros(height)
+
+    bands = run_bands(_profile_band, array, array, band_rows=band_rows)
+    for top, start, band_col_alpha, band_col_edges, band_row_alpha, band_row_edges in bands:
+        bottom = top + len(band_row_alpha)
+        col_alpha += band_col_alpha
+        col_edges[1:] += band_col_edges
+        row_alpha[top:bottom] = band_row_alpha
+        row_edges[start + 1:bottom] = band_row_edges
+
+    return {
+        "x": (col_alpha, col_edges),
+        "y": (row_alpha, row_edges),
+    }
+
+
+def autocorrelation(profile: np.ndarray) -> np.ndarray:
+    # Autocorrelazione normalizzata (non distorta) via FFT
+    x = profile.astype(np.float64) - profile.mean()
+    n = len(x)
+    spectrum = np.fft.rfft(x, 2 * n)
+    ac = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+    if ac[0] <= 0:
+        return np.zeros(n)
+    ac = ac / (n - np.arange(n))
+    return ac / ac[0]
+
+
+def _main_lobe_end(score: np.ndarray) -> int:
+    # Il lobe attorno al lag 0 scende fino al primo zero (o al primo minimo): i lag prima sono solo
+    # pixel vicini che si somigliano, non un periodo
+    below = np.flatnonzero(score[1:] <= 0)
+    rising = np.flatnonzero(np.diff(score) > 0)
+    ends = [int(below[0]) + 1] if len(below) else []
+    if len(rising):
+        ends.append(int(rising[0]))
+    return min(ends) if ends else len(score)
+
+
+def _profile_period(score: np.ndarray, min_period: int, max_period: int, harmonic_ratio: float):
+    # Solo massimi locali veri, oltre il lobe del lag 0
+    first = max(min_period, _main_lobe_end(score), 1)
+    lags = np.arange(first, min(max_period, len(score) - 2) + 1)
+    if not len(lags):
+        return None, 0.0
+    peaks = lags[(score[lags] >= score[lags - 1]) & (score[lags] > score[lags + 1]) & (score[lags] > 0)]
+    if not len(peaks):
+        return None, 0.0
+
+    # Ogni picco si pesa con la media dei suoi multipli (pettine): la fondamentale e le sue armoniche hanno
+    # pettini simili, un sottomultiplo no. Tra i pettini vicini al migliore vince il periodo più piccolo
+    # (un pixel di tolleranza sui multipli: i picchi lontani slittano per arrotondamento)
+    near = score.copy()
+    near[1:-1] = np.maximum(np.maximum(score[:-2], score[1:-1]), score[2:])
+    last = max(len(score) // 2, int(peaks[-1]))
+    comb = np.array([near[np.arange(peak, last + 1, peak)].mean() for peak in peaks])
+    period = int(peaks[comb >= comb.max() * harmonic_ratio][0])
+    # Se il periodo scelto è un multiplo di un picco più piccolo ancora forte, quello è la fondamentale
+    for peak in peaks[peaks < period]:
+        if abs(period - round(period / peak) * peak) <= 1 and score[peak] >= 0.5 * score[period]:
+            period = int(peak)
+            break
+    return period, float(np.clip(score[period], 0.0, 1.0))
+
+
+def estimate_period(profiles, min_period: int = 4, max_period: int = 256, harmonic_ratio: float = 0.85):
+    # Ogni profilo si valuta da solo e vince il più periodico: un margine vuoto rende la copertura alpha
+    # un gradino senza picchi, mentre i bordi tra tile che si toccano restano un pettine pulito
+    length = len(profiles[0])
+    max_period = min(max_period, length // 2)
+    if max_period < min_period:
+        return None, 0.0
+
+    best = (None, 0.0)
+    for profile in profiles:
+        if np.ptp(profile) == 0:
+            continue
+        period, confidence = _profile_period(autocorrelation(profile), min_period, max_period, harmonic_ratio)
+        if period is not None and confidence > best[1]:
+            best = (period, confidence)
+    return best
+
+
+def _fold(profile: np.ndarray, period: int) -> np.ndarray:
+    usable = len(profile) // period * period
+    return profile[:usable].reshape(-1, period).sum(axis=0)
+
+
+def estimate_offset(alpha_profile: np.ndarray, edge_profile: np.ndarray, period: int) -> int:
+    # Inizio della cella modulo il periodo. Con spazi trasparenti tra gli sprite la linea della griglia sta
+    # a metà della fascia vuota, non sul bordo degli sprite; senza spazi (tile che si toccano) sta sul
+    # pettine con più energia di bordo
+    if len(edge_profile) < period:
+        return 0
+    coverage = _fold(alpha_profile, period)
+    if coverage.max() > 0:
+        # Vuota in (quasi) tutte le celle: un margine solo attorno al foglio non conta
+        empty = coverage <= 0.1 * coverage.max()
+        if empty.any():
+            start = end = int(coverage.argmin())
+            while empty[(start - 1) % period]:
+                start -= 1
+            while empty[(end + 1) % period]:
+                end += 1
+            return (start + (end - start + 1) // 2) % period
+    return int(_fold(edge_profile, period).argmax()) % period
+
+
+def detect_grid_array(array: np.ndarray, min_period: int = 4, max_period: int = 256) -> dict:
+    result = {"cell_width": None, "cell_height": None, "offset_x": 0, "offset_y": 0, "confidence": 0.0}
+    confidences = []
+    profiles = axis_profiles(array)
+
+    for axis, size_key, offset_key in (("x", "cell_width", "offset_x"), ("y", "cell_height", "offset_y")):
+        alpha_profile, edge_profile = profiles[axis]
+        # Radice sui bordi: un salto di colore forte (il margine del foglio) non deve coprire il pettine dei tile
+        period, confidence = estimate_period([alpha_profile, np.sqrt(edge_profile)], min_period, max_period)
+        if period is None:
+            continue
+        result[size_key] = period
+        result[offset_key] = estimate_offset(alpha_profile, edge_profile, period)
+        confidences.append(confidence)
+
+    if confidences:
+        result["confidence"] = float(np.mean(confidences))
+    return result
+
+
+def detect_grid(image: QImage, min_period: int = 4, max_period: int = 256) -> dict:
+    image = to_argb32(image)
+    return detect_grid_array(qimage_view(image), min_period, max_period)
+
+
+def square_tile_size(result: dict):
+    # Le spin box accettano un solo lato: si usa il periodo comune, o il più piccolo dei due
+    sizes = [size for size in (result["cell_width"], result["cell_height"]) if size]
+    if not sizes:
+        return None
+    return min(sizes)
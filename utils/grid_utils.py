@@ -2,6 +2,7 @@ from PyQt5.QtWidgets import QGraphicsItem, QMessageBox
 from PyQt5.QtGui import QColor, QPen
 from PyQt5.QtCore import QRectF, Qt
 from utils.graphics_utils import draw_checkerboard_for_view
+from utils.profiling_utils import profiled
 
 class GridOverlayItem(QGraphicsItem):
     def __init__(self, width, height, tile_size):
@@ -25,6 +26,7 @@ class GridOverlayItem(QGraphicsItem):
             painter.drawLine(0, y, self.width, y)
 
 
+@profiled("grid_lines", "draw")
 def draw_grid_lines(scene, pixmap_width, pixmap_height, tile_size=16, z=10, color=QColor(255, 100, 0, 255)):
     grid_items = []
     pen = QPen(color)
@@ -81,3 +83,38 @@ def draw_grid_ui(view, tile_size_field, grid_button):
     else:
         grid_button.setText("Attiva griglia")
         clear_grid_for_view(view)
+
+
+@profiled("detect_grid", "analysis")
+def detect_grid_ui(view, tile_size_field, grid_button, info_label=None):
+    if view.pixmap_item is None:
+        return None
+
+    # NumPy serve solo qui: si importa al primo rilevamento
+    from utils.grid_detection_utils import MIN_CONFIDENCE, detect_grid, square_tile_size
+    result = detect_grid(view.pixmap_item.pixmap().toImage(),
+                         min_period=max(2, tile_size_field.minimum()),
+                         max_period=tile_size_field.maximum())
+    tile_size = square_tile_size(result)
+    if tile_size is None:
+        QMessageBox.warning(view, "Errore", "Nessuna griglia riconosciuta.")
+        return result
+
+    # La griglia disegnata parte sempre da 0,0: l'offset stimato resta nel risultato ma non si mostra
+    summary = f"{result['cell_width']}x{result['cell_height']} - affidabilità {result['confidence']:.0%}"
+    if result["confidence"] < MIN_CONFIDENCE:
+        # Stima incerta: la dimensione scelta dall'utente non si tocca
+        message = f"Griglia incerta ({summary}): dimensione non modificata."
+        if info_label is not None:
+            info_label.setText(message)
+        else:
+            QMessageBox.warning(view, "Errore", message)
+        return result
+
+    tile_size_field.setValue(tile_size)
+    if info_label is not None:
+        info_label.setText(summary)
+
+    # Ridisegna subito checker e griglia con la nuova dimensione
+    draw_grid_ui(view, tile_size_field, grid_button)
+    return result
@@ -0,0 +1,197 @@
+import os
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import QCoreApplication, QThread
+from PyQt5.QtGui import QImage, QPixmap
+
+IMAGE_CACHE_ENV = "SPRITYLE_IMAGE_CACHE_MB"
+DEFAULT_BUDGET_MB = 512
+
+
+def _budget_from_env() -> int:
+    try:
+        return max(0, int(os.environ.get(IMAGE_CACHE_ENV, DEFAULT_BUDGET_MB))) << 20
+    except ValueError:
+        return DEFAULT_BUDGET_MB << 20
+
+
+def _path_key(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _file_stamp(path: str):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _share(image: QImage) -> QImage:
+    # Copia implicita: chi disegna sulla propria copia la stacca senza toccare la cache.
+    # Le immagini mappate da pixel_cache_utils si portano dietro la mappatura, che deve restare viva.
+    shared = QImage(image)
+    mapped = getattr(image, "mapped_buffer", None)
+    if mapped is not None:
+        shared.mapped_buffer = mapped
+    return shared
+
+
+def _in_gui_thread() -> bool:
+    app = QCoreApplication.instance()
+    return app is not None and QThread.currentThread() == app.thread()
+
+
+class _Entry:
+    __slots__ = ("stamp", "image", "pixmap", "size")
+
+    def __init__(self, stamp, image: QImage):
+        self.stamp = stamp
+        self.image = image
+        self.pixmap = None
+        self.size = image.sizeInBytes()
+
+
+class ImageCache:
+    # Immagini decodificate, una per file, condivise da tutte le finestre.
+    # Chiave: path normalizzato; un file con mtime/dimensione diversi è un miss e sostituisce la voce.
+    # Si tengono QImage (valide in ogni thread); la QPixmap si crea al primo uso nel thread GUI e si conta a parte.
+    def __init__(self, budget_bytes: int = None):
+        self.budget_bytes = _budget_from_env() if budget_bytes is None else budget_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _lookup(self, key, stamp):
+        entry = self.entries.get(key)
+        if entry is None or entry.stamp != stamp:
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry.size
+
+    def _evict(self):
+        # LRU: in testa c'è la voce usata meno di recente
+        while self.total_bytes > self.budget_bytes and self.entries:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def get_image(self, path: str):
+        stamp = _file_stamp(path)
+        if stamp is None:
+            return None
+        with self._lock:
+            entry = self._lookup(_path_key(path), stamp)
+            return _share(entry.image) if entry else None
+
+    def get_pixmap(self, path: str):
+        # Solo dal thread GUI: la conversione avviene una volta, le chiamate successive condividono il buffer
+        stamp = _file_stamp(path)
+        if stamp is None:
+            return None
+        with self._lock:
+            entry = self._lookup(_path_key(path), stamp)
+            if entry is None:
+                return None
+            if entry.pixmap is None:
+                entry.pixmap = QPixmap.fromImage(entry.image)
+                entry.size += entry.image.sizeInBytes()
+                self.total_bytes += entry.image.sizeInBytes()
+                self._evict()
+            return QPixmap(entry.pixmap)
+
+    def put(self, path: str, image: QImage, pixmap: QPixmap = None):
+        stamp = _file_stamp(path)
+        if stamp is None or image is None or image.isNull():
+            return
+        entry = _Entry(stamp, image)
+        if pixmap is not None and _in_gui_thread():
+            entry.pixmap = pixmap
+            entry.size += image.sizeInBytes()
+        if entry.size > self.budget_bytes:
+            return  # più grande dell'intero budget: meglio non svuotare la cache per lei
+
+        key = _path_key(path)
+        with self._lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = entry
+            self.total_bytes += entry.size
+            self._evict()
+
+    def invalidate(self, path: str):
+        with self._lock:
+            if _path_key(path) in self.entries:
+                self._drop(_path_key(path))
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def set_budget(self, budget_bytes: int):
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "budget": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def image_cache() -> ImageCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache()
+        return _cache
+
+
+def cached_image(path: str, loader, store: bool = True) -> QImage:
+    # QImage del file dalla cache, altrimenti loader(path) e (se store) la si memorizza
+    cache = image_cache()
+    image = cache.get_image(path)
+    if image is None:
+        image = loader(path)
+        if store:
+            cache.put(path, image)
+            image = _share(image)
+    return image
+
+
+def cached_pixmap(path: str, loader) -> QPixmap:
+    # Come cached_image ma per il thread GUI; loader(path) ritorna una QImage
+    cache = image_cache()
+    pixmap = cache.get_pixmap(path)
+    if pixmap is None:
+        image = loader(path)
+        if image.isNull():
+            return QPixmap()
+        pixmap = QPixmap.fromImage(image)
+        cache.put(path, image, pixmap)
+        pixmap = QPixmap(pixmap)
+    return pixmap
@@ -0,0 +1,95 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtGui import QImage, QImageReader, QPixmap
+
+from utils.pixel_cache_utils import load_image, load_pixmap
+
+# Immagini decodificate in anticipo durante la generazione dell'atlas
+DECODE_WINDOW = 4
+
+
+class ImageHandle:
+    # Riferimento leggero a uno sprite: path, dimensioni e hash. I pixel si decodificano quando servono
+    # (dal file, dalle cache o da un loader, es. una voce di un bundle zip). Le immagini che non hanno
+    # un file da cui rileggerle (tile ritagliati, pixmap di altre finestre) restano in memoria come QImage.
+    __slots__ = ("path", "width", "height", "digest", "_loader", "_image")
+
+    def __init__(self, path: str, width: int, height: int, digest: str = None, loader=None, image: QImage = None):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.digest = digest
+        self._loader = loader
+        self._image = image
+
+    @classmethod
+    def from_file(cls, path: str, digest: str = None):
+        # Solo l'header: nessuna decodifica
+        size = QImageReader(path).size()
+        return cls(path, max(size.width(), 0), max(size.height(), 0), digest)
+
+    @classmethod
+    def from_image(cls, image, path: str):
+        # Dal thread GUI se image è una QPixmap
+        if isinstance(image, QPixmap):
+            image = image.toImage()
+        return cls(path, image.width(), image.height(), image=image)
+
+    def is_null(self) -> bool:
+        return self.width <= 0 or self.height <= 0
+
+    def is_resident(self) -> bool:
+        return self._image is not None
+
+    def load_image(self, store: bool = True) -> QImage:
+        # Va bene in ogni thread. store=False non inserisce il risultato nella cache in memoria:
+        # per le passate su tutti gli sprite, che non devono spingerne fuori le immagini aperte
+        if self._image is not None:
+            return QImage(self._image)
+        if self._loader is not None:
+            return self._loader()
+        return load_image(self.path, store=store)
+
+    def load_pixmap(self) -> QPixmap:
+        # Solo dal thread GUI
+        if self._image is not None or self._loader is not None:
+            return QPixmap.fromImage(self.load_image())
+        return load_pixmap(self.path)
+
+    def memory_images(self):
+        return [self._image] if self._image is not None else []
+
+
+def as_handle(value, path: str) -> ImageHandle:
+    return value if isinstance(value, ImageHandle) else ImageHandle.from_image(value, path)
+
+
+def iter_decoded(handles, window: int = DECODE_WINDOW, job=None):
+    # (handle, QImage) in ordine, decodificando in anticipo al massimo window immagini:
+    # chi consuma disegna e rilascia, la memoria non cresce con il numero di sprite
+    handles = iter(handles)
+    with ThreadPoolExecutor(max_workers=window, thread_name_prefix="decode") as pool:
+        pending = deque()
+
+        def submit():
+            handle = next(handles, None)
+            if handle is not None:
+                # Le immagini già in memoria non passano dal pool
+                future = None if handle.is_resident() else pool.submit(handle.load_image, False)
+                pending.append((handle, future))
+
+        for _ in range(window):
+            submit()
+        try:
+            while pending:
+                if job is not None:
+                    job.check()
+                handle, future = pending.popleft()
+                image = handle.load_image() if future is None else future.result()
+                submit()
+                yield handle, image
+        finally:
+            for _, future in pending:
+                if future is not None:
+                    future.cancel()
@@ -0,0 +1,193 @@
+import glob
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal, Qt
+from PyQt5.QtGui import QImage, QPixmap
+
+from utils.controls_utils import atlas_files
+from utils.image_cache_utils import cached_image
+from utils.image_handle_utils import ImageHandle
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+SKIP_DUPLICATE_PATH = "duplicate_path"
+SKIP_DUPLICATE_CONTENT = "duplicate_content"
+SKIP_ATLAS = "atlas"
+SKIP_INVALID = "invalid"
+
+
+def normalize_path(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def collect_image_files(folder: str, pattern: str = "*", recursive: bool = True) -> list:
+    if recursive:
+        matches = glob.glob(os.path.join(folder, "**", pattern), recursive=True)
+    else:
+        matches = glob.glob(os.path.join(folder, pattern))
+
+    files = [
+        path.replace("\\", "/") for path in matches
+        if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+    return sorted(files)
+
+
+def decode_image_file(path: str, thumb_size: int):
+    # Gira nel thread pool: solo QImage, mai QPixmap fuori dal thread GUI
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+            # Stat del contenuto letto, per il catalogo
+            stat = os.fstat(f.fileno())
+    except OSError:
+        return path, None, QImage(), QImage(), None
+
+    digest = hashlib.sha1(data).hexdigest()
+    # Se un'altra finestra ha già il file in cache lo si riusa, ma senza inserirlo: centinaia di sprite
+    # importati spingerebbero fuori dalla LRU condivisa i documenti aperti
+    image = cached_image(path, lambda _: QImage.fromData(data), store=False)
+    if image.isNull():
+        return path, digest, image, QImage(), stat
+
+    thumb = image.scaled(thumb_size, thumb_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return path, digest, image, thumb, stat
+
+
+class ImageImportTask(QObject):
+    # batch: lista di (path, hash, ImageHandle, thumbnail)
+    batch_ready = pyqtSignal(list)
+    progress = pyqtSignal(int, int)
+    # riepilogo: {motivo: [path, ...]}
+    finished = pyqtSignal(dict)
+    # Importazione annullata: nessun riepilogo da mostrare
+    aborted = pyqtSignal()
+
+    def __init__(self, files, known_paths=(), known_hashes=(), update_paths=(), thumb_size=96,
+                 batch_interval=50, max_workers=None, parent=None):
+        super().__init__(parent)
+        self.thumb_size = thumb_size
+        self.max_workers = max_workers or os.cpu_count() or 4
+        self.known_paths = {normalize_path(p) for p in known_paths}
+        self.known_hashes = set(known_hashes)
+        # File già caricati e modificati su disco: sono aggiornamenti, mai duplicati (né di path né di contenuto)
+        self.update_paths = {normalize_path(p) for p in update_paths}
+        self.skipped = {
+            SKIP_DUPLICATE_PATH: [],
+            SKIP_DUPLICATE_CONTENT: [],
+            SKIP_ATLAS: [],
+            SKIP_INVALID: [],
+        }
+
+        # Filtri economici (path e atlas, con una sola query al catalogo) prima di decodificare
+        self.files = []
+        atlases = atlas_files(files)
+        for file in files:
+            key = normalize_path(file)
+            if key in self.known_paths and key not in self.update_paths:
+                self.skipped[SKIP_DUPLICATE_PATH].append(file)
+                continue
+            if file in atlases:
+                self.skipped[SKIP_ATLAS].append(file)
+                continue
+            self.known_paths.add(key)
+            self.files.append(file)
+
+        self.total = len(self.files)
+        self.done = 0
+        self.cancelled = False
+        self._finished = False
+        self._queue = Queue()
+        self._executor = None
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(batch_interval)
+        self._timer.timeout.connect(self._drain)
+
+    def start(self):
+        if not self.files:
+            QTimer.singleShot(0, self._finish)
+            return
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        for file in self.files:
+            future = self._executor.submit(decode_image_file, file, self.thumb_size)
+            future.add_done_callback(self._queue.put)
+        self._timer.start()
+
+    def cancel(self):
+        self.cancelled = True
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._finish()
+
+    def _drain(self):
+        batch = []
+        indexed = []
+        while True:
+            try:
+                future = self._queue.get_nowait()
+            except Empty:
+                break
+            self.done += 1
+            if future.cancelled():
+                continue
+
+            path, digest, image, thumb, stat = future.result()
+            if image.isNull():
+                self.skipped[SKIP_INVALID].append(path)
+                continue
+            # Nel catalogo anche i duplicati: servono alle ricerche per contenuto
+            indexed.append((path, stat, image.width(), image.height(), digest))
+            if digest in self.known_hashes and normalize_path(path) not in self.update_paths:
+                self.skipped[SKIP_DUPLICATE_CONTENT].append(path)
+                continue
+            self.known_hashes.add(digest)
+
+            # Si tiene solo l'handle: i pixel restano (finché c'è budget) nella cache delle immagini decodificate.
+            # La conversione in QPixmap deve avvenire nel thread GUI
+            handle = ImageHandle(path, image.width(), image.height(), digest)
+            batch.append((path, digest, handle, QPixmap.fromImage(thumb)))
+
+        if indexed:
+            from utils.catalog_utils import index_imported
+            index_imported(indexed)
+        if batch:
+            self.batch_ready.emit(batch)
+        self.progress.emit(self.done, self.total)
+
+        if self.done >= self.total:
+            self._finish()
+
+    def _finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        self._timer.stop()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self.cancelled:
+            self.aborted.emit()
+            return
+        self.finished.emit({k: v for k, v in self.skipped.items() if v})
+
+
+def format_skipped_summary(skipped: dict, max_listed: int = 10) -> str:
+    labels = {
+        SKIP_DUPLICATE_PATH: "Già caricate",
+        SKIP_DUPLICATE_CONTENT: "Contenuto duplicato",
+        SKIP_ATLAS: "File atlas non consentiti",
+        SKIP_INVALID: "Immagini non valide",
+    }
+    lines = []
+    for reason, paths in skipped.items():
+        lines.append(f"{labels.get(reason, reason)}: {len(paths)}")
+        for path in paths[:max_listed]:
+            lines.append(f"  - {os.path.basename(path)}")
+        if len(paths) > max_listed:
+            lines.append(f"  ... e altri {len(paths) - max_listed}")
+    return "\n".join(lines)
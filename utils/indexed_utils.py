@@ -0,0 +1,176 @@
+import numpy as np
+from PyQt5.QtCore import QRect, QRectF
+from PyQt5.QtGui import QImage, QPixmap, QPainter
+from PyQt5.QtWidgets import QGraphicsItem
+
+from utils.array_utils import to_argb32, qimage_view, array_to_qimage
+
+# Oltre questi colori il documento resta ARGB: gli indici non starebbero in uint16
+MAX_INDEXED_COLORS = 1 << 16
+HIGHLIGHT_COLOR = 0x96FFA500  # arancione semi-trasparente, come la selezione dei tile
+
+
+class IndexedImage:
+    # Pixel art come palette (ARGB uint32) + indici uint8/uint16: un quarto (o metà) della memoria ARGB.
+    # Immutabile: le modifiche di colore ritornano una nuova immagine con una nuova palette e gli stessi
+    # indici, quindi gli stati di undo di queste modifiche costano quanto la palette.
+    __slots__ = ("palette", "indices")
+
+    def __init__(self, palette: np.ndarray, indices: np.ndarray):
+        self.palette = palette
+        self.indices = indices
+
+    @classmethod
+    def from_image(cls, image: QImage, max_colors: int = MAX_INDEXED_COLORS):
+        # None se l'immagine ha più di max_colors colori (ARGB esatti: la conversione è senza perdita)
+        if image.isNull():
+            return None
+        if image.format() == QImage.Format_ARGB32_Premultiplied:
+            image = image.convertToFormat(QImage.Format_ARGB32)
+        image = to_argb32(image)
+        pixels = qimage_view(image)
+        if image.format() == QImage.Format_RGB32:
+            pixels = pixels | np.uint32(0xFF000000)
+        palette, inverse = np.unique(pixels, return_inverse=True)
+        if len(palette) > max_colors:
+            return None
+        dtype = np.uint8 if len(palette) <= 256 else np.uint16
+        return cls(palette.astype(np.uint32), inverse.reshape(pixels.shape).astype(dtype))
+
+    @classmethod
+    def from_pixmap(cls, pixmap: QPixmap, max_colors: int = MAX_INDEXED_COLORS):
+        # Solo dal thread GUI
+        return cls.from_image(pixmap.toImage(), max_colors)
+
+    @property
+    def width(self) -> int:
+        return self.indices.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.indices.shape[0]
+
+    def rect(self) -> QRect:
+        return QRect(0, 0, self.width, self.height)
+
+    def nbytes(self) -> int:
+        return self.palette.nbytes + self.indices.nbytes
+
+    def memory_images(self):
+        return [self.palette, self.indices]
+
+    def expand(self, rect: QRect = None) -> np.ndarray:
+        # (h, w) uint32 ARGB, solo del rettangolo richiesto
+        indices = self.indices
+        if rect is not None:
+            indices = indices[rect.top():rect.top() + rect.height(), rect.left():rect.left() + rect.width()]
+        return self.palette[indices]
+
+    def to_image(self, rect: QRect = None) -> QImage:
+        return array_to_qimage(self.expand(rect))
+
+    def to_pixmap(self) -> QPixmap:
+        # Solo dal thread GUI; espande l'immagine intera (salvataggio, finestre che vogliono ARGB)
+        return QPixmap.fromImage(self.to_image())
+
+    def pixel(self, x: int, y: int) -> int:
+        return int(self.palette[self.indices[y, x]])
+
+    def color_entries(self, argb: int) -> np.ndarray:
+        # Voci di palette di quel colore (più d'una dopo una sostituzione che unisce due colori)
+        return np.flatnonzero(self.palette == np.uint32(argb))
+
+    def with_palette(self, palette) -> "IndexedImage":
+        # Scambio di palette: stessi indici, nessun pixel toccato
+        palette = np.asarray(palette, dtype=np.uint32)
+        if palette.shape != self.palette.shape:
+            raise ValueError(f"La palette deve avere {len(self.palette)} colori")
+        return IndexedImage(palette, self.indices)
+
+    def replace_color(self, target: int, replacement: int = 0):
+        # O(palette): None se il colore non c'è (nessuna modifica, nessuno stato di undo)
+        entries = self.color_entries(target)
+        if not entries.size:
+            return None
+        palette = self.palette.copy()
+        palette[entries] = np.uint32(replacement)
+        return IndexedImage(palette, self.indices)
+
+    def color_mask(self, argb: int) -> np.ndarray:
+        # (h, w) bool dei pixel di quel colore: un solo confronto sugli indici
+        entries = self.color_entries(argb)
+        if entries.size == 1:
+            return self.indices == entries[0]
+        return np.isin(self.indices, entries)
+
+
+def color_mask(image: QImage, argb: int) -> np.ndarray:
+    # Stessa maschera per i documenti ARGB: un confronto vettoriale su tutti i pixel
+    image = to_argb32(image)
+    if image.format() == QImage.Format_ARGB32_Premultiplied:
+        image = image.convertToFormat(QImage.Format_ARGB32)
+    pixels = qimage_view(image)
+    if image.format() == QImage.Format_RGB32:
+        return (pixels | np.uint32(0xFF000000)) == np.uint32(argb)
+    return pixels == np.uint32(argb)
+
+
+def mask_overlay(mask: np.ndarray, color: int = HIGHLIGHT_COLOR) -> QImage:
+    # Maschera -> immagine da sovrapporre alla vista (trasparente fuori dalla maschera)
+    return array_to_qimage(np.where(mask, np.uint32(color), np.uint32(0)))
+
+
+class IndexedImageItem(QGraphicsItem):
+    # Item di scena per i documenti indicizzati: espande in ARGB solo la parte esposta.
+    # Interfaccia di QGraphicsPixmapItem (pixmap/setPixmap) per states_utils e le altre utility: setPixmap
+    # indicizza la pixmap, pixmap() la rimette in ARGB. Se i colori sono troppi resta la pixmap così com'è.
+    def __init__(self, image=None):
+        super().__init__()
+        self.indexed = None
+        self._pixmap = None
+        self.path = None
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+        if isinstance(image, IndexedImage):
+            self.set_indexed(image)
+        elif image is not None:
+            self.setPixmap(image)
+
+    def set_indexed(self, indexed: IndexedImage):
+        self.prepareGeometryChange()
+        self.indexed = indexed
+        self._pixmap = None
+        self.update()
+
+    def setPixmap(self, pixmap: QPixmap):
+        indexed = IndexedImage.from_pixmap(pixmap)
+        if indexed is not None:
+            self.set_indexed(indexed)
+            return
+        self.prepareGeometryChange()
+        self.indexed = None
+        self._pixmap = QPixmap(pixmap)
+        self.update()
+
+    def pixmap(self) -> QPixmap:
+        if self.indexed is not None:
+            return self.indexed.to_pixmap()
+        return self._pixmap if self._pixmap is not None else QPixmap()
+
+    def boundingRect(self) -> QRectF:
+        if self.indexed is not None:
+            return QRectF(self.indexed.rect())
+        return QRectF(self._pixmap.rect()) if self._pixmap is not None else QRectF()
+
+    def paint(self, painter: QPainter, option, widget=None):
+        if self.indexed is None:
+            if self._pixmap is not None:
+                painter.drawPixmap(0, 0, self._pixmap)
+            return
+        rect = option.exposedRect.toAlignedRect() & self.indexed.rect()
+        if not rect.isEmpty():
+            painter.drawImage(rect.topLeft(), self.indexed.to_image(rect))
+
+    def memory_images(self):
+        if self.indexed is not None:
+            return self.indexed.memory_images()
+        return [self._pixmap] if self._pixmap is not None else []
@@ -0,0 +1,143 @@
+import traceback
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QCoreApplication, pyqtSignal, Qt
+from PyQt5.QtWidgets import QProgressDialog, QMessageBox
+
+from utils.profiling_utils import span
+
+
+# Riferimenti ai job in corso: senza, Python potrebbe raccoglierli mentre girano nel pool
+_running = set()
+_pool = None
+
+
+def job_pool() -> QThreadPool:
+    # Pool dedicato: Qt usa il pool globale per le conversioni di QImage grandi e le aspetta
+    # dal thread GUI senza rilasciare il GIL; un job Python fermo lì sul GIL bloccherebbe tutto
+    global _pool
+    if _pool is None:
+        _pool = QThreadPool()
+    return _pool
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobSignals(QObject):
+    # Emessi dal thread del pool, consegnati nel thread GUI (connessione in coda)
+    progress = pyqtSignal(int, int)
+    result = pyqtSignal(object)
+    error = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    finished = pyqtSignal()
+
+
+class Job(QRunnable):
+    # Esegue fn(job, *args, **kwargs) nel QThreadPool. La funzione lavora solo su QImage/array
+    # (mai QPixmap o widget), chiama job.report(done, total) e job.check() per l'annullamento.
+    def __init__(self, fn, *args, name=None, **kwargs):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.name = name or getattr(fn, "__name__", "job")
+        self.signals = JobSignals()
+        self.is_cancelled = False
+        self.is_finished = False
+
+    def cancel(self):
+        self.is_cancelled = True
+
+    def check(self):
+        if self.is_cancelled:
+            raise JobCancelled()
+
+    def report(self, done: int, total: int):
+        self.signals.progress.emit(done, total)
+
+    def run(self):
+        try:
+            with span(self.name, "job"):
+                result = self.fn(self, *self.args, **self.kwargs)
+            self.check()
+        except JobCancelled:
+            self.signals.cancelled.emit()
+        except Exception:
+            traceback.print_exc()
+            self.signals.error.emit(traceback.format_exc(limit=3))
+        else:
+            self.signals.result.emit(result)
+        finally:
+            self.is_finished = True
+            self.signals.finished.emit()
+
+
+def is_busy(owner) -> bool:
+    return getattr(owner, "_active_job", None) is not None
+
+
+def _release(job, owner):
+    # Nel thread GUI, dopo on_result: solo ora la finestra accetta un nuovo job
+    _running.discard(job)
+    if owner is not None and getattr(owner, "_active_job", None) is job:
+        owner._active_job = None
+
+
+def _show_error(owner, label, details: str):
+    # Default di on_error per i job con una finestra: l'errore non deve sparire insieme al dialog di avanzamento
+    operation = (label or "Operazione").rstrip(". ")
+    reason = details.strip().splitlines()[-1] if details.strip() else "errore sconosciuto"
+    QMessageBox.warning(owner, "Errore", f"{operation}: operazione non riuscita.\n\n{reason}")
+
+
+def start_job(fn, *args, owner=None, label=None, on_result=None, on_error=None, on_cancel=None,
+              on_progress=None, name=None, **kwargs):
+    # Avvia un job; on_result riceve il risultato nel thread GUI e applica la modifica in un colpo solo.
+    # Con owner si evita di sovrapporre due job sulla stessa finestra: in quel caso ritorna None.
+    if owner is not None and is_busy(owner):
+        print(f"[Job] Operazione già in corso, richiesta ignorata: {name or fn.__name__}")
+        return None
+
+    job = Job(fn, *args, name=name, **kwargs)
+    signals = job.signals
+
+    if on_error is None and owner is not None:
+        on_error = lambda details: _show_error(owner, label, details)
+
+    if on_result:
+        signals.result.connect(on_result)
+    if on_error:
+        signals.error.connect(on_error)
+    if on_cancel:
+        signals.cancelled.connect(on_cancel)
+    if on_progress:
+        signals.progress.connect(on_progress)
+
+    if label and owner is not None:
+        # Il dialog compare solo se il lavoro dura più di mezzo secondo
+        dialog = QProgressDialog(label, "Annulla", 0, 100, owner)
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(500)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.setValue(0)
+        dialog.canceled.connect(job.cancel)
+        signals.progress.connect(lambda done, total: dialog.setValue(int(done * 100 / max(total, 1))))
+        signals.finished.connect(dialog.close)
+        signals.finished.connect(dialog.deleteLater)
+
+    if owner is not None:
+        owner._active_job = job
+    _running.add(job)
+    signals.finished.connect(lambda: _release(job, owner))
+    job_pool().start(job)
+    return job
+
+
+def wait_for_jobs(timeout_ms: int = -1) -> bool:
+    # Attende i job in corso e consegna i loro risultati (utile negli script e nei benchmark)
+    done = job_pool().waitForDone(timeout_ms)
+    QCoreApplication.processEvents()
+    return done
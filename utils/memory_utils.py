@@ -0,0 +1,336 @@
+import os
+import tracemalloc
+from collections import deque
+
+import numpy as np
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTreeWidget, QTreeWidgetItem, QPushButton,
+                             QPlainTextEdit, QLabel, QApplication, QGraphicsView, QGraphicsPixmapItem, QHeaderView)
+from PyQt5.QtGui import QPixmap, QImage
+from PyQt5.QtCore import QTimer, Qt
+
+from utils.image_cache_utils import image_cache
+
+MAX_DEPTH = 4
+SNAPSHOT_FRAMES = 10
+
+# Sorgenti esterne (cache, pool...) che vogliono comparire nel pannello: nome -> (funzione che ritorna i byte,
+# funzione opzionale che ritorna una riga di dettagli)
+_sources = {}
+
+
+def register_memory_source(name: str, size_fn, details_fn=None):
+    _sources[name] = (size_fn, details_fn)
+
+
+def unregister_memory_source(name: str):
+    _sources.pop(name, None)
+
+
+def _image_cache_details() -> str:
+    stats = image_cache().stats()
+    return (f"{stats['entries']} immagini, {stats['hits']} hit / {stats['misses']} miss "
+            f"({stats['hit_rate']:.0%}), {stats['evictions']} espulse, budget {format_bytes(stats['budget'])}")
+
+
+def format_bytes(size) -> str:
+    size = float(size or 0)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def process_rss():
+    # RSS corrente dove è leggibile senza dipendenze esterne
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def image_bytes(value) -> int:
+    if isinstance(value, QPixmap):
+        return 0 if value.isNull() else value.width() * value.height() * max(value.depth(), 8) // 8
+    if isinstance(value, QImage):
+        return 0 if value.isNull() else value.sizeInBytes()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return 0
+
+
+def _image_key(value):
+    # Le copie implicite di Qt condividono il buffer: si contano una volta sola
+    if isinstance(value, (QPixmap, QImage)):
+        return ("qt", value.cacheKey())
+    if isinstance(value, np.ndarray):
+        base = value
+        while base.base is not None and isinstance(base.base, np.ndarray):
+            base = base.base
+        return ("np", id(base))
+    return None
+
+
+def collect_images(value, seen: set, depth: int = 0):
+    # Somma i byte di pixmap/immagini/array raggiungibili da un valore, senza entrare nei widget
+    if depth > MAX_DEPTH or value is None:
+        return 0, 0
+
+    if isinstance(value, (QPixmap, QImage, np.ndarray)):
+        key = _image_key(value)
+        if key in seen:
+            return 0, 1
+        seen.add(key)
+        return image_bytes(value), 1
+
+    if isinstance(value, QGraphicsPixmapItem):
+        return collect_images(value.pixmap(), seen, depth + 1)
+
+    # Oggetti che tengono le immagini per conto loro (es. la tela sparsa degli atlas)
+    memory_images = getattr(value, "memory_images", None)
+    if callable(memory_images):
+        return collect_images(memory_images(), seen, depth + 1)
+
+    if isinstance(value, dict):
+        items = list(value.keys()) + list(value.values())
+    elif isinstance(value, (list, tuple, set, frozenset, deque)):
+        items = list(value)
+    else:
+        return 0, 0
+
+    total, count = 0, 0
+    for item in items:
+        size, found = collect_images(item, seen, depth + 1)
+        total += size
+        count += found
+    return total, count
+
+
+def scene_stats(view: QGraphicsView, seen: set):
+    # Alcune view salvano la scena in un attributo "scene" che nasconde il metodo
+    scene = QGraphicsView.scene(view)
+    if scene is None:
+        return 0, 0
+    items = scene.items()
+    size = 0
+    for item in items:
+        if isinstance(item, QGraphicsPixmapItem) or hasattr(item, "memory_images"):
+            size += collect_images(item, seen)[0]
+    return len(items), size
+
+
+def account_window(window, seen: set) -> dict:
+    # Byte per attributo (undo stack, cache, anteprime...) e oggetti di scena per ogni view
+    attributes = []
+    views = []
+    for name, value in sorted(vars(window).items()):
+        if isinstance(value, QGraphicsView):
+            count, size = scene_stats(value, seen)
+            views.append({"name": name, "items": count, "bytes": size})
+            continue
+        if isinstance(value, QWidget):
+            continue
+        size, count = collect_images(value, seen)
+        if count:
+            attributes.append({"name": name, "bytes": size, "images": count})
+
+    if isinstance(window, QGraphicsView):
+        count, size = scene_stats(window, seen)
+        views.append({"name": "scene", "items": count, "bytes": size})
+
+    attributes.sort(key=lambda entry: entry["bytes"], reverse=True)
+    return {
+        "window": type(window).__name__,
+        "title": window.windowTitle(),
+        "visible": window.isVisible(),
+        "attributes": attributes,
+        "views": views,
+        "bytes": sum(entry["bytes"] for entry in attributes) + sum(entry["bytes"] for entry in views),
+    }
+
+
+def _windows():
+    # Finestre visibili più quelle chiuse ma ancora referenziate da un'altra finestra (es. self.atlas_manager)
+    app = QApplication.instance()
+    if app is None:
+        return []
+    pending = [widget for widget in app.topLevelWidgets() if widget.isVisible() and not isinstance(widget, MemoryPanel)]
+    found = []
+    while pending:
+        window = pending.pop()
+        if any(window is other for other in found):
+            continue
+        found.append(window)
+        for value in vars(window).values():
+            if isinstance(value, QWidget) and value.isWindow() and not isinstance(value, MemoryPanel):
+                pending.append(value)
+    return found
+
+
+def indexed_report() -> dict:
+    # Documenti in modalità indicizzata: byte già contati nelle finestre (stati di undo), qui il confronto
+    # con gli stessi stati in ARGB
+    from utils.document_utils import open_documents
+
+    report = {"documents": 0, "states": 0, "bytes": 0, "argb_bytes": 0}
+    for document in open_documents():
+        stats = document.indexed_stats()
+        if stats["states"]:
+            report["documents"] += 1
+            for key in ("states", "bytes", "argb_bytes"):
+                report[key] += stats[key]
+    report["saved_bytes"] = report["argb_bytes"] - report["bytes"]
+    return report
+
+
+def memory_report(windows=None) -> dict:
+    seen = set()
+    entries = [account_window(window, seen) for window in (windows if windows is not None else _windows())]
+    entries.sort(key=lambda entry: entry["bytes"], reverse=True)
+
+    sources = []
+    for name, (size_fn, details_fn) in sorted(_sources.items()):
+        try:
+            sources.append({"name": name, "bytes": int(size_fn()), "details": details_fn() if details_fn else ""})
+        except Exception as e:
+            print(f"[Memory] Errore sorgente {name}: {e}")
+
+    return {
+        "windows": entries,
+        "sources": sources,
+        "indexed": indexed_report(),
+        "total_bytes": sum(entry["bytes"] for entry in entries) + sum(entry["bytes"] for entry in sources),
+        "rss_bytes": process_rss(),
+    }
+
+
+register_memory_source("Immagini decodificate", lambda: image_cache().stats()["bytes"], _image_cache_details)
+
+
+class TracemallocSnapshots:
+    # Snapshot su richiesta: il primo avvia il tracciamento, i successivi mostrano la differenza
+    def __init__(self, frames: int = SNAPSHOT_FRAMES):
+        self.frames = frames
+        self.previous = None
+
+    def take(self, limit: int = 25) -> str:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.previous = tracemalloc.take_snapshot()
+            return "tracemalloc avviato: il prossimo snapshot mostrerà le allocazioni nel frattempo."
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Tracciati: {format_bytes(current)} (picco {format_bytes(peak)})", ""]
+        for stat in snapshot.compare_to(self.previous, "lineno")[:limit]:
+            lines.append(str(stat))
+        self.previous = snapshot
+        return "\n".join(lines)
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.previous = None
+
+
+class MemoryPanel(QWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Memoria")
+        self.resize(700, 520)
+        self.snapshots = TracemallocSnapshots()
+
+        self.summary_label = QLabel()
+
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(["Oggetto", "Memoria", "Dettagli"])
+        self.tree.header().setSectionResizeMode(0, QHeaderView.Stretch)
+
+        self.refresh_button = QPushButton("Aggiorna")
+        self.refresh_button.clicked.connect(self.refresh)
+
+        self.snapshot_button = QPushButton("Snapshot tracemalloc")
+        self.snapshot_button.clicked.connect(self.take_snapshot)
+
+        self.stop_button = QPushButton("Ferma tracemalloc")
+        self.stop_button.clicked.connect(self.snapshots.stop)
+
+        self.snapshot_text = QPlainTextEdit()
+        self.snapshot_text.setReadOnly(True)
+        self.snapshot_text.setMaximumHeight(180)
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.summary_label)
+        button_layout.addStretch()
+        button_layout.addWidget(self.refresh_button)
+        button_layout.addWidget(self.snapshot_button)
+        button_layout.addWidget(self.stop_button)
+
+        layout = QVBoxLayout()
+        layout.addLayout(button_layout)
+        layout.addWidget(self.tree)
+        layout.addWidget(self.snapshot_text)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(2000)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self.timer.start()
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        report = memory_report()
+        rss = report["rss_bytes"]
+        saved = report["indexed"]["saved_bytes"]
+        self.summary_label.setText(
+            f"Immagini: {format_bytes(report['total_bytes'])}" + (f"  |  RSS: {format_bytes(rss)}" if rss else "")
+            + (f"  |  Indicizzati: {format_bytes(saved)} risparmiati" if saved > 0 else "")
+        )
+
+        # Si conserva l'espansione dei nodi tra un aggiornamento e l'altro
+        expanded = {self.tree.topLevelItem(i).text(0) for i in range(self.tree.topLevelItemCount())
+                    if self.tree.topLevelItem(i).isExpanded()}
+        self.tree.clear()
+
+        for entry in report["windows"]:
+            label = f"{entry['window']} — {entry['title']}" if entry["title"] else entry["window"]
+            state = "visibile" if entry["visible"] else "chiusa, ancora in memoria"
+            node = QTreeWidgetItem([label, format_bytes(entry["bytes"]), state])
+            for attribute in entry["attributes"]:
+                node.addChild(QTreeWidgetItem([attribute["name"], format_bytes(attribute["bytes"]),
+                                               f"{attribute['images']} immagini"]))
+            for view in entry["views"]:
+                node.addChild(QTreeWidgetItem([f"{view['name']} (scena)", format_bytes(view["bytes"]),
+                                               f"{view['items']} oggetti"]))
+            self.tree.addTopLevelItem(node)
+            node.setExpanded(label in expanded)
+
+        indexed = report["indexed"]
+        if indexed["documents"]:
+            self.tree.addTopLevelItem(QTreeWidgetItem([
+                "Documenti indicizzati", format_bytes(indexed["bytes"]),
+                f"{indexed['states']} stati in {indexed['documents']} documenti: "
+                f"{format_bytes(indexed['saved_bytes'])} risparmiati su {format_bytes(indexed['argb_bytes'])} in ARGB"]))
+
+        if report["sources"]:
+            node = QTreeWidgetItem(["Cache", format_bytes(sum(s["bytes"] for s in report["sources"])), ""])
+            for source in report["sources"]:
+                node.addChild(QTreeWidgetItem([source["name"], format_bytes(source["bytes"]), source["details"]]))
+            self.tree.addTopLevelItem(node)
+            node.setExpanded("Cache" in expanded)
+
+        for column in (1, 2):
+            self.tree.resizeColumnToContents(column)
+
+    def take_snapshot(self):
+        self.snapshot_text.setPlainText(self.snapshots.take())
@@ -2,6 +2,7 @@ import json
 import os
 from datetime import datetime
 from utils.controls_utils import is_atlas_file
+from utils.catalog_utils import AssetCatalog
 
 
 class MetaUtils:
@@ -11,17 +12,12 @@ class MetaUtils:
         return image_path + ".meta.json"
 
     @staticmethod
-    def save_meta(image_path, tile_size, editable=True, cols=None, rows=None, start_tile=None, end_tile=None):
+    def save_meta(image_path, tile_size, editable=True, cols=None, rows=None, start_tile=None, end_tile=None, sprites=None,
+                  palette=None):
         meta_path = MetaUtils.get_meta_path(image_path)
-        existing = {}
 
-        # Carica meta precedente se esiste
-        if os.path.exists(meta_path):
-            try:
-                with open(meta_path, "r", encoding="utf-8") as f:
-                    existing = json.load(f)
-            except Exception as e:
-                print(f"[MetaUtils] Errore lettura meta esistente: {e}")
+        # Carica meta precedente se esiste (catalogo, o JSON se più recente)
+        existing = MetaUtils.load_meta(image_path) or {}
 
         # Dati base
         data = {
@@ -30,22 +26,48 @@ class MetaUtils:
             "created_at": existing.get("created_at", datetime.now().isoformat())
         }
 
-        is_atlas = is_atlas_file(image_path)
+        # Atlas per nome, per catalogo, o perché chi salva passa i dati della griglia atlas
+        is_atlas = is_atlas_file(image_path) or any(v is not None for v in (cols, rows, sprites))
 
         if is_atlas:
             data["cols"] = cols if cols is not None else existing.get("cols", 10)
             data["rows"] = rows if rows is not None else existing.get("rows", 10)
             data["start_tile"] = start_tile if start_tile is not None else existing.get("start_tile", [0, 0])
             data["end_tile"] = end_tile if end_tile is not None else existing.get("end_tile", [0, 0])
+            # sprite -> [x_tile, y_tile, tiles_wide, tiles_high]
+            data["sprites"] = sprites if sprites is not None else existing.get("sprites", {})
+
+        # Solo per i PNG indicizzati: colori "#AARRGGBB" nell'ordine degli indici
+        if palette is not None:
+            data["palette"] = palette
 
+        # Il JSON resta come export accanto all'immagine, il catalogo è la fonte per le query
+        meta_mtime = None
         try:
             with open(meta_path, "w", encoding="utf-8") as f:
                 json.dump(data, f, indent=4)
+            meta_mtime = os.stat(meta_path).st_mtime_ns
         except Exception as e:
             print(f"[MetaUtils] Errore salvataggio meta: {e}")
 
+        catalog = AssetCatalog.instance()
+        if catalog:
+            catalog.put_meta(image_path, data, meta_mtime)
+            # Il meta si salva dopo l'immagine: dimensioni e hash del file appena scritto
+            try:
+                catalog.index_file(image_path)
+            except OSError as e:
+                print(f"[MetaUtils] Errore indicizzazione: {e}")
+
     @staticmethod
     def load_meta(image_path):
+        if not image_path:
+            return None
+
+        catalog = AssetCatalog.instance()
+        if catalog:
+            return catalog.get_meta(image_path)
+
         meta_path = MetaUtils.get_meta_path(image_path)
         if not os.path.exists(meta_path):
             return None
@@ -0,0 +1,171 @@
+import os
+import zlib
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+from utils.array_utils import qimage_view
+from utils.stream_utils import PngRowWriter, png_scanlines
+
+MAX_COLORS = 256
+# Righe per banda nelle due passate dell'esportazione indicizzata
+EXPORT_BAND_ROWS = 256
+# Colori unici confrontati con la palette per blocco (blocco x 256 distanze in memoria)
+NEAREST_CHUNK = 4096
+PNG_LEVEL = 6
+
+
+def normalize_alpha(pixels: np.ndarray) -> np.ndarray:
+    # I pixel del tutto trasparenti diventano uno solo (0x00000000): il loro RGB non si vede
+    return np.where(pixels >> 24 == 0, np.uint32(0), pixels)
+
+
+def color_histogram(pixels: np.ndarray):
+    # (colori, conteggi) dei pixel ARGB, colori ordinati
+    return np.unique(normalize_alpha(pixels).ravel(), return_counts=True)
+
+
+def merge_histograms(first, second):
+    colors = np.concatenate((first[0], second[0]))
+    counts = np.concatenate((first[1], second[1]))
+    merged, inverse = np.unique(colors, return_inverse=True)
+    return merged, np.bincount(inverse, weights=counts, minlength=len(merged)).astype(np.int64)
+
+
+def _channels(colors: np.ndarray) -> np.ndarray:
+    # (n, 4) int32 in ordine A, R, G, B
+    shifts = np.array([24, 16, 8, 0], dtype=np.uint32)
+    return ((colors[:, None] >> shifts) & 0xFF).astype(np.int32)
+
+
+def _pack(channels: np.ndarray) -> np.ndarray:
+    channels = np.clip(np.rint(channels), 0, 255).astype(np.uint32)
+    return (channels[:, 0] << 24) | (channels[:, 1] << 16) | (channels[:, 2] << 8) | channels[:, 3]
+
+
+def median_cut(colors: np.ndarray, counts: np.ndarray, max_colors: int = MAX_COLORS) -> np.ndarray:
+    # Median cut pesato sui colori unici (alpha compreso): si divide sempre il box con il canale più esteso,
+    # alla mediana dei pixel; ogni box diventa la media pesata dei suoi colori
+    values = _channels(colors)
+    weights = counts.astype(np.float64)
+
+    def widest_channel(box):
+        box_values = values[box]
+        span = box_values.max(axis=0) - box_values.min(axis=0)
+        return int(span.max()), int(span.argmax())
+
+    boxes = [np.arange(len(colors))]
+    spans = [widest_channel(boxes[0])]
+
+    while len(boxes) < max_colors:
+        widest = max(range(len(boxes)), key=lambda index: spans[index][0])
+        span, channel = spans[widest]
+        if span == 0:
+            break
+
+        box = boxes.pop(widest)
+        spans.pop(widest)
+        box = box[np.argsort(values[box, channel], kind="stable")]
+        cumulative = np.cumsum(weights[box])
+        cut = int(np.searchsorted(cumulative, cumulative[-1] / 2)) + 1
+        cut = min(max(cut, 1), len(box) - 1)
+        for half in (box[:cut], box[cut:]):
+            boxes.append(half)
+            spans.append(widest_channel(half))
+
+    means = np.array([np.average(values[box], axis=0, weights=weights[box]) for box in boxes])
+    return np.unique(_pack(means))
+
+
+def build_palette(histogram, max_colors: int = MAX_COLORS):
+    # Palette ordinata (ARGB uint32) ed esattezza: con max_colors colori o meno è la lista dei colori stessi.
+    # L'ordine crescente mette le voci trasparenti in testa, così il chunk tRNS resta corto
+    colors, counts = histogram
+    if len(colors) <= max_colors:
+        return colors.astype(np.uint32), True
+    return median_cut(colors, counts, max_colors), False
+
+
+def map_to_palette(pixels: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    # Indici uint8 del colore di palette più vicino (distanza euclidea su A, R, G, B)
+    # Prima la ricerca esatta sulla palette ordinata; il più vicino si calcola solo per i colori che non ci sono
+    flat = normalize_alpha(pixels).ravel()
+    position = np.minimum(np.searchsorted(palette, flat), len(palette) - 1)
+    indices = position.astype(np.uint8)
+
+    missing = palette[position] != flat
+    if missing.any():
+        colors, inverse = np.unique(flat[missing], return_inverse=True)
+        nearest = np.empty(len(colors), dtype=np.uint8)
+        targets = _channels(palette)
+        for start in range(0, len(colors), NEAREST_CHUNK):
+            chunk = _channels(colors[start:start + NEAREST_CHUNK])
+            distance = ((chunk[:, None, :] - targets[None, :, :]) ** 2).sum(axis=2)
+            nearest[start:start + NEAREST_CHUNK] = distance.argmin(axis=1)
+        indices[missing] = nearest[inverse]
+    return indices.reshape(pixels.shape)
+
+
+def write_indexed_png(path: str, width: int, height: int, read_band, max_colors: int = MAX_COLORS,
+                      band_rows: int = EXPORT_BAND_ROWS, job=None, alpha: bool = True) -> dict:
+    # PNG a 8 bit indicizzato in due passate a bande: istogramma dei colori, poi indici.
+    # read_band(top, rows) ritorna (rows, width) uint32 ARGB non premoltiplicato.
+    # Nella seconda passata si comprime anche l'equivalente RGBA (senza scriverlo) per riportare il risparmio
+    bands = [(top, min(band_rows, height - top)) for top in range(0, height, band_rows)]
+    steps, step = 2 * len(bands), 0
+
+    histogram = (np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int64))
+    for top, rows in bands:
+        if job is not None:
+            job.check()
+        histogram = merge_histograms(histogram, color_histogram(read_band(top, rows)))
+        step += 1
+        if job is not None:
+            job.report(step, steps)
+
+    palette, exact = build_palette(histogram, max_colors)
+    rgba_size = 0
+    estimator = zlib.compressobj(PNG_LEVEL)
+    with PngRowWriter(path, width, height, level=PNG_LEVEL, palette=palette) as writer:
+        for top, rows in bands:
+            if job is not None:
+                job.check()
+            pixels = read_band(top, rows)
+            writer.write_rows(map_to_palette(pixels, palette))
+            rgba_size += len(estimator.compress(png_scanlines(pixels, 4 if alpha else 3)))
+            step += 1
+            if job is not None:
+                job.report(step, steps)
+    rgba_size += len(estimator.flush())
+
+    return {
+        "colors": len(palette),
+        "source_colors": len(histogram[0]),
+        "exact": exact,
+        "bytes": os.path.getsize(path),
+        "rgba_bytes": rgba_size,
+        "palette": palette_to_hex(palette),
+    }
+
+
+def write_indexed_image(path: str, image: QImage, max_colors: int = MAX_COLORS, job=None) -> dict:
+    if image.format() != QImage.Format_RGB32:
+        image = image.convertToFormat(QImage.Format_ARGB32)
+    pixels = qimage_view(image)
+    return write_indexed_png(path, image.width(), image.height(), lambda top, rows: pixels[top:top + rows],
+                             max_colors, job=job, alpha=image.hasAlphaChannel())
+
+
+def palette_to_hex(palette) -> list:
+    # Formato del meta: "#AARRGGBB"
+    return [f"#{int(color):08X}" for color in palette]
+
+
+def format_export_report(stats: dict) -> str:
+    from utils.memory_utils import format_bytes
+
+    kind = "palette esatta" if stats["exact"] else f"quantizzati da {stats['source_colors']}"
+    saved = 1 - stats["bytes"] / stats["rgba_bytes"] if stats["rgba_bytes"] else 0
+    change = f"{saved:.0%} in meno" if saved >= 0 else f"{-saved:.0%} in più"
+    return (f"PNG indicizzato: {stats['colors']} colori ({kind}).\n"
+            f"{format_bytes(stats['bytes'])} invece di {format_bytes(stats['rgba_bytes'])} in RGBA ({change}).")
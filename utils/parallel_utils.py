@@ -0,0 +1,188 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+# Bande di righe da circa 1 MB: restano in cache mentre il kernel ci lavora
+BAND_BYTES = 1 << 20
+MIN_BAND_ROWS = 8
+# Sotto questa soglia (in pixel) il costo di smistare le bande supera il guadagno
+PARALLEL_MIN_PIXELS = 1 << 18
+# Numero di worker forzato (es. per provare i pool su una macchina a un core)
+WORKERS_ENV = "SPRITYLE_WORKERS"
+
+MODE_THREADS = "threads"
+MODE_PROCESSES = "processes"
+
+_lock = threading.Lock()
+_pools = {}
+
+
+def worker_count() -> int:
+    try:
+        return max(1, int(os.environ[WORKERS_ENV]))
+    except (KeyError, ValueError):
+        return max(1, os.cpu_count() or 1)
+
+
+def _pool(mode):
+    # Pool condivisi e creati al primo uso: niente thread o processi finché non servono
+    with _lock:
+        pool = _pools.get(mode)
+        if pool is None:
+            if mode == MODE_PROCESSES:
+                import multiprocessing
+                # spawn: i figli non ereditano lo stato Qt del processo principale
+                pool = ProcessPoolExecutor(worker_count(), mp_context=multiprocessing.get_context("spawn"))
+            else:
+                pool = ThreadPoolExecutor(worker_count(), thread_name_prefix="bands")
+            _pools[mode] = pool
+        return pool
+
+
+def _discard_pool(mode, pool):
+    # Un pool di processi rotto (figlio morto) non si riprende: il prossimo run_bands ne crea uno nuovo
+    with _lock:
+        if _pools.get(mode) is pool:
+            del _pools[mode]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pools():
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True)
+
+
+def band_ranges(height: int, width: int, itemsize: int = 4, band_rows: int = None) -> list:
+    # [(top, bottom), ...] che coprono tutte le righe
+    if band_rows is None:
+        band_rows = max(MIN_BAND_ROWS, BAND_BYTES // max(1, width * itemsize))
+    return [(top, min(height, top + band_rows)) for top in range(0, height, band_rows)]
+
+
+def merge_rects(rects):
+    # Unione (bounding box) dei rettangoli sporchi (x, y, w, h) delle bande; None se nessuno
+    rects = [rect for rect in rects if rect]
+    if not rects:
+        return None
+    x0 = min(x for x, _, _, _ in rects)
+    y0 = min(y for _, y, _, _ in rects)
+    x1 = max(x + w for x, _, w, _ in rects)
+    y1 = max(y + h for _, y, _, h in rects)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def mask_rect(mask: np.ndarray, top: int = 0):
+    # Rettangolo (x, y, w, h) dei pixel True, con y spostata di top (riga iniziale della banda)
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not rows.size:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), top + int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)
+
+
+def _check(job):
+    if job is not None:
+        job.check()
+
+
+def run_bands(kernel, array: np.ndarray, *args, band_rows: int = None, mode: str = MODE_THREADS,
+              job=None, **kwargs) -> list:
+    # Esegue kernel(band, top, *args, **kwargs) su ogni banda orizzontale di array e ritorna i risultati
+    # in ordine di banda. I kernel lavorano in place sulla banda e devono toccare solo le proprie righe.
+    #   threads:   per i kernel NumPy, che rilasciano il GIL (viste sull'array originale, nessuna copia)
+    #   processes: per i kernel in Python puro; array condiviso via shared memory, kernel e argomenti
+    #              picklabili (funzioni a livello di modulo)
+    height, width = array.shape[:2]
+    bands = band_ranges(height, width, array.itemsize, band_rows)
+    done = 0
+
+    if len(bands) < 2 or array.size < PARALLEL_MIN_PIXELS or worker_count() == 1:
+        results = []
+        for top, bottom in bands:
+            _check(job)
+            results.append(kernel(array[top:bottom], top, *args, **kwargs))
+            done += bottom - top
+            if job is not None:
+                job.report(done, height)
+        return results
+
+    if mode == MODE_PROCESSES:
+        return _run_bands_in_processes(kernel, array, bands, args, kwargs, job)
+
+    def call(top, bottom):
+        # Annullamento: le bande non ancora partite vengono saltate
+        if job is not None and job.is_cancelled:
+            return None
+        return kernel(array[top:bottom], top, *args, **kwargs)
+
+    futures = [_pool(MODE_THREADS).submit(call, top, bottom) for top, bottom in bands]
+    results = []
+    for (top, bottom), future in zip(bands, futures):
+        results.append(future.result())
+        done += bottom - top
+        if job is not None:
+            job.report(done, height)
+    _check(job)
+    return results
+
+
+def _process_band(shm_name, shape, dtype, top, bottom, kernel, args, kwargs):
+    # Nel processo figlio: vista sulla shared memory, nessuna copia dell'immagine
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    array = None
+    try:
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        result = kernel(array[top:bottom], top, *args, **kwargs)
+        # Un risultato che è una vista sulla shared memory non sopravvive alla chiusura: si copia
+        if isinstance(result, np.ndarray) and np.may_share_memory(result, array):
+            result = result.copy()
+        return result
+    finally:
+        del array
+        shm.close()
+
+
+def _run_bands_in_processes(kernel, array, bands, args, kwargs, job):
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    pool = _pool(MODE_PROCESSES)
+    shared = None
+    futures = []
+    try:
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        shared[...] = array
+        futures = [
+            pool.submit(_process_band, shm.name, array.shape, array.dtype.str, top, bottom, kernel, args, kwargs)
+            for top, bottom in bands
+        ]
+        results, done = [], 0
+        for (top, bottom), future in zip(bands, futures):
+            _check(job)
+            results.append(future.result())
+            done += bottom - top
+            if job is not None:
+                job.report(done, array.shape[0])
+        # I kernel possono aver scritto: si riportano i pixel nell'array del chiamante
+        array[...] = shared
+        return results
+    except BrokenProcessPool:
+        _discard_pool(MODE_PROCESSES, pool)
+        raise
+    finally:
+        # Errore o annullamento: le bande in coda non partono, quelle in corso si aspettano prima di
+        # togliere la memoria condivisa da sotto ai figli
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        del shared
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,182 @@
+import ctypes
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+from PyQt5 import sip
+from PyQt5.QtGui import QImage, QPixmap
+
+from utils.image_cache_utils import cached_image, cached_pixmap
+
+PIXEL_CACHE_ENV = "SPRITYLE_PIXEL_CACHE"
+# Valori della variabile che disattivano la cache
+DISABLED_VALUES = ("0", "off", "no", "false")
+
+MAGIC = b"SPRAW\x00\x00\x01"
+# magic, width, height, bytes per riga, formato QImage, mtime_ns, dimensione e hash del sorgente
+HEADER = struct.Struct("<8sIIIIqq40s")
+# I pixel partono allineati a 128 byte
+HEADER_SIZE = 128
+MTIME_OFFSET = struct.calcsize("<8sIIII")
+
+# Sotto questa soglia la decodifica del PNG è già istantanea: niente cache
+MIN_PIXELS = 1 << 20
+MAX_CACHE_BYTES = 4 << 30
+
+_lock = threading.Lock()
+
+
+def cache_dir():
+    value = os.environ.get(PIXEL_CACHE_ENV)
+    if value and value.lower() in DISABLED_VALUES:
+        return None
+    return value or os.path.join(os.path.expanduser("~"), ".sprityle", "pixels")
+
+
+def is_enabled() -> bool:
+    return cache_dir() is not None
+
+
+def cache_path(path: str):
+    folder = cache_dir()
+    if folder is None:
+        return None
+    key = hashlib.sha1(os.path.normcase(os.path.abspath(path)).encode("utf-8")).hexdigest()
+    return os.path.join(folder, key + ".rgba")
+
+
+def _source_hash(path: str) -> bytes:
+    from utils.watch_utils import hash_file
+    return (hash_file(path) or "").encode("ascii")
+
+
+def read_cached_image(path: str):
+    # QImage mappata sul file di cache (nessuna copia: il sistema carica le pagine quando servono),
+    # oppure None se la cache manca o non corrisponde più al sorgente
+    raw_path = cache_path(path)
+    if raw_path is None or not os.path.exists(raw_path):
+        return None
+
+    try:
+        stat = os.stat(path)
+        with open(raw_path, "rb") as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return None
+            magic, width, height, stride, fmt, mtime_ns, size, digest = HEADER.unpack(header)
+            if magic != MAGIC or os.fstat(f.fileno()).st_size < HEADER_SIZE + stride * height:
+                return None
+            if (mtime_ns, size) != (stat.st_mtime_ns, stat.st_size):
+                # File toccato ma forse identico (copia, checkout): decide l'hash del contenuto
+                if size != stat.st_size or _source_hash(path) != digest:
+                    return None
+                _update_mtime(raw_path, stat.st_mtime_ns)
+
+            # ACCESS_COPY: pagine private, chi disegna sulla QImage non tocca il file
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (OSError, ValueError, struct.error):
+        return None
+
+    buffer = (ctypes.c_char * (stride * height)).from_buffer(mapped, HEADER_SIZE)
+    image = QImage(sip.voidptr(ctypes.addressof(buffer)), width, height, stride, QImage.Format(fmt))
+    # La QImage non possiede i dati: la mappatura resta viva finché vive l'oggetto Python.
+    # Chi deve tenerla a lungo ne fa una QPixmap o una copy().
+    image.mapped_buffer = (mapped, buffer)
+    os.utime(raw_path)
+    return image
+
+
+def _update_mtime(raw_path, mtime_ns):
+    with open(raw_path, "r+b") as f:
+        f.seek(MTIME_OFFSET)
+        f.write(struct.pack("<q", mtime_ns))
+
+
+def write_cached_image(path: str, image: QImage) -> bool:
+    # Scrive i pixel decodificati accanto all'header; file temporaneo + rename, mai un file a metà
+    raw_path = cache_path(path)
+    if raw_path is None or image.isNull():
+        return False
+
+    try:
+        stat = os.stat(path)
+        digest = _source_hash(path)
+        os.makedirs(os.path.dirname(raw_path), exist_ok=True)
+
+        stride, height = image.bytesPerLine(), image.height()
+        ptr = image.constBits()
+        ptr.setsize(stride * height)
+        header = HEADER.pack(MAGIC, image.width(), height, stride, int(image.format()),
+                             stat.st_mtime_ns, stat.st_size, digest)
+
+        tmp_path = f"{raw_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+            f.write(memoryview(ptr))
+        os.replace(tmp_path, raw_path)
+    except OSError as e:
+        print(f"[PixelCache] Scrittura cache fallita per {path}: {e}")
+        return False
+
+    trim_cache()
+    return True
+
+
+def trim_cache(max_bytes: int = MAX_CACHE_BYTES):
+    # Si eliminano prima i file usati meno di recente (mtime aggiornato a ogni lettura)
+    folder = cache_dir()
+    if folder is None or not os.path.isdir(folder):
+        return
+    with _lock:
+        entries = []
+        for name in os.listdir(folder):
+            if name.endswith(".rgba"):
+                full = os.path.join(folder, name)
+                try:
+                    stat = os.stat(full)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, full))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, full in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(full)
+                total -= size
+            except OSError:
+                pass
+
+
+def _store_job(job, path, image):
+    return write_cached_image(path, image)
+
+
+def _decode(path: str, store_in_background: bool = False) -> QImage:
+    # Dalla cache su disco se valida, altrimenti decodifica (e se conviene la si scrive)
+    image = read_cached_image(path) if is_enabled() else None
+    if image is not None:
+        return image
+
+    image = QImage(path)
+    if is_enabled() and not image.isNull() and image.width() * image.height() >= MIN_PIXELS:
+        if store_in_background:
+            from utils.job_utils import start_job
+            start_job(_store_job, path, image, name="pixel_cache_store")
+        else:
+            write_cached_image(path, image)
+    return image
+
+
+def load_image(path: str, store: bool = True) -> QImage:
+    # QImage del file: prima la cache in memoria, poi quella su disco. Va bene anche fuori dal thread GUI.
+    # store=False non aggiunge l'immagine alla cache in memoria
+    return cached_image(path, _decode, store=store)
+
+
+def load_pixmap(path: str) -> QPixmap:
+    # Come QPixmap(path), ma passando per le cache; la scrittura su disco avviene nel pool
+    return cached_pixmap(path, lambda source: _decode(source, store_in_background=True))
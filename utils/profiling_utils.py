@@ -0,0 +1,243 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton,
+                             QCheckBox, QFileDialog, QHeaderView)
+from PyQt5.QtCore import QTimer, Qt
+
+PROFILE_ENV = "SPRITYLE_PROFILE"
+MAX_EVENTS = 200000
+MAX_SAMPLES = 2000
+
+
+class _ProfilerState:
+    def __init__(self):
+        self.enabled = os.environ.get(PROFILE_ENV, "").lower() not in ("", "0", "false", "no")
+        self.lock = threading.Lock()
+        self.origin_ns = time.perf_counter_ns()
+        # Eventi "X" del formato trace-event di Chrome: (nome, categoria, inizio, durata, thread)
+        self.events = deque(maxlen=MAX_EVENTS)
+        # Per ogni span: conteggio, totale e gli ultimi campioni per i percentili
+        self.stats = {}
+
+
+_state = _ProfilerState()
+
+
+def is_enabled() -> bool:
+    return _state.enabled
+
+
+def set_enabled(enabled: bool):
+    _state.enabled = bool(enabled)
+
+
+def reset():
+    with _state.lock:
+        _state.events.clear()
+        _state.stats.clear()
+        _state.origin_ns = time.perf_counter_ns()
+
+
+def _record(name, category, start_ns, end_ns):
+    duration = end_ns - start_ns
+    with _state.lock:
+        _state.events.append((name, category, start_ns, duration, threading.get_ident()))
+        entry = _state.stats.get(name)
+        if entry is None:
+            entry = _state.stats[name] = [0, 0, deque(maxlen=MAX_SAMPLES)]
+        entry[0] += 1
+        entry[1] += duration
+        entry[2].append(duration)
+
+
+def record(name: str, start_ns: int, end_ns: int, category: str = "app"):
+    # Per intervalli misurati altrove (es. l'avvio), con i tempi di time.perf_counter_ns()
+    if _state.enabled:
+        _record(name, category, start_ns, end_ns)
+
+
+class _Span:
+    __slots__ = ("name", "category", "start")
+
+    def __init__(self, name, category):
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, self.category, self.start, time.perf_counter_ns())
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, category: str = "app"):
+    # Da disattivato ritorna sempre lo stesso oggetto vuoto: nessuna allocazione né lettura dell'orologio
+    if not _state.enabled:
+        return _NULL_SPAN
+    return _Span(name, category)
+
+
+def profiled(name: str = None, category: str = "app"):
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(label, category, start, time.perf_counter_ns())
+
+        return wrapper
+
+    return decorator
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def get_stats() -> list:
+    # Una riga per span, in millisecondi, ordinate per tempo totale
+    with _state.lock:
+        snapshot = [(name, count, total, sorted(samples)) for name, (count, total, samples) in _state.stats.items()]
+
+    rows = []
+    for name, count, total, samples in snapshot:
+        rows.append({
+            "name": name,
+            "count": count,
+            "total_ms": total / 1e6,
+            "p50_ms": _percentile(samples, 0.50) / 1e6,
+            "p95_ms": _percentile(samples, 0.95) / 1e6,
+            "max_ms": (samples[-1] if samples else 0) / 1e6,
+        })
+    rows.sort(key=lambda row: row["total_ms"], reverse=True)
+    return rows
+
+
+def export_chrome_trace(path: str) -> int:
+    # JSON apribile in chrome://tracing o Perfetto
+    with _state.lock:
+        events = list(_state.events)
+        origin = _state.origin_ns
+
+    pid = os.getpid()
+    trace = [{
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": (start - origin) / 1000.0,
+        "dur": duration / 1000.0,
+        "pid": pid,
+        "tid": tid,
+    } for name, category, start, duration, tid in events]
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+    return len(trace)
+
+
+class ProfilerPanel(QWidget):
+    COLUMNS = ("Span", "Conteggio", "Totale ms", "p50 ms", "p95 ms", "Max ms")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Statistiche prestazioni")
+        self.resize(640, 400)
+
+        self.enabled_checkbox = QCheckBox("Profilazione attiva")
+        self.enabled_checkbox.setChecked(is_enabled())
+        self.enabled_checkbox.toggled.connect(set_enabled)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        self.reset_button = QPushButton("Azzera")
+        self.reset_button.clicked.connect(self.reset_stats)
+
+        self.export_button = QPushButton("Esporta trace")
+        self.export_button.clicked.connect(self.export_trace)
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.enabled_checkbox)
+        button_layout.addStretch()
+        button_layout.addWidget(self.reset_button)
+        button_layout.addWidget(self.export_button)
+
+        layout = QVBoxLayout()
+        layout.addLayout(button_layout)
+        layout.addWidget(self.table)
+        self.setLayout(layout)
+
+        # Aggiornamento periodico solo mentre il pannello è visibile
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.enabled_checkbox.setChecked(is_enabled())
+        self.refresh()
+        self.timer.start()
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        rows = get_stats()
+        self.table.setRowCount(len(rows))
+        for index, row in enumerate(rows):
+            values = (row["name"], str(row["count"]), f"{row['total_ms']:.2f}",
+                      f"{row['p50_ms']:.2f}", f"{row['p95_ms']:.2f}", f"{row['max_ms']:.2f}")
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if column:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(index, column, item)
+
+    def reset_stats(self):
+        reset()
+        self.refresh()
+
+    def export_trace(self):
+        export_trace_dialog(self)
+
+
+def export_trace_dialog(parent):
+    path, _ = QFileDialog.getSaveFileName(parent, "Esporta trace", "sprityle_trace.json", "JSON (*.json)")
+    if not path:
+        return None
+    count = export_chrome_trace(path)
+    print(f"[Profiler] {count} eventi esportati in {path}")
+    return path
@@ -0,0 +1,343 @@
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QColor
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton,
+                             QLabel, QSpinBox, QListWidget, QListWidgetItem, QHeaderView, QColorDialog,
+                             QInputDialog, QFileDialog, QMessageBox)
+
+from utils.array_utils import qimage_view
+from utils.import_utils import normalize_path
+from utils.parallel_utils import run_bands, worker_count
+
+# Colori unici confrontati con le sorgenti della mappatura per blocco (con tolleranza)
+MATCH_CHUNK = 4096
+
+
+def _split(colors: np.ndarray) -> np.ndarray:
+    # (n, 4) int16 in ordine A, R, G, B
+    shifts = np.array([24, 16, 8, 0], dtype=np.uint32)
+    return ((colors[:, None] >> shifts) & 0xFF).astype(np.int16)
+
+
+def _join(channels: np.ndarray) -> np.ndarray:
+    channels = np.clip(channels, 0, 255).astype(np.uint32)
+    return (channels[:, 0] << 24) | (channels[:, 1] << 16) | (channels[:, 2] << 8) | channels[:, 3]
+
+
+def build_lut(colors: np.ndarray, mapping, tolerance: int = 0):
+    # LUT (chiavi ordinate, valori) dei soli colori che cambiano. mapping: [(sorgente, destinazione)] ARGB.
+    # Tolleranza 0: solo i colori esatti, colors non serve. Con tolleranza un colore entro quella distanza
+    # (massima differenza per canale, alpha compreso) dalla sorgente più vicina si sposta della stessa
+    # differenza sorgente -> destinazione: le sfumature attorno al colore restano sfumature
+    if not mapping:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+    sources = np.array([source for source, _ in mapping], dtype=np.uint32)
+    targets = np.array([target for _, target in mapping], dtype=np.uint32)
+
+    if tolerance <= 0:
+        # A parità di sorgente vale l'ultima riga
+        keys, first = np.unique(sources[::-1], return_index=True)
+        return keys, targets[::-1][first]
+
+    colors = np.asarray(colors, dtype=np.uint32)
+    source_channels, shift = _split(sources), _split(targets) - _split(sources)
+    keys, values = [], []
+    for start in range(0, len(colors), MATCH_CHUNK):
+        chunk = colors[start:start + MATCH_CHUNK]
+        channels = _split(chunk)
+        distance = np.abs(channels[:, None, :] - source_channels[None, :, :]).max(axis=2)
+        nearest = distance.argmin(axis=1)
+        matched = distance[np.arange(len(chunk)), nearest] <= tolerance
+        keys.append(chunk[matched])
+        values.append(_join(channels[matched] + shift[nearest[matched]]))
+    keys, values = np.concatenate(keys), np.concatenate(values)
+    order = np.argsort(keys)
+    return keys[order], values[order]
+
+
+def apply_lut(pixels: np.ndarray, keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    # Nuovo array con i colori della LUT sostituiti: una ricerca binaria vettoriale per pixel
+    if not len(keys):
+        return pixels.copy()
+    position = np.minimum(np.searchsorted(keys, pixels), len(keys) - 1)
+    return np.where(keys[position] == pixels, values[position], pixels)
+
+
+def _recolor_band(band: np.ndarray, top: int, keys: np.ndarray, values: np.ndarray) -> int:
+    position = np.minimum(np.searchsorted(keys, band), len(keys) - 1)
+    hit = keys[position] == band
+    band[hit] = values[position[hit]]
+    return int(hit.sum())
+
+
+def _argb_image(image: QImage) -> QImage:
+    # Copia ARGB32 non premoltiplicata: le LUT lavorano sui colori come li vede il color picker
+    if image.format() == QImage.Format_ARGB32:
+        return image.copy()
+    return image.convertToFormat(QImage.Format_ARGB32)
+
+
+def recolor_image(image: QImage, mapping, tolerance: int = 0, job=None):
+    # (immagine ricolorata, pixel cambiati); l'immagine di partenza non viene toccata
+    image = _argb_image(image)
+    pixels = qimage_view(image)
+    colors = np.unique(pixels) if tolerance > 0 else None
+    keys, values = build_lut(colors, mapping, tolerance)
+    if not len(keys):
+        return image, 0
+    changed = run_bands(_recolor_band, pixels, keys, values, job=job)
+    return image, sum(changed)
+
+
+def recolor_indexed(indexed, mapping, tolerance: int = 0):
+    # Documento indicizzato (utils.indexed_utils): la LUT si applica alla sola palette, O(colori)
+    keys, values = build_lut(indexed.palette, mapping, tolerance)
+    palette = apply_lut(indexed.palette, keys, values)
+    if np.array_equal(palette, indexed.palette):
+        return None
+    return indexed.with_palette(palette)
+
+
+def variant_path(source: str, name: str, out_dir: str, taken=None) -> str:
+    # taken: path (normalizzati) già assegnati in questa generazione. Sorgenti omonime da cartelle diverse
+    # o nomi che si riducono allo stesso ("Rosso" e "Rosso!") prendono un suffisso invece di sovrascriversi
+    stem = os.path.splitext(os.path.basename(source))[0]
+    safe = re.sub(r"[^\w-]+", "_", name).strip("_") or "variante"
+    path = os.path.join(out_dir, f"{stem}_{safe}.png")
+    if taken is None:
+        return path
+    suffix = 2
+    while normalize_path(path) in taken:
+        path = os.path.join(out_dir, f"{stem}_{safe}_{suffix}.png")
+        suffix += 1
+    taken.add(normalize_path(path))
+    return path
+
+
+def generate_variants(job, sources, variants, out_dir: str, tolerance: int = 0) -> list:
+    # Per ogni sorgente (sprite o atlas): una decodifica e un solo passaggio per i colori unici, poi una LUT
+    # per variante applicata e scritta su disco nel pool. variants: [(nome, mapping)].
+    # Ritorna [(sorgente, file scritto)]; i meta si scrivono dal thread GUI
+    from utils.pixel_cache_utils import load_image
+
+    total, done = len(sources) * len(variants), 0
+    written = []
+    # Le sorgenti stesse non si sovrascrivono mai, anche se out_dir è la loro cartella
+    taken = {normalize_path(source) for source in sources}
+    # Ogni variante in volo alloca un'immagine grande quanto la sorgente: al massimo una per worker
+    limit = worker_count()
+    pending = deque()
+
+    def write_variant(pixels, colors, mapping, path):
+        # Un solo buffer per variante: la copia dei pixel si ricolora sul posto
+        keys, values = build_lut(colors, mapping, tolerance)
+        image = QImage(pixels.shape[1], pixels.shape[0], QImage.Format_ARGB32)
+        target = qimage_view(image)
+        target[...] = pixels
+        if len(keys):
+            _recolor_band(target, 0, keys, values)
+        return image.save(path, "PNG")
+
+    def collect():
+        nonlocal done
+        source, path, future = pending.popleft()
+        if future.result():
+            written.append((source, path))
+        done += 1
+        job.report(done, total)
+
+    with ThreadPoolExecutor(max_workers=limit, thread_name_prefix="variants") as pool:
+        try:
+            for source in sources:
+                job.check()
+                image = _argb_image(load_image(source, store=False))
+                if image.isNull():
+                    done += len(variants)
+                    continue
+                pixels = qimage_view(image)
+                colors = np.unique(pixels) if tolerance > 0 else None
+
+                for name, mapping in variants:
+                    while len(pending) >= limit:
+                        collect()
+                    job.check()
+                    path = variant_path(source, name, out_dir, taken)
+                    pending.append((source, path, pool.submit(write_variant, pixels, colors, mapping, path)))
+            while pending:
+                collect()
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+    return written
+
+
+def save_variant_meta(written):
+    # Dal thread GUI: ogni variante eredita il meta della sua sorgente (griglia e sprite degli atlas)
+    from utils.meta_utils import MetaUtils
+
+    for source, path in written:
+        meta = MetaUtils.load_meta(source) or {}
+        MetaUtils.save_meta(
+            path, meta.get("tile_size", 16), editable=meta.get("editable", True),
+            cols=meta.get("cols"), rows=meta.get("rows"), start_tile=meta.get("start_tile"),
+            end_tile=meta.get("end_tile"), sprites=meta.get("sprites")
+        )
+
+
+def _color_item(argb: int) -> QTableWidgetItem:
+    color = QColor.fromRgba(argb)
+    item = QTableWidgetItem(color.name(QColor.HexArgb).upper())
+    item.setData(Qt.UserRole, argb)
+    item.setBackground(color)
+    item.setForeground(QColor(Qt.black) if color.lightness() > 127 or color.alpha() < 128 else QColor(Qt.white))
+    return item
+
+
+class RecolorPanel(QWidget):
+    # Mappatura colore -> colore applicata al documento del MainWindow, e varianti generate in blocco
+    COLUMNS = ("Da", "A")
+
+    def __init__(self, window, parent=None):
+        super().__init__(parent)
+        self.main_window = window
+        self.setWindowTitle("Ricolora")
+        self.resize(360, 480)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.table.cellDoubleClicked.connect(self.edit_color)
+
+        self.add_button = QPushButton("Aggiungi")
+        self.add_button.clicked.connect(self.add_mapping)
+        self.remove_button = QPushButton("Rimuovi")
+        self.remove_button.clicked.connect(self.remove_mapping)
+
+        tolerance_label = QLabel("Tolleranza:")
+        self.tolerance_field = QSpinBox()
+        self.tolerance_field.setRange(0, 255)
+        self.tolerance_field.setToolTip("Differenza massima per canale: i colori vicini si spostano insieme")
+
+        self.apply_button = QPushButton("Applica")
+        self.apply_button.clicked.connect(self.apply_to_document)
+
+        mapping_layout = QHBoxLayout()
+        mapping_layout.addWidget(self.add_button)
+        mapping_layout.addWidget(self.remove_button)
+        mapping_layout.addStretch()
+        mapping_layout.addWidget(tolerance_label)
+        mapping_layout.addWidget(self.tolerance_field)
+        mapping_layout.addWidget(self.apply_button)
+
+        # Varianti: nome -> mappatura, generate tutte insieme su sprite o atlas
+        self.variant_list = QListWidget()
+        self.add_variant_button = QPushButton("Salva variante")
+        self.add_variant_button.clicked.connect(self.add_variant)
+        self.remove_variant_button = QPushButton("Rimuovi variante")
+        self.remove_variant_button.clicked.connect(self.remove_variant)
+        self.generate_button = QPushButton("Genera varianti...")
+        self.generate_button.clicked.connect(self.generate)
+
+        variant_layout = QHBoxLayout()
+        variant_layout.addWidget(self.add_variant_button)
+        variant_layout.addWidget(self.remove_variant_button)
+        variant_layout.addStretch()
+        variant_layout.addWidget(self.generate_button)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.table)
+        layout.addLayout(mapping_layout)
+        layout.addWidget(QLabel("Varianti:"))
+        layout.addWidget(self.variant_list)
+        layout.addLayout(variant_layout)
+        self.setLayout(layout)
+
+    def mapping(self) -> list:
+        return [(self.table.item(row, 0).data(Qt.UserRole), self.table.item(row, 1).data(Qt.UserRole))
+                for row in range(self.table.rowCount())]
+
+    def set_mapping(self, mapping):
+        self.table.setRowCount(0)
+        for source, target in mapping:
+            self._append_row(source, target)
+
+    def _append_row(self, source: int, target: int):
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        self.table.setItem(row, 0, _color_item(source))
+        self.table.setItem(row, 1, _color_item(target))
+
+    def _pick(self, initial: int, title: str):
+        color = QColorDialog.getColor(QColor.fromRgba(initial), self, title, QColorDialog.ShowAlphaChannel)
+        return color.rgba() if color.isValid() else None
+
+    def add_mapping(self):
+        # La sorgente è il colore scelto col color picker, se c'è
+        selected = self.main_window.color_field.text()
+        source = QColor(selected).rgba() if QColor.isValidColor(selected) else QColor(Qt.black).rgba()
+        target = self._pick(source, "Nuovo colore")
+        if target is not None:
+            self._append_row(source, target)
+
+    def edit_color(self, row, column):
+        argb = self._pick(self.table.item(row, column).data(Qt.UserRole), self.COLUMNS[column])
+        if argb is not None:
+            self.table.setItem(row, column, _color_item(argb))
+
+    def remove_mapping(self):
+        for row in sorted({index.row() for index in self.table.selectedIndexes()}, reverse=True):
+            self.table.removeRow(row)
+
+    def apply_to_document(self):
+        if self.table.rowCount():
+            self.main_window.apply_recolor(self.mapping(), self.tolerance_field.value())
+
+    def add_variant(self):
+        if not self.table.rowCount():
+            return
+        name, ok = QInputDialog.getText(self, "Salva variante", "Nome:", text=f"variante{self.variant_list.count() + 1}")
+        if ok and name.strip():
+            item = QListWidgetItem(name.strip())
+            item.setData(Qt.UserRole, self.mapping())
+            self.variant_list.addItem(item)
+
+    def remove_variant(self):
+        for item in self.variant_list.selectedItems():
+            self.variant_list.takeItem(self.variant_list.row(item))
+
+    def variants(self) -> list:
+        items = [self.variant_list.item(row) for row in range(self.variant_list.count())]
+        return [(item.text(), item.data(Qt.UserRole)) for item in items]
+
+    def generate(self):
+        variants = self.variants()
+        if not variants:
+            QMessageBox.warning(self, "Errore", "Nessuna variante salvata.")
+            return
+        document = self.main_window.document
+        start = document.path if document is not None and document.path else ""
+        sources, _ = QFileDialog.getOpenFileNames(self, "Sprite o atlas", start, "Immagini (*.png *.jpg *.bmp)")
+        if not sources:
+            return
+        out_dir = QFileDialog.getExistingDirectory(self, "Cartella di destinazione")
+        if not out_dir:
+            return
+
+        from utils.job_utils import start_job
+        start_job(
+            generate_variants, sources, variants, out_dir, self.tolerance_field.value(),
+            owner=self, label="Generazione varianti...", name="generate_variants",
+            on_result=lambda written: self._on_generated(written, len(sources) * len(variants))
+        )
+
+    def _on_generated(self, written, expected):
+        save_variant_meta(written)
+        QMessageBox.information(self, "Varianti generate", f"{len(written)} immagini salvate su {expected}.")
@@ -0,0 +1,240 @@
+import math
+
+import numpy as np
+from PyQt5.QtWidgets import QGraphicsItem
+from PyQt5.QtGui import QImage, QPixmap, QPainter, QColor, QBrush
+from PyQt5.QtCore import QRectF, QRect
+
+from utils.array_utils import to_argb32, qimage_view, pad_to_multiple, array_to_qimage
+from utils.stream_utils import PngRowWriter
+
+# Colori della griglia guida degli atlas (riga e colonna 0 in bianco/nero, il resto a scacchi)
+GUIDE_DARK = 0xFF000000
+GUIDE_LIGHT = 0xFFFFFFFF
+CHECKER_LIGHT = 0xFFC8C8C8
+CHECKER_WHITE = 0xFFFFFFFF
+
+BLOCK_FORMAT = QImage.Format_ARGB32_Premultiplied
+# Righe di tile per banda quando si esporta
+EXPORT_BAND_TILES = 16
+
+
+def checker_value(col: int, row: int) -> int:
+    if row == 0 or col == 0:
+        return GUIDE_DARK if (row + col) % 2 == 0 else GUIDE_LIGHT
+    return CHECKER_LIGHT if (row + col) % 2 == 0 else CHECKER_WHITE
+
+
+def checker_color(col: int, row: int) -> QColor:
+    return QColor.fromRgba(checker_value(col, row))
+
+
+class SparseTileCanvas:
+    # Atlas come dizionario di tile occupati (col, row) -> QImage tile_size x tile_size sopra uno sfondo
+    # procedurale (la scacchiera guida): la memoria cresce con l'area occupata, non con la tela.
+    # Disegno, hit-test ed esportazione leggono direttamente i blocchi.
+    def __init__(self, width: int, height: int, tile_size: int, has_alpha: bool = False):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.cols = math.ceil(width / tile_size)
+        self.rows = math.ceil(height / tile_size)
+        self.has_alpha = has_alpha
+        self.blocks = {}
+        self._brush = None
+
+    @classmethod
+    def from_image(cls, image: QImage, tile_size: int):
+        # Da un atlas già salvato: si tengono solo i tile che differiscono dallo sfondo
+        canvas = cls(image.width(), image.height(), tile_size, has_alpha=image.hasAlphaChannel())
+        source = to_argb32(image)
+        pixels = qimage_view(source)
+        band = tile_size * EXPORT_BAND_TILES
+        cols = canvas.cols
+        expected = np.array([[checker_value(col, row) for col in range(cols)]
+                             for row in range(canvas.rows)], dtype=np.uint32)
+
+        for top in range(0, image.height(), band):
+            # Bande di righe di tile: il confronto non alloca maschere grandi quanto l'atlas
+            tiles = pad_to_multiple(pixels[top:top + band], tile_size)
+            rows = tiles.shape[0] // tile_size
+            grid = tiles.reshape(rows, tile_size, cols, tile_size)
+            first = top // tile_size
+            background = (grid == expected[first:first + rows, None, :, None]).all(axis=(1, 3))
+            for row, col in zip(*np.nonzero(~background)):
+                block = array_to_qimage(grid[row, :, col, :], source.format())
+                canvas.blocks[(int(col), first + int(row))] = block.convertToFormat(BLOCK_FORMAT)
+        return canvas
+
+    def snapshot(self):
+        # Copia per i job: i blocchi sono a condivisione implicita, si duplicano solo se poi vengono modificati
+        copy = SparseTileCanvas(self.width, self.height, self.tile_size, self.has_alpha)
+        copy.blocks = dict(self.blocks)
+        return copy
+
+    def rect(self) -> QRectF:
+        return QRectF(0, 0, self.width, self.height)
+
+    def memory_images(self):
+        return list(self.blocks.values())
+
+    def memory_bytes(self) -> int:
+        return sum(block.sizeInBytes() for block in self.blocks.values())
+
+    # --- Hit-test -----------------------------------------------------------
+
+    def tile_at(self, x: float, y: float):
+        col, row = int(x // self.tile_size), int(y // self.tile_size)
+        if 0 <= col < self.cols and 0 <= row < self.rows:
+            return col, row
+        return None
+
+    def is_occupied(self, col: int, row: int) -> bool:
+        return (col, row) in self.blocks
+
+    def pixel(self, x: int, y: int) -> QColor:
+        col, row = x // self.tile_size, y // self.tile_size
+        block = self.blocks.get((col, row))
+        if block is None:
+            return checker_color(col, row)
+        return block.pixelColor(x - col * self.tile_size, y - row * self.tile_size)
+
+    # --- Modifica -----------------------------------------------------------
+
+    def _block(self, col: int, row: int) -> QImage:
+        block = self.blocks.get((col, row))
+        if block is None:
+            block = QImage(self.tile_size, self.tile_size, BLOCK_FORMAT)
+            block.fill(checker_color(col, row))
+            self.blocks[(col, row)] = block
+        return block
+
+    def draw_image(self, x: int, y: int, image):
+        # Come painter.drawImage sull'atlas intero, ma solo sui tile toccati dall'immagine
+        if isinstance(image, QPixmap):
+            image = image.toImage()
+        if image.isNull():
+            return
+        ts = self.tile_size
+        col0, row0 = max(0, x // ts), max(0, y // ts)
+        col1 = min(self.cols, (x + image.width() + ts - 1) // ts)
+        row1 = min(self.rows, (y + image.height() + ts - 1) // ts)
+
+        for row in range(row0, row1):
+            for col in range(col0, col1):
+                painter = QPainter(self._block(col, row))
+                painter.drawImage(x - col * ts, y - row * ts, image)
+                painter.end()
+
+    def clear_tiles(self, x_tile: int, y_tile: int, tiles_wide: int, tiles_high: int):
+        # Tile liberati: tornano sfondo e non occupano più memoria
+        for row in range(y_tile, y_tile + tiles_high):
+            for col in range(x_tile, x_tile + tiles_wide):
+                self.blocks.pop((col, row), None)
+
+    # --- Disegno ed esportazione -------------------------------------------
+
+    def _checker_brush(self) -> QBrush:
+        # Scacchiera 2x2 celle ripetuta: lo sfondo costa un solo fillRect per area esposta
+        if self._brush is None:
+            ts = self.tile_size
+            texture = QImage(ts * 2, ts * 2, QImage.Format_RGB32)
+            texture.fill(QColor.fromRgba(CHECKER_WHITE))
+            painter = QPainter(texture)
+            painter.fillRect(0, 0, ts, ts, QColor.fromRgba(CHECKER_LIGHT))
+            painter.fillRect(ts, ts, ts, ts, QColor.fromRgba(CHECKER_LIGHT))
+            painter.end()
+            self._brush = QBrush(texture)
+        return self._brush
+
+    def render(self, painter: QPainter, exposed: QRectF = None, exact: bool = False):
+        # Disegna l'area esposta: sfondo procedurale, riga/colonna guida e solo i blocchi visibili.
+        # exact copia i blocchi così come sono (alpha compreso), per l'esportazione
+        ts = self.tile_size
+        exposed = self.rect() if exposed is None else exposed.intersected(self.rect())
+        if exposed.isEmpty():
+            return
+        col0, row0 = int(exposed.left() // ts), int(exposed.top() // ts)
+        col1 = min(self.cols, int(math.ceil(exposed.right() / ts)))
+        row1 = min(self.rows, int(math.ceil(exposed.bottom() / ts)))
+
+        painter.save()
+        painter.setClipRect(self.rect())
+        painter.setBrushOrigin(0, 0)
+        painter.fillRect(QRect(col0 * ts, row0 * ts, (col1 - col0) * ts, (row1 - row0) * ts), self._checker_brush())
+        if row0 == 0:
+            for col in range(col0, col1):
+                painter.fillRect(col * ts, 0, ts, ts, checker_color(col, 0))
+        if col0 == 0:
+            for row in range(max(row0, 1), row1):
+                painter.fillRect(0, row * ts, ts, ts, checker_color(0, row))
+
+        if exact:
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+        visible = (col1 - col0) * (row1 - row0)
+        if visible < len(self.blocks):
+            cells = ((col, row) for row in range(row0, row1) for col in range(col0, col1))
+            blocks = ((cell, self.blocks.get(cell)) for cell in cells)
+        else:
+            blocks = self.blocks.items()
+        for (col, row), block in blocks:
+            if block is not None and col0 <= col < col1 and row0 <= row < row1:
+                painter.drawImage(col * ts, row * ts, block)
+        painter.restore()
+
+    def to_image(self, rect: QRect = None) -> QImage:
+        rect = rect or QRect(0, 0, self.width, self.height)
+        image = QImage(rect.width(), rect.height(), QImage.Format_ARGB32)
+        painter = QPainter(image)
+        painter.translate(-rect.x(), -rect.y())
+        self.render(painter, QRectF(rect), exact=True)
+        painter.end()
+        return image
+
+    def write_png(self, path: str, job=None) -> bool:
+        # Esportazione a bande di righe di tile: in memoria una banda alla volta, mai l'atlas intero
+        band = self.tile_size * EXPORT_BAND_TILES
+        with PngRowWriter(path, self.width, self.height, alpha=self.has_alpha) as writer:
+            for top in range(0, self.height, band):
+                if job is not None:
+                    job.check()
+                image = self.to_image(QRect(0, top, self.width, min(band, self.height - top)))
+                writer.write_rows(qimage_view(image))
+                if job is not None:
+                    job.report(min(top + band, self.height), self.height)
+        return True
+
+    def read_band(self, top: int, rows: int) -> np.ndarray:
+        # Righe [top, top + rows) come (rows, width) uint32 ARGB non premoltiplicato, per gli export a bande
+        image = self.to_image(QRect(0, top, self.width, rows))
+        return qimage_view(image).copy()
+
+    def write_indexed_png(self, path: str, job=None, max_colors: int = 256) -> dict:
+        # PNG a 8 bit con palette, sempre a bande di righe di tile (vedi utils.palette_utils)
+        from utils.palette_utils import write_indexed_png
+
+        return write_indexed_png(path, self.width, self.height, self.read_band, max_colors,
+                                 band_rows=self.tile_size * EXPORT_BAND_TILES, job=job, alpha=self.has_alpha)
+
+    def write_dds(self, path: str, fmt: str, quality: int, regions=None, job=None) -> dict:
+        # Texture BC1/BC3 pronta per la GPU (vedi utils.dds_utils)
+        from utils.dds_utils import write_dds
+
+        return write_dds(path, self.width, self.height, self.read_band, fmt, quality, regions, job=job)
+
+
+class SparseCanvasItem(QGraphicsItem):
+    # Item di scena che disegna solo la parte esposta della tela
+    def __init__(self, canvas: SparseTileCanvas):
+        super().__init__()
+        self.canvas = canvas
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def boundingRect(self) -> QRectF:
+        return self.canvas.rect()
+
+    def paint(self, painter, option, widget=None):
+        self.canvas.render(painter, option.exposedRect)
+
+    def memory_images(self):
+        return self.canvas.memory_images()
@@ -0,0 +1,168 @@
+import numpy as np
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QImage
+
+from utils.array_utils import to_argb32, qimage_view
+from utils.parallel_utils import run_bands
+
+MODE_ALPHA = "alpha"
+MODE_BACKGROUND = "background"
+
+
+def _foreground_band(band: np.ndarray, top: int, out: np.ndarray, mode: str, alpha_threshold: int, background):
+    alpha = (band >> 24) & 0xFF
+    mask = out[top:top + band.shape[0]]
+    np.greater(alpha, alpha_threshold, out=mask)
+    if mode == MODE_BACKGROUND:
+        mask &= band != np.uint32(background)
+
+
+def foreground_mask(array: np.ndarray, mode: str = MODE_ALPHA, alpha_threshold: int = 0, background=None) -> np.ndarray:
+    if mode == MODE_BACKGROUND and background is None:
+        # Sfondo a tinta unita: di default il colore del pixel in alto a sinistra
+        background = array[0, 0] if array.size else 0
+    # Scansione di occupazione a bande: ogni banda scrive solo le proprie righe della maschera
+    mask = np.empty(array.shape, dtype=bool)
+    run_bands(_foreground_band, array, mask, mode, alpha_threshold, background)
+    return mask
+
+
+def _find_runs(mask: np.ndarray):
+    # Run orizzontali di pixel pieni: (riga, inizio, fine esclusa), in ordine riga per riga.
+    # Una colonna vuota separa le righe, così basta un solo passaggio sull'array appiattito.
+    height, width = mask.shape
+    padded = np.zeros((height, width + 1), dtype=np.int8)
+    padded[:, :width] = mask
+    flat = padded.ravel()
+    edges = np.flatnonzero(np.diff(flat, prepend=np.int8(0)))
+    starts_flat, ends_flat = edges[0::2], edges[1::2]
+    rows = starts_flat // (width + 1)
+    return rows, starts_flat - rows * (width + 1), ends_flat - rows * (width + 1)
+
+
+def _run_edges(rows, starts, ends, width):
+    # Coppie di run in righe consecutive che si toccano (connettività 8), tutto con searchsorted
+    key = width + 2
+    start_keys = rows * key + starts
+    end_keys = rows * key + ends
+
+    next_row = (rows + 1) * key
+    lo = np.searchsorted(end_keys, next_row + starts, side="left")
+    hi = np.searchsorted(start_keys, next_row + ends, side="right") - 1
+
+    counts = np.clip(hi - lo + 1, 0, None)
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    src = np.repeat(np.arange(len(rows)), counts)
+    first = np.repeat(lo, counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return src, first + offsets
+
+
+def _connected_labels(count: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    # Propagazione del minimo + pointer jumping: poche iterazioni, nessun ciclo per pixel
+    labels = np.arange(count)
+    if len(src) == 0:
+        return labels
+
+    while True:
+        low = np.minimum(labels[src], labels[dst])
+        updated = labels.copy()
+        np.minimum.at(updated, labels[src], low)
+        np.minimum.at(updated, labels[dst], low)
+        while True:
+            jumped = updated[updated]
+            if np.array_equal(jumped, updated):
+                break
+            updated = jumped
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def _dilate_runs(rows, starts, ends, reach: int):
+    # Max-filter sulle lunghezze dei run: ogni run si allunga di reach pixel a destra e si ripete sulle reach
+    # righe sotto, poi i run sovrapposti della stessa riga si fondono. È la maschera dilatata senza
+    # materializzarla; (rows, starts, ends) escono ordinati come quelli di _find_runs
+    if reach <= 0 or len(rows) == 0:
+        return rows, starts, ends
+    rows = (rows[:, None] + np.arange(reach + 1)).ravel()
+    starts = np.repeat(starts, reach + 1)
+    ends = np.repeat(ends + reach, reach + 1)
+
+    order = np.lexsort((starts, rows))
+    rows, starts, ends = rows[order], starts[order], ends[order]
+    key = int(ends.max()) + 1
+    end_keys = rows * key + ends
+    # Un run nuovo comincia dove non tocca nessuno dei run precedenti della stessa riga
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = rows[1:] * key + starts[1:] > np.maximum.accumulate(end_keys)[:-1]
+    heads = np.flatnonzero(first)
+    merged_rows = rows[heads]
+    return merged_rows, starts[heads], np.maximum.reduceat(end_keys, heads) - merged_rows * key
+
+
+def _label_runs(rows, starts, ends, width: int):
+    src, dst = _run_edges(rows, starts, ends, width)
+    labels = _connected_labels(len(rows), src, dst)
+    _, labels = np.unique(labels, return_inverse=True)
+    count = int(labels.max()) + 1 if len(labels) else 0
+    return labels, count
+
+
+def label_components(mask: np.ndarray):
+    # Etichetta le componenti connesse (8-vicinato) di una maschera booleana.
+    # Ritorna (rows, starts, ends, labels) per ogni run e il numero di componenti.
+    rows, starts, ends = _find_runs(mask)
+    labels, count = _label_runs(rows, starts, ends, mask.shape[1])
+    return (rows, starts, ends, labels), count
+
+
+def detect_sprite_boxes(array: np.ndarray, gap: int = 1, mode: str = MODE_ALPHA,
+                        alpha_threshold: int = 0, background=None, min_area: int = 4):
+    # Bounding box (x, y, w, h) degli sprite: frammenti a distanza <= gap (Chebyshev) vengono uniti
+    mask = foreground_mask(array, mode, alpha_threshold, background)
+    if not mask.any():
+        return []
+
+    # Dilatazione di gap - 1 pixel verso destra e verso il basso: due pixel finiscono nella stessa componente
+    # esattamente quando distano al massimo gap, qualunque sia il loro allineamento
+    rows, starts, ends = _find_runs(mask)
+    reach = max(1, int(gap)) - 1
+    width = mask.shape[1] + reach
+    dilated_rows, dilated_starts, dilated_ends = _dilate_runs(rows, starts, ends, reach)
+    labels, count = _label_runs(dilated_rows, dilated_starts, dilated_ends, width)
+    if reach:
+        # Ogni run originale sta dentro il run dilatato della sua riga che comincia per ultimo prima di lui
+        key = width + 1
+        owner = np.searchsorted(dilated_rows * key + dilated_starts, rows * key + starts, side="right") - 1
+        labels = labels[owner]
+
+    # Box di ogni componente dai soli run originali: già al pixel, senza il margine della dilatazione
+    x0 = np.full(count, np.iinfo(np.int64).max)
+    y0 = np.full(count, np.iinfo(np.int64).max)
+    x1 = np.full(count, -1)
+    y1 = np.full(count, -1)
+    np.minimum.at(x0, labels, starts)
+    np.minimum.at(y0, labels, rows)
+    np.maximum.at(x1, labels, ends)
+    np.maximum.at(y1, labels, rows + 1)
+
+    boxes = []
+    for bx0, by0, bx1, by1 in zip(x0.tolist(), y0.tolist(), x1.tolist(), y1.tolist()):
+        w, h = bx1 - bx0, by1 - by0
+        if w * h >= min_area:
+            boxes.append((bx0, by0, w, h))
+
+    boxes.sort(key=lambda box: (box[1], box[0]))
+    return boxes
+
+
+def detect_sprites(image: QImage, gap: int = 1, mode: str = MODE_ALPHA, alpha_threshold: int = 0, min_area: int = 4):
+    if mode == MODE_ALPHA and not image.hasAlphaChannel():
+        mode = MODE_BACKGROUND
+    image = to_argb32(image)
+    boxes = detect_sprite_boxes(qimage_view(image), gap, mode, alpha_threshold, min_area=min_area)
+    return [QRect(x, y, w, h) for x, y, w, h in boxes]
@@ -0,0 +1,46 @@
+import sys
+import time
+
+from PyQt5.QtCore import QObject, QEvent
+
+from utils.profiling_utils import record
+
+# Moduli che la finestra principale non deve caricare all'avvio: arrivano al primo utilizzo
+DEFERRED_MODULES = (
+    "numpy",
+    "sqlite3",
+    "atlas.atlas_manager",
+    "atlas.atlas_creator_widget",
+    "atlas.atlas_generated_window",
+    "tile_splitter.tile_splitter",
+    "tile_splitter.tile_splitter_executor",
+    "utils.meta_utils",
+    "utils.catalog_utils",
+    "utils.memory_utils",
+)
+
+
+def loaded_deferred_modules() -> list:
+    return [name for name in DEFERRED_MODULES if name in sys.modules]
+
+
+class FirstFrameProbe(QObject):
+    # Misura il tempo dall'avvio del processo al primo paint della finestra, una volta sola
+    def __init__(self, window, start_time: float, callback=None):
+        super().__init__(window)
+        self.window = window
+        self.start_time = start_time
+        self.callback = callback
+        self.elapsed = None
+        window.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if obj is self.window and event.type() == QEvent.Paint and self.elapsed is None:
+            self.elapsed = time.perf_counter() - self.start_time
+            self.window.removeEventFilter(self)
+            end = time.perf_counter_ns()
+            record("startup.first_frame", end - int(self.elapsed * 1e9), end, "startup")
+            print(f"[Startup] Primo frame in {self.elapsed * 1000:.0f} ms")
+            if self.callback:
+                self.callback(self.elapsed)
+        return False
@@ -1,16 +1,22 @@
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import QMessageBox
+from utils.profiling_utils import profiled
 
 
+@profiled("undo_snapshot", "undo")
 def save_state(pixmap_item, selected_coords: set, undo_stack: list, redo_stack: list):
     if not pixmap_item:
         print("save_state: pixmap_item is None")
         return
 
-    state = {
-        "pixmap": pixmap_item.pixmap().copy(),
-        "selection": set(selected_coords) if selected_coords else set()
-    }
+    state = {"selection": set(selected_coords) if selected_coords else set()}
+    indexed = getattr(pixmap_item, "indexed", None)
+    if indexed is not None:
+        # Documento indicizzato (utils.indexed_utils): immutabile, le modifiche di colore condividono gli indici
+        state["indexed"] = indexed
+    else:
+        # Copia implicita: il buffer si duplica solo quando una modifica lo riscrive
+        state["pixmap"] = pixmap_item.pixmap()
     undo_stack.append(state)
     redo_stack.clear()
 
@@ -21,6 +27,11 @@ def apply_state(pixmap_item, selected_coords: set, state: dict, restore_selectio
 
     if "pixmap" in state:
         pixmap_item.setPixmap(state["pixmap"])
+    elif "indexed" in state:
+        if hasattr(pixmap_item, "set_indexed"):
+            pixmap_item.set_indexed(state["indexed"])
+        else:
+            pixmap_item.setPixmap(state["indexed"].to_pixmap())
 
     if "selection" in state and restore_selection_fn:
         restore_selection_fn(state["selection"])
@@ -29,6 +40,7 @@ def apply_state(pixmap_item, selected_coords: set, state: dict, restore_selectio
     selected_coords.update(state.get("selection", []))
 
 
+@profiled("undo", "undo")
 def undo_state(pixmap_item, selected_coords: set, undo_stack: list, redo_stack: list, restore_selection_fn=None):
     if len(undo_stack) <= 1:
         print("[UNDO] Stack troppo corto, impossibile annullare.")
@@ -40,6 +52,7 @@ def undo_state(pixmap_item, selected_coords: set, undo_stack: list, redo_stack:
     apply_state(pixmap_item, selected_coords, previous, restore_selection_fn)
 
 
+@profiled("redo", "undo")
 def redo_state(pixmap_item, selected_coords: set, undo_stack: list, redo_stack: list, restore_selection_fn=None):
     if not redo_stack:
         print("[REDO] Stack vuoto, niente da rifare.")
@@ -51,13 +64,20 @@ def redo_state(pixmap_item, selected_coords: set, undo_stack: list, redo_stack:
     apply_state(pixmap_item, selected_coords, next_state, restore_selection_fn)
 
 
-def reset_state(pixmap_item, original_pixmap: QPixmap, selected_coords: set,
+def reset_state(pixmap_item, original_pixmap, selected_coords: set,
                 undo_stack: list, redo_stack: list, restore_selection_fn=None, color_field=None, parent=None):
+    # original_pixmap: QPixmap, o IndexedImage per i documenti indicizzati (resta indicizzato, niente ARGB)
     if not pixmap_item or not original_pixmap:
         return
 
+    # Stato base iniziale
+    if hasattr(original_pixmap, "indices"):
+        state = {"indexed": original_pixmap, "selection": set()}
+    else:
+        state = {"pixmap": QPixmap(original_pixmap), "selection": set()}
+
     # Reset immagine
-    pixmap_item.setPixmap(QPixmap(original_pixmap))
+    apply_state(pixmap_item, set(), state)
 
     # Reset selezione visiva + logica
     if restore_selection_fn and callable(restore_selection_fn):
@@ -69,12 +89,6 @@ def reset_state(pixmap_item, original_pixmap: QPixmap, selected_coords: set,
     # Pulisce gli stack
     undo_stack.clear()
     redo_stack.clear()
-
-    # Stato base iniziale
-    state = {
-        "pixmap": QPixmap(original_pixmap),
-        "selection": set()
-    }
     undo_stack.append(state)
 
     if color_field:
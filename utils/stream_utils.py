@@ -0,0 +1,513 @@
+import hashlib
+import os
+import struct
+import zlib
+
+import numpy as np
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QImage, QImageReader, QImageIOHandler
+
+from utils.array_utils import to_argb32, qimage_to_array, pad_to_multiple, array_to_qimage
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Quanti byte compressi leggere per volta dal file
+READ_CHUNK = 1 << 16
+# Bande da circa 8 MB di pixel decodificati
+BAND_BYTES = 8 << 20
+# Fogli che decodificati restano sotto questa soglia si leggono interi con Qt (molto più veloce)
+FULL_DECODE_LIMIT = 64 << 20
+
+_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# PNG sintetico con la stessa unità di filtro (byte per pixel): bpp -> (tipo colore, profondità, formato Qt atteso)
+_SYNTHETIC = {
+    1: (0, 8, QImage.Format_Grayscale8),
+    2: (4, 8, QImage.Format_ARGB32),
+    3: (2, 8, QImage.Format_RGB32),
+    4: (6, 8, QImage.Format_ARGB32),
+    6: (2, 16, QImage.Format_RGBX64),
+    8: (6, 16, QImage.Format_RGBA64),
+}
+
+
+class UnsupportedStream(Exception):
+    pass
+
+
+def _argb(r, g, b, a) -> np.ndarray:
+    return (a.astype(np.uint32) << 24) | (r.astype(np.uint32) << 16) | (g.astype(np.uint32) << 8) | b.astype(np.uint32)
+
+
+def remove_partial(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+
+
+class PngRowReader:
+    # Decodifica un PNG non interlacciato a righe: in memoria restano solo il blocco zlib corrente,
+    # la riga precedente (per i filtri) e le righe richieste. Nessuna dipendenza oltre numpy e zlib.
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        try:
+            self._read_header()
+        except Exception:
+            self.file.close()
+            raise
+
+        self.row = 0
+        self.buffer = bytearray()
+        self.decompressor = zlib.decompressobj()
+        self.prev = np.zeros(self.row_bytes, dtype=np.uint8)
+
+    def _read_header(self):
+        if self.file.read(8) != PNG_SIGNATURE:
+            raise UnsupportedStream("non è un PNG")
+
+        palette = transparency = None
+        while True:
+            header = self.file.read(8)
+            if len(header) < 8:
+                raise UnsupportedStream("PNG senza dati immagine")
+            length, chunk_type = struct.unpack(">I4s", header)
+            if chunk_type == b"IDAT":
+                self._idat_left = length
+                break
+            data = self.file.read(length)
+            self.file.read(4)  # CRC
+            if chunk_type == b"IHDR":
+                self.width, self.height, self.depth, self.color_type, _, _, interlace = struct.unpack(">IIBBBBB", data)
+                if interlace:
+                    raise UnsupportedStream("PNG interlacciato")
+            elif chunk_type == b"PLTE":
+                palette = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+            elif chunk_type == b"tRNS":
+                transparency = data
+
+        if self.color_type not in _CHANNELS:
+            raise UnsupportedStream(f"tipo colore PNG {self.color_type}")
+        self.channels = _CHANNELS[self.color_type]
+        bits_per_pixel = self.channels * self.depth
+        # Unità dei filtri: byte per pixel, almeno 1 con profondità sotto gli 8 bit
+        self.bpp = max(1, bits_per_pixel // 8)
+        self.row_bytes = (self.width * bits_per_pixel + 7) // 8
+        self._build_lookup(palette, transparency)
+
+    def _build_lookup(self, palette, transparency):
+        self.lut = None
+        self.transparent = None
+        if self.color_type == 3:
+            if palette is None:
+                raise UnsupportedStream("PNG a palette senza PLTE")
+            alpha = np.full(len(palette), 255, dtype=np.uint8)
+            if transparency:
+                trns = np.frombuffer(transparency, dtype=np.uint8)[:len(palette)]
+                alpha[:len(trns)] = trns
+            lut = np.zeros(256, dtype=np.uint32)
+            lut[:len(palette)] = _argb(palette[:, 0], palette[:, 1], palette[:, 2], alpha)
+            self.lut = lut
+        elif transparency and self.color_type in (0, 2):
+            # Un solo colore trasparente, campioni a 16 bit
+            values = struct.unpack(">%dH" % (len(transparency) // 2), transparency)
+            self.transparent = values
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_idat(self) -> bytes:
+        while self._idat_left == 0:
+            self.file.read(4)  # CRC del chunk precedente
+            header = self.file.read(8)
+            if len(header) < 8:
+                self._idat_left = -1
+                break
+            length, chunk_type = struct.unpack(">I4s", header)
+            if chunk_type != b"IDAT":
+                self._idat_left = -1
+                break
+            self._idat_left = length
+        if self._idat_left < 0:
+            return b""
+        data = self.file.read(min(self._idat_left, READ_CHUNK))
+        self._idat_left -= len(data)
+        return data
+
+    def _fill(self, size: int):
+        # max_length limita l'espansione: un blocco molto comprimibile non riempie la memoria
+        while len(self.buffer) < size:
+            data = self.decompressor.unconsumed_tail or self._read_idat()
+            if not data:
+                raise ValueError("PNG troncato")
+            self.buffer += self.decompressor.decompress(data, max(size - len(self.buffer), READ_CHUNK))
+
+    def read_rows(self, count: int) -> np.ndarray:
+        # Le prossime count righe come array (n, width) uint32 ARGB
+        count = min(count, self.height - self.row)
+        if count <= 0:
+            return np.zeros((0, self.width), dtype=np.uint32)
+
+        size = count * (self.row_bytes + 1)
+        self._fill(size)
+        data = np.frombuffer(bytes(self.buffer[:size]), dtype=np.uint8).reshape(count, self.row_bytes + 1)
+        del self.buffer[:size]
+
+        rows = self._unfilter(data[:, 0], data[:, 1:])
+        self.prev = rows[-1].copy()
+        self.row += count
+        return self._to_argb(rows)
+
+    def _unfilter(self, filters: np.ndarray, raw: np.ndarray) -> np.ndarray:
+        if filters.max() <= 2:
+            return self._unfilter_rows(filters, raw)
+        rows = self._unfilter_libpng(filters, raw)
+        return rows if rows is not None else self._unfilter_wavefront(filters, raw)
+
+    def _unfilter_rows(self, filters, raw):
+        # None/Sub/Up: ogni riga si risolve con operazioni vettoriali
+        out = np.empty_like(raw)
+        prev = self.prev
+        for i, kind in enumerate(filters):
+            line = raw[i]
+            if kind == 1:
+                line = np.cumsum(line.reshape(-1, self.bpp), axis=0, dtype=np.uint8).reshape(-1)
+            elif kind == 2:
+                line = line + prev
+            out[i] = line
+            prev = out[i]
+        return out
+
+    def _unfilter_libpng(self, filters, raw):
+        # Average e Paeth sono sequenziali lungo la riga: li risolve libpng (via Qt) su un PNG sintetico della
+        # banda con la stessa unità di filtro, a 8 o 16 bit per campione così che i byte tornino identici.
+        # In testa la riga precedente già decodificata, con filtro None: è il riferimento della prima riga.
+        # None se Qt non restituisce il formato atteso (si ripiega sul fronte d'onda)
+        synthetic = _SYNTHETIC.get(self.bpp)
+        if synthetic is None:
+            return None
+        color_type, depth, expected = synthetic
+        count = raw.shape[0]
+        width = self.row_bytes // self.bpp
+        data = np.empty((count + 1, self.row_bytes + 1), dtype=np.uint8)
+        data[0, 0] = 0
+        data[0, 1:] = self.prev
+        data[1:, 0] = filters
+        data[1:, 1:] = raw
+
+        # zlib a livello 0: blocchi non compressi, costa quanto una copia
+        png = (PNG_SIGNATURE
+               + png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, count + 1, depth, color_type, 0, 0, 0))
+               + png_chunk(b"IDAT", zlib.compress(data.tobytes(), 0))
+               + png_chunk(b"IEND", b""))
+        image = QImage.fromData(png, "PNG")
+        if image.isNull() or image.format() != expected:
+            return None
+
+        # Copia dei byte: la memoria della QImage sparisce con lei, i risultati possono esserne viste
+        buffer = image.constBits().asstring(image.sizeInBytes())
+        lines = np.frombuffer(buffer, dtype=np.uint8).reshape(count + 1, image.bytesPerLine())[1:]
+        if depth == 16:
+            samples = lines.view(np.uint16)[:, :width * 4].reshape(count, width, 4)[..., :self.bpp // 2]
+            return samples.astype(">u2").view(np.uint8).reshape(count, self.row_bytes)
+        if expected == QImage.Format_Grayscale8:
+            return lines[:, :width].copy()
+
+        pixels = lines.view(np.uint32)[:, :width]
+        shifts = {2: (16, 24), 3: (16, 8, 0), 4: (16, 8, 0, 24)}[self.bpp]
+        samples = np.empty((count, width, self.bpp), dtype=np.uint8)
+        for channel, shift in enumerate(shifts):
+            samples[..., channel] = pixels >> np.uint32(shift)
+        return samples.reshape(count, self.row_bytes)
+
+    def _unfilter_wavefront(self, filters, raw):
+        # Ripiego: Average e Paeth dipendono dal pixel a sinistra, sopra e in alto a sinistra: i pixel sulla stessa
+        # antidiagonale (riga + colonna costante) sono indipendenti e si risolvono insieme
+        count = raw.shape[0]
+        width = self.row_bytes // self.bpp
+        source = raw.reshape(count, width, self.bpp).astype(np.int16)
+        out = np.zeros((count + 1, width + 1, self.bpp), dtype=np.int16)
+        out[0, 1:] = self.prev.reshape(width, self.bpp)
+        kinds = filters.astype(np.int16)
+
+        for diagonal in range(count + width - 1):
+            rows = np.arange(max(0, diagonal - width + 1), min(count, diagonal + 1))
+            cols = diagonal - rows
+            a = out[rows + 1, cols]
+            b = out[rows, cols + 1]
+            c = out[rows, cols]
+            kind = kinds[rows][:, None]
+
+            p = a + b - c
+            pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+            paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+            predictor = np.select([kind == 0, kind == 1, kind == 2, kind == 3], [0, a, b, (a + b) >> 1], paeth)
+            out[rows + 1, cols + 1] = (source[rows, cols] + predictor) & 0xFF
+
+        return out[1:, 1:].reshape(count, self.row_bytes).astype(np.uint8)
+
+    def _samples(self, rows: np.ndarray) -> np.ndarray:
+        # (n, width, canali) a 8 bit (o indici di palette)
+        count = rows.shape[0]
+        if self.depth == 16:
+            # Si tiene il byte alto
+            return rows.reshape(count, self.width, self.channels, 2)[..., 0]
+        if self.depth == 8:
+            return rows.reshape(count, self.width, self.channels)
+
+        bits = np.unpackbits(rows, axis=1)[:, :self.width * self.depth].reshape(count, self.width, self.depth)
+        weights = (1 << np.arange(self.depth - 1, -1, -1)).astype(np.uint8)
+        values = (bits * weights).sum(axis=2, dtype=np.uint8)
+        if self.color_type == 0:
+            values = values * (255 // ((1 << self.depth) - 1))
+        return values[:, :, None].astype(np.uint8)
+
+    def _to_argb(self, rows: np.ndarray) -> np.ndarray:
+        samples = self._samples(rows)
+        if self.color_type == 3:
+            return self.lut[samples[..., 0]]
+
+        opaque = np.full(samples.shape[:2], 255, dtype=np.uint8)
+        if self.color_type == 0:
+            gray = samples[..., 0]
+            pixels = _argb(gray, gray, gray, opaque)
+        elif self.color_type == 4:
+            gray = samples[..., 0]
+            pixels = _argb(gray, gray, gray, samples[..., 1])
+        elif self.color_type == 2:
+            pixels = _argb(samples[..., 0], samples[..., 1], samples[..., 2], opaque)
+        else:
+            pixels = _argb(samples[..., 0], samples[..., 1], samples[..., 2], samples[..., 3])
+
+        if self.transparent is not None:
+            # Confronto sui valori scalati a 8 bit, come i campioni
+            shift = 8 if self.depth == 16 else 0
+            key = [value >> shift for value in self.transparent]
+            if self.color_type == 0 and self.depth < 8:
+                key = [key[0] * (255 // ((1 << self.depth) - 1))]
+            match = np.all(samples[..., :len(key)] == np.array(key, dtype=np.uint8), axis=2)
+            pixels[match] &= np.uint32(0x00FFFFFF)
+        return pixels
+
+
+def png_scanlines(pixels: np.ndarray, channels: int = 4) -> bytes:
+    # Righe PNG (RGB o RGBA) da (n, width) uint32 ARGB non premoltiplicato, con filtro Sub su tutte le righe:
+    # le aree a tinta unita si comprimono quasi a zero
+    count, width = pixels.shape
+    samples = np.empty((count, width, channels), dtype=np.uint8)
+    samples[..., 0] = pixels >> 16
+    samples[..., 1] = pixels >> 8
+    samples[..., 2] = pixels
+    if channels == 4:
+        samples[..., 3] = pixels >> 24
+
+    raw = np.empty((count, 1 + width * channels), dtype=np.uint8)
+    raw[:, 0] = 1
+    line = samples.reshape(count, -1)
+    raw[:, 1:1 + channels] = line[:, :channels]
+    np.subtract(line[:, channels:], line[:, :-channels], out=raw[:, 1 + channels:])
+    return raw.tobytes()
+
+
+class PngRowWriter:
+    # Scrive un PNG a 8 bit a righe (RGB, RGBA o indicizzato): compressione zlib incrementale, nessuna immagine intera.
+    # Con palette (ARGB uint32, al massimo 256 colori) il PNG è indicizzato e write_rows vuole gli indici uint8
+    def __init__(self, path: str, width: int, height: int, alpha: bool = True, level: int = 6, palette=None):
+        self.width, self.height = width, height
+        self.channels = 4 if alpha else 3
+        self.indexed = palette is not None
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(level)
+        # Si scrive su path.tmp e si rinomina solo a PNG completo: un errore o un annullamento
+        # non lascia mai a metà il file di destinazione (es. l'atlas che si sta risalvando)
+        self.path, self.tmp_path = path, path + ".tmp"
+        self.file = open(self.tmp_path, "wb")
+        try:
+            self.file.write(PNG_SIGNATURE)
+            color_type = 3 if self.indexed else (6 if alpha else 2)
+            self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+            if self.indexed:
+                self._write_palette(np.asarray(palette, dtype=np.uint32))
+        except Exception:
+            self.discard()
+            raise
+
+    def _write_palette(self, palette: np.ndarray):
+        if not 0 < len(palette) <= 256:
+            raise ValueError(f"Palette PNG non valida: {len(palette)} colori")
+        rgb = np.empty((len(palette), 3), dtype=np.uint8)
+        rgb[:, 0] = palette >> 16
+        rgb[:, 1] = palette >> 8
+        rgb[:, 2] = palette
+        self._chunk(b"PLTE", rgb.tobytes())
+
+        # tRNS solo fino all'ultima voce non opaca
+        alpha = (palette >> 24).astype(np.uint8)
+        translucent = np.flatnonzero(alpha != 255)
+        if translucent.size:
+            self._chunk(b"tRNS", alpha[:translucent[-1] + 1].tobytes())
+
+    def _chunk(self, chunk_type: bytes, data: bytes):
+        self.file.write(png_chunk(chunk_type, data))
+
+    def write_rows(self, pixels: np.ndarray):
+        # pixels: (n, width) uint32 ARGB non premoltiplicato, oppure uint8 indici di palette
+        count = pixels.shape[0]
+        if self.indexed:
+            # Nessun filtro: sugli indici di palette i filtri peggiorano la compressione
+            raw = np.zeros((count, 1 + self.width), dtype=np.uint8)
+            raw[:, 1:] = pixels
+            raw = raw.tobytes()
+        else:
+            raw = png_scanlines(pixels, self.channels)
+
+        data = self.compressor.compress(raw)
+        if data:
+            self._chunk(b"IDAT", data)
+        self.rows_written += count
+
+    def close(self):
+        if self.file.closed:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"PNG incompleto: {self.rows_written} righe su {self.height}")
+            self._chunk(b"IDAT", self.compressor.flush())
+            self._chunk(b"IEND", b"")
+            self.file.close()
+            os.replace(self.tmp_path, self.path)
+        except Exception:
+            self.discard()
+            raise
+
+    def discard(self):
+        # Abbandona la scrittura: il file di destinazione resta quello di prima
+        self.file.close()
+        remove_partial(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class ClipRectReader:
+    # Formati il cui plugin Qt sa decodificare solo un rettangolo (es. JPEG)
+    def __init__(self, path: str):
+        self.path = path
+        size = QImageReader(path).size()
+        self.width, self.height = size.width(), size.height()
+        self.row = 0
+
+    def read_rows(self, count: int) -> np.ndarray:
+        count = min(count, self.height - self.row)
+        if count <= 0:
+            return np.zeros((0, self.width), dtype=np.uint32)
+        reader = QImageReader(self.path)
+        reader.setClipRect(QRect(0, self.row, self.width, count))
+        image = reader.read()
+        if image.isNull():
+            raise ValueError(reader.errorString())
+        self.row += count
+        return qimage_to_array(image)
+
+    def close(self):
+        pass
+
+
+class FullImageReader:
+    # Ultima risorsa: l'immagine intera in memoria, restituita a bande
+    def __init__(self, path: str):
+        reader = QImageReader(path)
+        image = reader.read()
+        if image.isNull():
+            raise ValueError(reader.errorString())
+        self.array = qimage_to_array(to_argb32(image))
+        self.height, self.width = self.array.shape
+        self.row = 0
+
+    def read_rows(self, count: int) -> np.ndarray:
+        rows = self.array[self.row:self.row + count]
+        self.row += rows.shape[0]
+        return rows
+
+    def close(self):
+        self.array = None
+
+
+def open_band_reader(path: str, full_decode_limit: int = FULL_DECODE_LIMIT):
+    # Fogli piccoli: decodifica Qt in un colpo. Fogli grandi: il lettore più economico in memoria
+    # per il formato, PNG a righe o clip rect Qt; immagine intera solo se non c'è alternativa
+    reader = QImageReader(path)
+    size = reader.size()
+    if size.isValid() and size.width() * size.height() * 4 <= full_decode_limit:
+        return FullImageReader(path)
+    try:
+        return PngRowReader(path)
+    except UnsupportedStream:
+        pass
+    if reader.supportsOption(QImageIOHandler.ClipRect):
+        return ClipRectReader(path)
+    return FullImageReader(path)
+
+
+def band_tiles(band: np.ndarray, tile_size: int) -> np.ndarray:
+    # Banda alta tile_size * k righe -> (k, colonne, tile_size, tile_size), bordi completati trasparenti
+    band = pad_to_multiple(band, tile_size)
+    rows, cols = band.shape[0] // tile_size, band.shape[1] // tile_size
+    return band.reshape(rows, tile_size, cols, tile_size).swapaxes(1, 2)
+
+
+def split_sheet(path: str, tile_size: int, out_dir: str, job=None, prefix: str = None,
+                skip_empty: bool = True, skip_duplicates: bool = True, band_bytes: int = BAND_BYTES,
+                full_decode_limit: int = FULL_DECODE_LIMIT) -> dict:
+    # Estrae tutti i tile del foglio leggendo a bande di righe di tile: il picco di memoria dipende dalla
+    # banda, non dal foglio. Ogni tile viene scritto appena estratto.
+    prefix = prefix or os.path.splitext(os.path.basename(path))[0]
+    summary = {"saved": [], "empty": 0, "duplicates": 0}
+    seen = set()
+
+    reader = open_band_reader(path, full_decode_limit)
+    try:
+        band_rows = tile_size * max(1, band_bytes // max(1, reader.width * 4 * tile_size))
+        for top in range(0, reader.height, band_rows):
+            if job is not None:
+                job.check()
+            tiles = band_tiles(reader.read_rows(band_rows), tile_size)
+            empty = ((tiles >> 24) == 0).all(axis=(2, 3)) if skip_empty else np.zeros(tiles.shape[:2], dtype=bool)
+
+            for row, col in np.ndindex(*tiles.shape[:2]):
+                if empty[row, col]:
+                    summary["empty"] += 1
+                    continue
+                tile = np.ascontiguousarray(tiles[row, col])
+                if skip_duplicates:
+                    digest = hashlib.blake2b(tile.tobytes(), digest_size=16).digest()
+                    if digest in seen:
+                        summary["duplicates"] += 1
+                        continue
+                    seen.add(digest)
+
+                y = top // tile_size + row
+                tile_path = os.path.join(out_dir, f"{prefix}_{y:04d}_{col:04d}.png")
+                if array_to_qimage(tile).save(tile_path, "PNG"):
+                    summary["saved"].append(tile_path)
+
+            if job is not None:
+                job.report(min(top + band_rows, reader.height), reader.height)
+    finally:
+        reader.close()
+
+    return summary
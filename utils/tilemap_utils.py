@@ -0,0 +1,274 @@
+import math
+import os
+import struct
+
+import numpy as np
+
+from utils.parallel_utils import run_bands
+from utils.stream_utils import BAND_BYTES, FULL_DECODE_LIMIT, PngRowWriter, band_tiles, open_band_reader
+
+# Bit di capovolgimento dei tile: orizzontale (specchio sinistra/destra) e verticale
+FLIP_H = 1
+FLIP_V = 2
+# Nella mappa esportata: 0 = tile vuoto, altrimenti indice + 1 con i capovolgimenti nei bit alti (come Tiled)
+GID_FLIP_H = 0x80000000
+GID_FLIP_V = 0x40000000
+# Mappa binaria: magic, colonne, righe, tile_size, poi colonne * righe uint32 little endian
+BINARY_MAGIC = b"STMP"
+HASH_SEED = 0x5EED
+
+
+def _flip(tiles: np.ndarray, flips) -> np.ndarray:
+    # tiles: (..., ts, ts)
+    if flips & FLIP_H:
+        tiles = tiles[..., :, ::-1]
+    if flips & FLIP_V:
+        tiles = tiles[..., ::-1, :]
+    return tiles
+
+
+def hash_weights(tile_size: int, flips: bool) -> np.ndarray:
+    # (ts * ts, varianti) pesi uint64 dispari: hash = somma pixel * peso (mod 2^64).
+    # L'hash del tile capovolto è quello del tile con i pesi capovolti: una sola moltiplicazione per tutte le varianti
+    rng = np.random.default_rng(HASH_SEED)
+    weights = rng.integers(0, 1 << 63, (tile_size, tile_size), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    variants = range(4) if flips else range(1)
+    return np.stack([_flip(weights, f).ravel() for f in variants], axis=1)
+
+
+def _hash_band(band: np.ndarray, top: int, weights: np.ndarray, out: np.ndarray):
+    # band: (tile, ts * ts) pixel; ogni banda di tile scrive solo le proprie righe di hash
+    np.matmul(band.astype(np.uint64), weights, out=out[top:top + band.shape[0]])
+
+
+class TileStore:
+    # Tile unici in un blocco numpy che cresce raddoppiando: il confronto con i tile della banda è un solo indexing
+    def __init__(self, tile_size: int):
+        self.tiles = np.zeros((64, tile_size, tile_size), dtype=np.uint32)
+        self.count = 0
+
+    def add(self, tiles: np.ndarray) -> np.ndarray:
+        needed = self.count + len(tiles)
+        if needed > len(self.tiles):
+            grown = np.zeros((max(needed, 2 * len(self.tiles)),) + self.tiles.shape[1:], dtype=np.uint32)
+            grown[:self.count] = self.tiles[:self.count]
+            self.tiles = grown
+        self.tiles[self.count:needed] = tiles
+        ids = np.arange(self.count, needed)
+        self.count = needed
+        return ids
+
+    def array(self) -> np.ndarray:
+        return self.tiles[:self.count]
+
+
+def build_tilemap(path: str, tile_size: int, flips: bool = False, job=None, band_bytes: int = BAND_BYTES,
+                  full_decode_limit: int = FULL_DECODE_LIMIT) -> dict:
+    # Taglia l'immagine sulla griglia, a bande di righe di tile, e la riduce a tile unici + mappa di indici.
+    # I tile si confrontano per hash vettoriale (uno per variante capovolta, si tiene il minimo come chiave);
+    # ogni corrispondenza si verifica poi pixel per pixel, le collisioni passano da un dizionario esatto.
+    # Tile del tutto trasparenti: indice -1, non entrano nel tileset.
+    weights = hash_weights(tile_size, flips)
+    store = TileStore(tile_size)
+    known = {}  # chiave hash -> (id, variante del primo tile)
+    exact = {}  # bytes del tile canonico -> (id, variante), solo per le collisioni
+    index_rows, flip_rows = [], []
+
+    reader = open_band_reader(path, full_decode_limit)
+    try:
+        width, height = reader.width, reader.height
+        band_rows = tile_size * max(1, band_bytes // max(1, width * 4 * tile_size))
+        for top in range(0, height, band_rows):
+            if job is not None:
+                job.check()
+            grid = band_tiles(reader.read_rows(band_rows), tile_size)
+            rows, cols = grid.shape[:2]
+            tiles = np.ascontiguousarray(grid).reshape(rows * cols, tile_size, tile_size)
+            ids = np.full(len(tiles), -1, dtype=np.int64)
+            variant = np.zeros(len(tiles), dtype=np.uint8)
+
+            filled = np.flatnonzero(((tiles >> 24) != 0).any(axis=(1, 2)))
+            if filled.size:
+                source = tiles if filled.size == len(tiles) else tiles[filled]
+                hashes = np.empty((len(filled), weights.shape[1]), dtype=np.uint64)
+                run_bands(_hash_band, source.reshape(len(filled), -1), weights, hashes)
+                best = hashes.argmin(axis=1)
+                keys = hashes[np.arange(len(filled)), best]
+                _assign(tiles, filled, keys, best.astype(np.uint8), store, known, exact, ids, variant)
+
+            index_rows.append(ids.reshape(rows, cols))
+            flip_rows.append(variant.reshape(rows, cols))
+            if job is not None:
+                job.report(min(top + band_rows, height), height)
+    finally:
+        reader.close()
+
+    index = np.concatenate(index_rows) if index_rows else np.zeros((0, 0), dtype=np.int64)
+    flipped = np.concatenate(flip_rows) if flip_rows else np.zeros((0, 0), dtype=np.uint8)
+    used = int((index >= 0).sum())
+    return {
+        "tile_size": tile_size,
+        "tiles": store.array(),
+        "index": index,
+        "flips": flipped,
+        "source_size": (width, height),
+        "stats": {
+            "tiles": int(index.size),
+            "empty": int(index.size - used),
+            "unique": store.count,
+            "flipped": int(((flipped != 0) & (index >= 0)).sum()),
+            "ratio": used / store.count if store.count else 1.0,
+        },
+    }
+
+
+def _assign(tiles, filled, keys, best, store, known, exact, ids, variant):
+    # Variante di un tile rispetto al tile salvato: la composizione dei capovolgimenti è uno XOR dei bit
+    unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    key_ids = np.empty(len(unique_keys), dtype=np.int64)
+    key_variant = np.empty(len(unique_keys), dtype=np.uint8)
+
+    new = []
+    for position, key in enumerate(unique_keys.tolist()):
+        entry = known.get(key)
+        if entry is None:
+            new.append(position)
+        else:
+            key_ids[position], key_variant[position] = entry
+    if new:
+        new = np.array(new)
+        added = store.add(tiles[filled[first[new]]])
+        key_ids[new] = added
+        key_variant[new] = best[first[new]]
+        for position, tile_id, flips in zip(new.tolist(), added.tolist(), best[first[new]].tolist()):
+            known[unique_keys[position].item()] = (tile_id, flips)
+
+    tile_ids = key_ids[inverse]
+    flips = best ^ key_variant[inverse]
+    ids[filled] = tile_ids
+    variant[filled] = flips
+
+    # Verifica esatta: il tile deve essere il tile salvato con i capovolgimenti indicati
+    stored = store.tiles[tile_ids]
+    for f in np.unique(flips).tolist():
+        group = flips == f
+        stored[group] = _flip(stored[group], f)
+    mismatch = np.flatnonzero((stored != tiles[filled]).any(axis=(1, 2)))
+    for position in mismatch.tolist():
+        tile = tiles[filled[position]]
+        canonical = np.ascontiguousarray(_flip(tile, int(best[position]))).tobytes()
+        entry = exact.get(canonical)
+        if entry is None:
+            entry = (int(store.add(tile[None])[0]), int(best[position]))
+            exact[canonical] = entry
+        ids[filled[position]] = entry[0]
+        variant[filled[position]] = best[position] ^ entry[1]
+
+
+def tileset_columns(count: int) -> int:
+    return max(1, math.ceil(math.sqrt(count)))
+
+
+def write_tileset_png(path: str, tiles: np.ndarray, columns: int = None, job=None) -> tuple:
+    # Tile unici in griglia, una riga di tile alla volta; ritorna (colonne, righe) della griglia
+    count, tile_size = len(tiles), tiles.shape[1]
+    columns = columns or tileset_columns(count)
+    rows = max(1, math.ceil(count / columns))
+    with PngRowWriter(path, columns * tile_size, rows * tile_size) as writer:
+        for row in range(rows):
+            if job is not None:
+                job.check()
+            strip = np.zeros((columns, tile_size, tile_size), dtype=np.uint32)
+            chunk = tiles[row * columns:(row + 1) * columns]
+            strip[:len(chunk)] = chunk
+            writer.write_rows(strip.swapaxes(0, 1).reshape(tile_size, columns * tile_size))
+    return columns, rows
+
+
+def tile_gids(index: np.ndarray, flips: np.ndarray) -> np.ndarray:
+    gids = (index + 1).astype(np.uint32)
+    gids[(flips & FLIP_H) != 0] |= np.uint32(GID_FLIP_H)
+    gids[(flips & FLIP_V) != 0] |= np.uint32(GID_FLIP_V)
+    gids[index < 0] = 0
+    return gids
+
+
+def write_index_csv(path: str, index: np.ndarray, flips: np.ndarray):
+    np.savetxt(path, tile_gids(index, flips), fmt="%d", delimiter=",")
+
+
+def write_index_binary(path: str, index: np.ndarray, flips: np.ndarray, tile_size: int):
+    rows, cols = index.shape
+    with open(path, "wb") as f:
+        f.write(BINARY_MAGIC + struct.pack("<III", cols, rows, tile_size))
+        f.write(tile_gids(index, flips).astype("<u4").tobytes())
+
+
+def read_index_binary(path: str):
+    # (gids (righe, colonne) uint32, tile_size)
+    with open(path, "rb") as f:
+        header = f.read(16)
+        if header[:4] != BINARY_MAGIC:
+            raise ValueError("Mappa tile non valida")
+        cols, rows, tile_size = struct.unpack("<III", header[4:])
+        gids = np.frombuffer(f.read(cols * rows * 4), dtype="<u4").reshape(rows, cols)
+    return gids.astype(np.uint32), tile_size
+
+
+def render_tilemap(tiles: np.ndarray, gids: np.ndarray) -> np.ndarray:
+    # Ricostruisce l'immagine (righe * ts, colonne * ts) dalla mappa: per verifiche e anteprime
+    rows, cols = gids.shape
+    tile_size = tiles.shape[1]
+    index = (gids & np.uint32(0x3FFFFFFF)).astype(np.int64) - 1
+    out = np.zeros((rows * cols, tile_size, tile_size), dtype=np.uint32)
+    flat_index, flat_gids = index.ravel(), gids.ravel()
+    for flips in range(4):
+        group = (flat_index >= 0) & (((flat_gids & np.uint32(GID_FLIP_H)) != 0) == bool(flips & FLIP_H)) \
+            & (((flat_gids & np.uint32(GID_FLIP_V)) != 0) == bool(flips & FLIP_V))
+        if group.any():
+            out[group] = _flip(tiles[flat_index[group]], flips)
+    return out.reshape(rows, cols, tile_size, tile_size).swapaxes(1, 2).reshape(rows * tile_size, cols * tile_size)
+
+
+def save_tilemap(tilemap: dict, tileset_path: str, map_path: str, job=None) -> dict:
+    # Scrive tileset e mappa (CSV o binaria secondo l'estensione); ritorna il resoconto con le dimensioni dei file
+    tile_size = tilemap["tile_size"]
+    columns, rows = write_tileset_png(tileset_path, tilemap["tiles"], job=job)
+    if map_path.lower().endswith(".csv"):
+        write_index_csv(map_path, tilemap["index"], tilemap["flips"])
+    else:
+        write_index_binary(map_path, tilemap["index"], tilemap["flips"], tile_size)
+
+    stats = dict(tilemap["stats"])
+    width, height = tilemap["source_size"]
+    stats.update({
+        "columns": columns,
+        "rows": rows,
+        "map_size": tilemap["index"].shape[::-1],
+        "rgba_bytes": width * height * 4,
+        "tileset_bytes": os.path.getsize(tileset_path),
+        "map_bytes": os.path.getsize(map_path),
+    })
+    return stats
+
+
+def tileset_sprites(count: int, columns: int) -> dict:
+    # Meta atlas del tileset: un tile per sprite, nell'ordine degli indici della mappa
+    return {f"tile_{i:05d}": [i % columns, i // columns, 1, 1] for i in range(count)}
+
+
+def format_tilemap_report(stats: dict) -> str:
+    from utils.memory_utils import format_bytes
+
+    cols, rows = stats["map_size"]
+    used = stats["tiles"] - stats["empty"]
+    lines = [
+        f"Mappa {cols}x{rows}: {used} tile pieni ({stats['empty']} vuoti).",
+        f"Tile unici: {stats['unique']} (compressione {stats['ratio']:.1f}:1).",
+    ]
+    if stats["flipped"]:
+        lines.append(f"Tile riusati capovolti: {stats['flipped']}.")
+    files = stats["tileset_bytes"] + stats["map_bytes"]
+    lines.append(f"File: {format_bytes(files)} (tileset {format_bytes(stats['tileset_bytes'])} + mappa "
+                 f"{format_bytes(stats['map_bytes'])}) invece di {format_bytes(stats['rgba_bytes'])} in RGBA.")
+    return "\n".join(lines)
@@ -0,0 +1,180 @@
+import hashlib
+import os
+
+from PyQt5.QtCore import QObject, QTimer, QFileSystemWatcher, pyqtSignal
+
+from utils.controls_utils import atlas_files
+from utils.import_utils import collect_image_files, normalize_path
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20):
+    digest = hashlib.sha1()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class AssetFolderWatcher(QObject):
+    # added, modified, removed: liste di path
+    changes_detected = pyqtSignal(list, list, list)
+
+    def __init__(self, folder: str, pattern: str = "*", debounce_ms: int = 500, poll_ms: int = 3000,
+                 poll: bool = False, parent=None):
+        super().__init__(parent)
+        self.folder = folder
+        self.pattern = pattern
+        # path -> (mtime_ns, size, hash)
+        self.snapshot = {}
+        # Path segnalati dal sistema dall'ultima scansione: si ricontrollano solo quelli
+        self._dirty = set()
+        self._full_scan = False
+
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._schedule_scan)
+        self._watcher.fileChanged.connect(self._schedule_scan)
+
+        # Le modifiche arrivano a raffica mentre un file viene scritto: si aspetta che si calmino
+        self._debounce = QTimer(self)
+        self._debounce.setSingleShot(True)
+        self._debounce.setInterval(debounce_ms)
+        self._debounce.timeout.connect(self.scan)
+
+        # Polling di riserva, solo su richiesta (dischi di rete dove le notifiche non arrivano) o quando
+        # il sistema rifiuta di osservare qualche path: ogni giro rilegge tutto l'albero
+        self.polling = poll
+        self._poll = QTimer(self)
+        self._poll.setInterval(poll_ms)
+        self._poll.timeout.connect(self._schedule_full_scan)
+
+    def start(self, known=None):
+        # known: {path: hash} dei file già caricati. All'avvio basta lo stat: il contenuto si legge
+        # solo quando un file cambia (hash None = da confrontare con niente, conta come modificato)
+        known = {normalize_path(path): digest for path, digest in (known or {}).items()}
+        files = self._list_files()
+        self.snapshot = {}
+        for path in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            self.snapshot[path] = (stat.st_mtime_ns, stat.st_size, known.get(normalize_path(path)))
+        self._watch_paths()
+        if self.polling:
+            self._poll.start()
+
+    def remember(self, path: str, digest: str):
+        # Hash calcolato dall'import: evita di rileggere il file al prossimo cambio di mtime
+        previous = self.snapshot.get(path)
+        if previous is not None:
+            self.snapshot[path] = (previous[0], previous[1], digest)
+
+    def stop(self):
+        self._poll.stop()
+        self._debounce.stop()
+        watched = self._watcher.directories() + self._watcher.files()
+        if watched:
+            self._watcher.removePaths(watched)
+
+    def _schedule_scan(self, path: str):
+        self._dirty.add(path)
+        self._debounce.start()
+
+    def _schedule_full_scan(self):
+        self._full_scan = True
+        self._debounce.start()
+
+    def _list_files(self, folder: str = None, recursive: bool = True):
+        files = collect_image_files(folder or self.folder, self.pattern, recursive)
+        atlases = atlas_files(files)
+        return [path for path in files if path not in atlases]
+
+    def _watch_paths(self):
+        # Le cartelle segnalano file aggiunti, tolti o rinominati; la scrittura dentro un file arriva solo
+        # osservando il file, quindi si osservano solo quelli tenuti nello snapshot
+        dirs = {self.folder}
+        for root, subdirs, _ in os.walk(self.folder):
+            dirs.update(os.path.join(root, d) for d in subdirs)
+
+        current = set(self._watcher.directories()) | set(self._watcher.files())
+        wanted = dirs | set(self.snapshot)
+        to_add = list(wanted - current)
+        to_remove = list(current - wanted)
+        if to_remove:
+            self._watcher.removePaths(to_remove)
+        failed = self._watcher.addPaths(to_add) if to_add else []
+        if failed and not self.polling:
+            # Limite di watch del sistema o filesystem che non li supporta: si ripiega sul polling
+            print(f"[Watch] {len(failed)} path non osservabili, attivo il polling")
+            self.polling = True
+            self._poll.start()
+
+    def _candidates(self, dirty):
+        # Path da ricontrollare: i file segnalati, più il contenuto (non ricorsivo) delle cartelle segnalate.
+        # Una sottocartella nuova non ha ancora un watch: si legge per intero
+        candidates = set()
+        watched_dirs = set(self._watcher.directories())
+        for path in dirty:
+            if not os.path.isdir(path):
+                candidates.add(path)
+                continue
+            candidates.update(self._list_files(path, recursive=False))
+            candidates.update(known for known in self.snapshot if os.path.dirname(known) == path.rstrip("/\\"))
+            for entry in os.scandir(path):
+                if entry.is_dir() and entry.path not in watched_dirs:
+                    candidates.update(self._list_files(entry.path))
+        # Cartelle sparite: i loro file spariscono con loro
+        candidates.update(known for known in self.snapshot
+                          if any(known.startswith(path.rstrip("/\\") + "/") for path in dirty
+                                 if not os.path.isdir(path)))
+        return candidates
+
+    def scan(self):
+        dirty, self._dirty = self._dirty, set()
+        full, self._full_scan = self._full_scan, False
+        if full:
+            current = set(self._list_files())
+            candidates = current | set(self.snapshot)
+        else:
+            candidates = self._candidates(dirty)
+            # I file nuovi passano dal filtro degli atlas come quelli della scansione completa
+            new = [path for path in candidates if path not in self.snapshot]
+            atlases = atlas_files(new) if new else set()
+            current = {path for path in candidates if path not in atlases}
+            candidates = current
+
+        added, modified, removed = [], [], []
+        for path in sorted(candidates):
+            previous = self.snapshot.get(path)
+            try:
+                stat = os.stat(path) if path in current else None
+            except OSError:
+                stat = None
+            if stat is None:
+                if previous is not None:
+                    del self.snapshot[path]
+                    removed.append(path)
+                continue
+
+            if previous and previous[0] == stat.st_mtime_ns and previous[1] == stat.st_size:
+                continue
+
+            # mtime cambiato: si rilegge il contenuto solo per questi file
+            digest = hash_file(path)
+            if digest is None:
+                continue
+            self.snapshot[path] = (stat.st_mtime_ns, stat.st_size, digest)
+
+            if previous is None:
+                added.append(path)
+            elif previous[2] != digest:
+                modified.append(path)
+
+        if added or modified or removed or full or any(os.path.isdir(path) for path in dirty):
+            self._watch_paths()
+
+        if added or modified or removed:
+            self.changes_detected.emit(added, modified, removed)